@@ -0,0 +1,83 @@
+"""
+Cold import budget for the non-UI modules.
+
+Each module is imported in a fresh interpreter, timed, and checked for
+modules it must not drag in (Streamlit above all). Exits non-zero if any
+module is over budget or imports a forbidden module.
+
+Run from the repo root:
+    python -m benchmarks.bench_import --budget-ms 250
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must stay light enough for workers and CLI tools
+CORE_MODULES = ('rafiq_core', 'nudge_campaign', 'conversation_server', 'feature_aggregator',
+                'cohort_stats', 'training_export')
+
+# Modules none of them may import
+FORBIDDEN = ('streamlit', 'pandas', 'pyarrow', 'altair')
+
+_PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "__import__(sys.argv[1])\n"
+    "seconds = time.perf_counter() - start\n"
+    "print(json.dumps([seconds, sorted(m for m in sys.modules if m.split('.')[0] in sys.argv[2:])]))\n"
+)
+
+
+def cold_import(module):
+    """(seconds, forbidden modules loaded) for one import in a new interpreter"""
+    proc = subprocess.run(
+        [sys.executable, '-c', _PROBE, module, *FORBIDDEN],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    seconds, loaded = json.loads(proc.stdout.splitlines()[-1])
+    return seconds, ', '.join(loaded)
+
+
+def measure_imports(modules=CORE_MODULES, repeat=5):
+    """Module -> {'median', 'min', 'calls', 'forbidden'}"""
+    results = {}
+    for module in modules:
+        runs = [cold_import(module) for _ in range(repeat)]
+        timings = [seconds for seconds, _ in runs]
+        results[module] = {
+            'median': statistics.median(timings),
+            'min': min(timings),
+            'calls': repeat,
+            'forbidden': runs[0][1]
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--budget-ms', type=float, default=250,
+                        help="allowed median cold import time per module")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for module, timing in measure_imports(repeat=args.repeat).items():
+        status = 'ok'
+        if timing['forbidden']:
+            status = f"IMPORTS {timing['forbidden']}"
+        elif timing['median'] * 1e3 > args.budget_ms:
+            status = 'OVER BUDGET'
+        failed = failed or status != 'ok'
+        print(f"{module:24s} {timing['median'] * 1e3:8.1f} ms  (min {timing['min'] * 1e3:.1f})  {status}")
+
+    if failed:
+        sys.exit(1)
+    print(f"All modules import in under {args.budget_ms:g} ms")
+
+
+if __name__ == "__main__":
+    main()
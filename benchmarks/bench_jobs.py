@@ -0,0 +1,132 @@
+"""
+Job matching latency against a synthetic catalog.
+
+Writes a catalog of --rows postings, builds (or loads) its index and times
+JobIndex.match for random users.
+
+Run from the repo root:
+    python -m benchmarks.bench_jobs --rows 300000
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from job_index import JobIndex
+
+# Per industry: job titles and the skills postings ask for, most common first
+INDUSTRY_JOBS = {
+    'Data Analytics': (
+        ['Data Analyst', 'Senior Data Analyst', 'Analytics Engineer', 'BI Developer',
+         'Data Scientist', 'Analytics Manager'],
+        ['SQL', 'Python', 'Excel', 'Tableau', 'Power BI', 'Statistics', 'Data Visualization',
+         'Machine Learning', 'dbt', 'Snowflake', 'Looker', 'A/B Testing', 'R', 'Spark',
+         'Data Modeling', 'Communication']),
+    'Software Engineering': (
+        ['Backend Engineer', 'Frontend Engineer', 'Full Stack Developer', 'DevOps Engineer',
+         'Senior Software Engineer', 'Platform Engineer'],
+        ['Python', 'JavaScript', 'Git', 'SQL', 'React', 'TypeScript', 'Node.js', 'AWS', 'Docker',
+         'Kubernetes', 'CI/CD', 'Go', 'REST APIs', 'System Design', 'Terraform', 'Agile']),
+    'Marketing': (
+        ['Digital Marketing Specialist', 'Content Manager', 'SEO Specialist',
+         'Growth Marketer', 'Social Media Manager', 'Marketing Manager'],
+        ['Social Media', 'Content Marketing', 'SEO', 'Google Analytics', 'Copywriting',
+         'Email Marketing', 'CRM', 'HubSpot', 'A/B Testing', 'Performance Marketing',
+         'Marketing Automation', 'Canva', 'Brand Strategy', 'TikTok Ads', 'Data Analysis',
+         'Arabic Copywriting']),
+    'Finance': (
+        ['Financial Analyst', 'Senior Accountant', 'FP&A Analyst', 'Finance Manager',
+         'Credit Analyst', 'Internal Auditor'],
+        ['Excel', 'Accounting', 'Financial Modeling', 'Budgeting', 'Forecasting', 'IFRS',
+         'SAP', 'Power BI', 'SQL', 'Risk Management', 'Valuation', 'VBA', 'Audit', 'Python',
+         'CFA', 'Bloomberg']),
+    'Project Management': (
+        ['Project Manager', 'Program Manager', 'Scrum Master', 'Delivery Manager',
+         'PMO Analyst', 'Senior Project Manager'],
+        ['Agile', 'Scrum', 'Stakeholder Management', 'Jira', 'Risk Management', 'PMP',
+         'Communication', 'Budgeting', 'MS Project', 'Kanban', 'Confluence', 'Leadership',
+         'Change Management', 'Prince2', 'Vendor Management', 'Power BI'])
+}
+
+COMPANIES = ['DataCo', 'TechCorp', 'FinanceHub', 'Noon', 'Careem', 'Talabat', 'Emirates NBD',
+             'Majid Al Futtaim', 'Aramex', 'Property Finder', 'Bayut', 'Kitopi', 'Tabby',
+             'Anghami', 'Fetchr', 'STC', 'ADNOC Digital', 'G42', 'Dubizzle', 'Mashreq']
+
+LOCATIONS = ['Remote', 'Hybrid - Dubai', 'On-site - Dubai', 'Hybrid - Abu Dhabi',
+             'On-site - Riyadh', 'Remote (GCC)']
+
+HIGHLIGHTS = ['Own reporting for a product line end to end', 'Partner with cross-functional teams',
+              'Build and maintain core services', 'Mentor junior team members',
+              'Present findings to senior leadership', 'Improve processes and tooling',
+              'Drive quarterly planning', 'Work directly with customers']
+
+
+def synthetic_catalog(path, rows, seed=0, now=None):
+    """Write `rows` random postings over the last 30 days to path"""
+    rng = np.random.default_rng(seed)
+    now = time.time() if now is None else now
+    industries = list(INDUSTRY_JOBS)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(rows):
+            industry = industries[rng.integers(len(industries))]
+            titles, skills = INDUSTRY_JOBS[industry]
+            popularity = 1 / np.arange(1, len(skills) + 1) ** 0.7
+            picked = rng.choice(len(skills), size=rng.integers(4, 9), replace=False,
+                                p=popularity / popularity.sum())
+            required = [skills[j] for j in picked[:-1]]
+            low = int(rng.integers(6, 20)) * 5
+            f.write(json.dumps({
+                'id': f'j{i}',
+                'title': titles[rng.integers(len(titles))],
+                'company': COMPANIES[rng.integers(len(COMPANIES))],
+                'industry': industry,
+                'skills': required,
+                'optional': [skills[picked[-1]]],
+                'posted': int(now - rng.uniform(0, 30) * 86400),
+                'min_years': int(rng.integers(1, 9)),
+                'salary': f'${low}K-{low + int(rng.integers(2, 7)) * 5}K',
+                'location': LOCATIONS[rng.integers(len(LOCATIONS))],
+                'highlights': [HIGHLIGHTS[j] for j in rng.choice(len(HIGHLIGHTS), 3, replace=False)]
+            }) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=300_000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'catalog.jsonl')
+    synthetic_catalog(path, args.rows, args.seed)
+
+    start = time.perf_counter()
+    JobIndex.from_file(path)
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    index = JobIndex.from_file(path)
+    load_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(args.seed + 1)
+    timings = []
+    for _ in range(args.queries):
+        industry = list(INDUSTRY_JOBS)[rng.integers(len(INDUSTRY_JOBS))]
+        skills = INDUSTRY_JOBS[industry][1]
+        user_skills = [skills[j] for j in rng.choice(len(skills), rng.integers(1, 10), replace=False)]
+        start = time.perf_counter()
+        index.match(user_skills, industry, k=3)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    print(f"postings:      {index.rows:,}")
+    print(f"index build:   {build_seconds:8.2f}s   reload: {load_seconds * 1e3:.1f} ms")
+    print(f"match p50:     {statistics.median(timings) * 1e3:8.2f} ms")
+    print(f"match p99:     {timings[int(len(timings) * 0.99)] * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
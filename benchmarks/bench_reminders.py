@@ -0,0 +1,91 @@
+"""
+Reminder scheduler throughput.
+
+Schedules --count reminders due over the coming week (one at a time, then
+the same number in batches), cancels a tenth of them, reopens the
+directory as a restart would and fires everything.
+
+Run from the repo root:
+    python -m benchmarks.bench_reminders --count 10000000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from reminders import ReminderScheduler
+
+WEEK = 7 * 86400
+
+
+def reminder_throughput(count, directory=None, seed=0, batch_size=10000):
+    """Seconds per reminder for each operation, plus the restart time in seconds"""
+    temporary = directory is None
+    directory = directory or tempfile.mkdtemp(prefix='rafiq_reminders_')
+    rng = np.random.default_rng(seed)
+    now = time.time()
+    due = (now + rng.uniform(0, WEEK, count)).tolist()
+    timings = {}
+    try:
+        scheduler = ReminderScheduler(directory)
+        start = time.perf_counter()
+        ids = [scheduler.schedule(d, session_id=f'0.s{i}', flow='refresh_cv')
+               for i, d in enumerate(due)]
+        timings['schedule'] = (time.perf_counter() - start) / count
+
+        start = time.perf_counter()
+        for lo in range(0, count, batch_size):
+            scheduler.schedule_many(
+                (d, {'session_id': f'0.b{lo + i}', 'flow': 'refresh_cv'})
+                for i, d in enumerate(due[lo:lo + batch_size]))
+        timings['schedule_many'] = (time.perf_counter() - start) / count
+
+        cancelled = [ids[i] for i in rng.choice(count, count // 10, replace=False).tolist()]
+        start = time.perf_counter()
+        for reminder_id in cancelled:
+            scheduler.cancel(reminder_id)
+        timings['cancel'] = (time.perf_counter() - start) / max(len(cancelled), 1)
+        scheduler.close()
+
+        start = time.perf_counter()
+        scheduler = ReminderScheduler(directory)
+        timings['reopen_seconds'] = time.perf_counter() - start
+
+        fired = 0
+
+        def fire(reminders):
+            nonlocal fired
+            fired += len(reminders)
+
+        start = time.perf_counter()
+        scheduler.run_due(fire, now=now + WEEK + 3600, batch_size=batch_size)
+        timings['fire'] = (time.perf_counter() - start) / max(fired, 1)
+        timings['fired'] = fired
+        scheduler.close()
+    finally:
+        if temporary:
+            shutil.rmtree(directory, ignore_errors=True)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=1_000_000)
+    parser.add_argument('--dir', help="empty directory to schedule into (default: a temporary one)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.dir:
+        os.makedirs(args.dir, exist_ok=True)
+    timings = reminder_throughput(args.count, args.dir, args.seed)
+    print(f"reminders:      {args.count:,} scheduled twice, {args.count // 10:,} cancelled")
+    for op in ('schedule', 'schedule_many', 'cancel', 'fire'):
+        print(f"{op + ':':15s} {timings[op] * 1e6:8.2f} us   ({1 / timings[op]:12,.0f} /s)")
+    print(f"reopen:         {timings['reopen_seconds'] * 1e3:8.1f} ms   (fired {timings['fired']:,})")
+
+
+if __name__ == "__main__":
+    main()
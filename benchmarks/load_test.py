@@ -0,0 +1,419 @@
+"""
+Concurrent-session load test and transcript replay.
+
+Simulated users each open a session, start a random flow and click random
+offered buttons until the conversation ends, sometimes following a flow
+switch or starting another nudge. On the skill grid they pick 5-7 skills
+and submit. With --replay, recorded transcripts are played back instead,
+keeping their original pacing divided by --speedup.
+
+Transcripts are JSONL, one request per line, as written by
+`conversation_server.py --transcript FILE` or by --record here:
+
+    {"ts": 1760000000.0, "session_id": "0.abc", "action": "create", "body": {"user_id": ...}}
+    {"ts": 1760000003.2, "session_id": "0.abc", "action": "respond", "body": {"response": ...}}
+
+Two targets:
+    server   a local conversation_server, spawned on a free port unless
+             --url points at a running one
+    apptest  the Streamlit app itself, one AppTest per session. AppTest
+             swaps in a process-wide runtime for every run, so runs of
+             different sessions take turns on one worker thread
+
+Reports latency percentiles per action, throughput, errors and memory per
+session: resident memory growth of the spawned server (or, for apptest,
+of this process) divided by the sessions opened.
+
+Run from the repo root:
+    python -m benchmarks.load_test --users 2000 --concurrency 500
+    python -m benchmarks.load_test --replay transcripts.jsonl --speedup 20
+    python -m benchmarks.load_test --target apptest --users 20 --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from rafiq_core import MIN_SKILLS_SELECTED, NUDGES, USER_PAGE_SIZE, open_profile_store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Sidebar buttons that start each flow in the app
+FLOW_BUTTONS = {
+    'refresh_cv': '🔄 Refresh CV Nudge',
+    'add_skill': '⚡ Add Skills Nudge',
+    'apply_job': '📋 Apply to Jobs Nudge'
+}
+
+
+class TargetError(Exception):
+    pass
+
+
+def resident_memory(pid='self'):
+    """Resident set size of a process in bytes, or None where /proc is unavailable"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+class ServerTarget:
+    """A conversation_server reached over HTTP, one request per connection"""
+
+    def __init__(self, url=None, max_connections=512):
+        self.process = None
+        if url is None:
+            with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                port = s.getsockname()[1]
+            self.process = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, 'conversation_server.py'), '--port', str(port)],
+                cwd=ROOT)
+            url = f'http://127.0.0.1:{port}'
+        host_port = url.split('://', 1)[-1].rstrip('/')
+        self.host, _, port = host_port.partition(':')
+        self.port = int(port or 80)
+        self._connections = asyncio.Semaphore(max_connections)
+
+    async def start(self):
+        for _ in range(100):
+            try:
+                await self.request('GET', '/health')
+                return
+            except OSError:
+                await asyncio.sleep(0.1)
+        raise TargetError(f"No server at {self.host}:{self.port}")
+
+    def memory(self):
+        return resident_memory(self.process.pid) if self.process else None
+
+    async def request(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        async with self._connections:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                writer.write(
+                    f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: close\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                response = await reader.read()
+            finally:
+                writer.close()
+        head, _, payload = response.partition(b'\r\n\r\n')
+        result = json.loads(payload)
+        if head.split(b' ', 2)[1] != b'200':
+            raise TargetError(result.get('error', head.split(b'\r\n', 1)[0].decode('latin-1')))
+        return result
+
+    async def create(self, user_id):
+        return await self.request('POST', '/sessions', {'user_id': user_id})
+
+    async def act(self, session_id, action, body):
+        if action == 'state':
+            return await self.request('GET', f'/sessions/{session_id}')
+        return await self.request('POST', f'/sessions/{session_id}/{action}', body)
+
+    async def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+
+
+class AppTestTarget:
+    """The Streamlit app through AppTest; each session is one AppTest"""
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(1)
+        self._apps = {}
+        self._profiles = open_profile_store()
+
+    async def start(self):
+        pass
+
+    def memory(self):
+        return resident_memory()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    @staticmethod
+    def _state(session_id, at):
+        if at.exception:
+            raise TargetError(at.exception[0].message)
+        buttons = [b for b in at.main.button if b.key and b.key.startswith(('btn_', 'skill_'))]
+        return {
+            'session_id': session_id,
+            'step': 'show_skills' if any(b.key.startswith('skill_') for b in buttons) else None,
+            'buttons': [b.label for b in buttons],
+            'skills_selected': [b.label for b in buttons
+                                if b.key.startswith('skill_') and b.proto.type == 'primary']
+        }
+
+    @staticmethod
+    def _click(at, label, sidebar=False):
+        # After a fragment rerun AppTest only holds that fragment's
+        # elements; a browser would still show the rest of the page
+        for refresh in (False, True):
+            if refresh:
+                at.run()
+            for button in (at.sidebar.button if sidebar else at.main.button):
+                if button.label == label:
+                    button.click().run()
+                    return
+        raise TargetError(f"No button {label!r}")
+
+    def _create(self, user_id):
+        from streamlit.testing.v1 import AppTest
+        at = AppTest.from_file(os.path.join(ROOT, 'rafiq_demo1.py'), default_timeout=60).run()
+        # The user picker lists one page of users at a time
+        if at.sidebar.number_input:
+            page = self._profiles.row_of(user_id) // USER_PAGE_SIZE + 1
+            at.sidebar.number_input(key='user_page').set_value(page).run()
+        at.sidebar.selectbox[0].set_value(user_id).run()
+        self._click(at, 'Load User Profile', sidebar=True)
+        session_id = at.session_state.session_id
+        self._apps[session_id] = at
+        return self._state(session_id, at)
+
+    def _act(self, session_id, action, body):
+        at = self._apps[session_id]
+        if action == 'start':
+            self._click(at, FLOW_BUTTONS[body.get('flow') or NUDGES[0]], sidebar=True)
+        elif action in ('respond', 'toggle_skill'):
+            self._click(at, body.get('response') or body.get('skill'))
+        elif action == 'submit_skills':
+            self._click(at, '✅ Add These Skills')
+        elif action == 'reset':
+            self._click(at, '🔄 Reset Conversation', sidebar=True)
+        else:
+            at.run()
+        return self._state(session_id, at)
+
+    async def create(self, user_id):
+        return await self._run(self._create, user_id)
+
+    async def act(self, session_id, action, body):
+        return await self._run(self._act, session_id, action, body)
+
+    async def stop(self):
+        self._pool.shutdown()
+
+
+class LoadStats:
+    """Latencies per action, errors and session counts"""
+
+    def __init__(self, record=None):
+        self.latencies = {}
+        self.errors = {}
+        self.sessions = 0
+        self.active = self.peak_active = 0
+        self._record = record
+        self._ids = {}      # target session id -> id written to the transcript
+
+    async def call(self, target, action, session_id=None, body=None):
+        """One request, timed; returns the new state or None on error"""
+        start = time.perf_counter()
+        try:
+            if action == 'create':
+                state = await target.create(body['user_id'])
+            else:
+                state = await target.act(session_id, action, body or {})
+        except (TargetError, OSError, ValueError) as e:
+            self.errors[type(e).__name__] = self.errors.get(type(e).__name__, 0) + 1
+            return None
+        self.latencies.setdefault(action, []).append(time.perf_counter() - start)
+        if self._record:
+            session_id = session_id or state['session_id']
+            self._record.write(json.dumps({
+                'ts': time.time(),
+                'session_id': self._ids.setdefault(session_id, f'load.{len(self._ids)}'),
+                'action': action,
+                'body': body or {}
+            }) + '\n')
+        return state
+
+    def opened(self):
+        self.sessions += 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+
+    def closed(self):
+        self.active -= 1
+
+
+async def walk(target, stats, rng, user_ids, think, max_turns=30):
+    """One simulated user: random flows and buttons until the conversation ends"""
+    state = await stats.call(target, 'create', body={'user_id': rng.choice(user_ids)})
+    if state is None:
+        return
+    session_id = state['session_id']
+    stats.opened()
+    try:
+        for _ in range(rng.randint(1, 3)):
+            state = await stats.call(target, 'start', session_id, {'flow': rng.choice(NUDGES)})
+            for _ in range(max_turns):
+                if state is None or not state['buttons']:
+                    break
+                await asyncio.sleep(rng.expovariate(1 / think) if think else 0)
+                if state['step'] == 'show_skills':
+                    # Top the selection up to 5-7 skills; skills picked on an
+                    # earlier pass through the flow are still selected
+                    selected = state['skills_selected']
+                    offered = [b for b in state['buttons'] if b not in selected]
+                    wanted = rng.randint(MIN_SKILLS_SELECTED, 7) - len(selected)
+                    if len(selected) + len(offered) < MIN_SKILLS_SELECTED:
+                        break       # too few skills offered to submit, as in the app
+                    picks = rng.sample(offered, min(max(wanted, 0), len(offered)))
+                    for skill in picks:
+                        state = await stats.call(target, 'toggle_skill', session_id, {'skill': skill})
+                    state = await stats.call(target, 'submit_skills', session_id)
+                else:
+                    state = await stats.call(target, 'respond', session_id,
+                                             {'response': rng.choice(state['buttons'])})
+    finally:
+        stats.closed()
+
+
+async def simulate(target, stats, users, concurrency, think, ramp, seed):
+    rng = random.Random(seed)
+    user_ids = list(islice(open_profile_store(), 10000))
+    slots = asyncio.Semaphore(concurrency)
+
+    async def user(i):
+        await asyncio.sleep(ramp * i / users)
+        async with slots:
+            await walk(target, stats, random.Random(rng.random()), user_ids, think)
+
+    await asyncio.gather(*(user(i) for i in range(users)))
+
+
+def read_transcripts(path):
+    """Recorded sessions: session id -> [(ts, action, body)] in time order"""
+    sessions = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                sessions.setdefault(event['session_id'], []).append(
+                    (event['ts'], event['action'], event.get('body') or {}))
+    for events in sessions.values():
+        events.sort(key=lambda e: e[0])
+    return sessions
+
+
+async def replay(target, stats, path, speedup):
+    sessions = read_transcripts(path)
+    if not sessions:
+        raise SystemExit(f"No requests in {path}")
+    first = min(events[0][0] for events in sessions.values())
+    started = time.perf_counter()
+    lag = []
+
+    async def play(events):
+        session_id = None
+        for ts, action, body in events:
+            delay = started + (ts - first) / speedup - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lag.append(max(-delay, 0))
+            if action == 'create':
+                state = await stats.call(target, 'create', body=body)
+                if state is None:
+                    return
+                session_id = state['session_id']
+                stats.opened()
+            elif session_id is not None:
+                await stats.call(target, action, session_id, body)
+        if session_id is not None:
+            stats.closed()
+
+    await asyncio.gather(*(play(events) for events in sessions.values()))
+    return lag
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+def report(stats, seconds, memory_growth, lag=None):
+    requests = sum(len(v) for v in stats.latencies.values())
+    print(f"sessions:      {stats.sessions:,} (peak {stats.peak_active:,} concurrent)")
+    print(f"requests:      {requests:,} in {seconds:.1f}s = {requests / seconds:,.0f}/s, "
+          f"errors: {sum(stats.errors.values())} {stats.errors or ''}")
+    if memory_growth is not None and stats.sessions:
+        print(f"memory:        {memory_growth / 2 ** 20:.1f} MiB grown, "
+              f"{memory_growth / stats.sessions / 1024:.1f} KiB per session")
+    if lag:
+        print(f"replay lag:    p50 {statistics.median(lag) * 1e3:.1f} ms, max {max(lag) * 1e3:.1f} ms")
+    print(f"{'latency (ms)':16s} {'count':>8s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s}")
+    rows = dict(stats.latencies)
+    rows['all'] = [t for v in stats.latencies.values() for t in v]
+    for action, timings in rows.items():
+        if timings:
+            timings = sorted(timings)
+            print(f"{action:16s} {len(timings):8d} " + ' '.join(
+                f"{percentile(timings, q) * 1e3:8.2f}" for q in (0.5, 0.9, 0.99, 1.0)))
+
+
+async def run(args):
+    if args.target == 'apptest':
+        target = AppTestTarget()
+    else:
+        target = ServerTarget(args.url, args.max_connections)
+    record = open(args.record, 'w', encoding='utf-8') if args.record else None
+    stats = LoadStats(record)
+    lag = None
+    try:
+        await target.start()
+        memory_before = target.memory()
+        start = time.perf_counter()
+        if args.replay:
+            lag = await replay(target, stats, args.replay, args.speedup)
+        else:
+            await simulate(target, stats, args.users, args.concurrency, args.think,
+                           args.ramp, args.seed)
+        seconds = time.perf_counter() - start
+        memory_after = target.memory()
+    finally:
+        await target.stop()
+        if record:
+            record.close()
+    growth = memory_after - memory_before if memory_before is not None and memory_after else None
+    report(stats, seconds, growth, lag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--target', choices=('server', 'apptest'), default='server')
+    parser.add_argument('--url', help="running server to test instead of spawning one")
+    parser.add_argument('--users', type=int, default=1000, help="simulated users in total")
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help="users with a conversation in progress at once")
+    parser.add_argument('--think', type=float, default=0.5,
+                        help="mean seconds a user waits before each click")
+    parser.add_argument('--ramp', type=float, default=5.0, help="seconds over which users arrive")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', help="transcript JSONL to replay instead of random walks")
+    parser.add_argument('--speedup', type=float, default=1.0, help="replay this many times faster")
+    parser.add_argument('--record', help="write the requests made as a transcript")
+    parser.add_argument('--max-connections', type=int, default=512,
+                        help="open connections to the server at once")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Rafiq performance suite.
+
+Times cold imports of the non-UI modules, model scoring (single profiles,
+synthetic populations and what-if grids), job matching, reminder
+scheduling and firing, cohort aggregation over a profile store, message
+rendering for every flow step, dispatch for every button, and full app
+reruns driven headlessly through Streamlit's AppTest. Results are written
+as JSON; with --compare they are checked against a stored baseline and
+the run fails if anything got slower than the allowed threshold.
+
+Run from the repo root:
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --output new.json --compare bench.json --threshold 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+from benchmarks.bench_import import measure_imports
+from benchmarks.bench_jobs import synthetic_catalog
+from benchmarks.bench_reminders import reminder_throughput
+from benchmarks.bench_scoring import synthetic_population
+from cohort_stats import CohortStats, aggregate_store
+from job_index import JobIndex
+from profile_store import ProfileStore, write_profile_store
+from rafiq_core import (
+    JOB_MATCHES,
+    MODEL_FEATURES,
+    NUDGES,
+    NUMERIC_PROFILE_FIELDS,
+    STEP_FIELDS,
+    TEST_USERS,
+    WHAT_IF_AXES,
+    ConversationSession,
+    batch_ml_prediction,
+    complete_reply,
+    format_message,
+    handle_user_response,
+    mock_ml_prediction,
+    open_catalog,
+    open_job_index,
+    user_skills,
+    what_if_grid,
+    what_if_slice,
+)
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rafiq_demo1.py')
+
+# Values for the fields STEP_FIELDS adds on top of the profile
+STEP_FIELD_VALUES = {
+    'confidence': 45,
+    'years': 6,
+    'new_completeness': 83,
+    'improvement': 15,
+    'old_skills': 3,
+    'new_skills': 8,
+    'skills_added': 5,
+    'job_list': '**1. Senior Data Analyst at DataCo**\nMatch: 92% | Posted: 1 day ago',
+    'job_title': 'Senior Data Analyst',
+    'company': 'DataCo',
+    'highlights': '• Lead analytics for product launches',
+    'requirements': '✅ Python - You have this  \n⚠️ Hadoop - Nice to have (optional)',
+    'match': 92,
+    'location': 'Remote',
+    'salary': '$95K-115K',
+    'posted': '1 day ago',
+    'gap_summary': "You're missing only 1 optional skill",
+    'gap': 'Hadoop is listed as "nice to have", not required.',
+    'skills_have': 11,
+    'skills_total': 12,
+    'min_years': 5
+}
+
+
+def measure(fn, repeat=5, min_time=0.05):
+    """
+    Per-call timings of fn: the call count is grown until one repeat takes
+    at least min_time, then the repeat is done `repeat` times.
+    """
+    timer = timeit.Timer(fn)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 10
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {'median': statistics.median(runs), 'min': min(runs), 'calls': number * repeat}
+
+
+def bench_imports(results):
+    for module, timing in measure_imports().items():
+        results[f'import.{module}'] = timing
+
+
+def bench_scoring(results, sizes):
+    for user_id, profile in TEST_USERS.items():
+        results[f'scoring.single.{user_id}'] = measure(lambda: mock_ml_prediction(profile))
+
+    for size in sizes:
+        columns = synthetic_population(size)
+        results[f'scoring.batch.{size}'] = measure(lambda: batch_ml_prediction(columns), repeat=3)
+
+    # The per-profile loop, for comparison with the batch path
+    columns = synthetic_population(1000)
+    profiles = [dict(zip(columns, row)) for row in zip(*(c.tolist() for c in columns.values()))]
+    results['scoring.loop.1000'] = measure(lambda: [mock_ml_prediction(p) for p in profiles], repeat=3)
+
+
+def bench_what_if(results):
+    """Scoring a profile's what-if grid once, then the slices one slider move takes"""
+    for user_id, profile in TEST_USERS.items():
+        results[f'what_if.grid.{user_id}'] = measure(
+            lambda: what_if_grid(batch_ml_prediction, MODEL_FEATURES, profile), repeat=3)
+
+    grid = what_if_grid(batch_ml_prediction, MODEL_FEATURES, TEST_USERS['fatima_hassan'])
+    x, y = 'days_since_last_refresh', 'profile_completeness'
+    point = {name: int(values[len(values) // 2]) for name, values in WHAT_IF_AXES.items()}
+    results['what_if.slider_move'] = measure(
+        lambda: (what_if_slice(grid, (), point), what_if_slice(grid, (x, y), point),
+                 what_if_slice(grid, (x,), point), what_if_slice(grid, (y,), point)))
+
+
+def bench_jobs(results, rows):
+    path = os.path.join(tempfile.mkdtemp(), 'catalog.jsonl')
+    synthetic_catalog(path, rows)
+    index = JobIndex.from_file(path)
+    for user_id, profile in TEST_USERS.items():
+        results[f'jobs.match.{rows}.{user_id}'] = measure(
+            lambda: index.match(profile['skills'], profile['industry'], k=3))
+
+
+def bench_reminders(results, count):
+    timings = reminder_throughput(count)
+    for op in ('schedule', 'schedule_many', 'cancel', 'fire'):
+        results[f'reminders.{op}.{count}'] = {
+            'median': timings[op], 'min': timings[op], 'calls': count}
+
+
+def bench_cohorts(results, rows):
+    """One streaming pass over a synthetic profile store, then merging and summarizing"""
+    rng = np.random.default_rng(0)
+    columns = {f: rng.integers(0, 100, rows) for f in NUMERIC_PROFILE_FIELDS}
+    columns.update(synthetic_population(rows))
+    industries = rng.integers(0, 12, rows)
+    path = tempfile.mkdtemp()
+    write_profile_store(path, (
+        (f'user{i}', {**{f: int(columns[f][i]) for f in NUMERIC_PROFILE_FIELDS},
+                      'name': f'User {i}', 'industry': f'Industry {industries[i]}'})
+        for i in range(rows)
+    ), NUMERIC_PROFILE_FIELDS)
+    store = ProfileStore(path)
+
+    results[f'cohorts.aggregate.{rows}'] = measure(
+        lambda: aggregate_store(store, batch_ml_prediction, MODEL_FEATURES, NUDGES), repeat=3)
+    stats = aggregate_store(store, batch_ml_prediction, MODEL_FEATURES, NUDGES)
+    results['cohorts.merge'] = measure(
+        lambda: CohortStats(stats.features, NUDGES).merge(stats))
+    results['cohorts.summary'] = measure(lambda: (stats.summary('industry'), stats.summary('nudge')))
+
+
+def bench_rendering(results):
+    profile = TEST_USERS['fatima_hassan']
+    catalog = open_catalog().current
+    for flow_type, step_name in catalog.steps():
+        kwargs = {f: STEP_FIELD_VALUES[f] for f in STEP_FIELDS.get((flow_type, step_name), ())}
+        results[f'render.{flow_type}.{step_name}'] = measure(
+            lambda: format_message(catalog.template(flow_type, step_name), profile, **kwargs))
+
+
+def bench_dispatch(results):
+    profile = TEST_USERS['fatima_hassan']
+    prediction = mock_ml_prediction(profile)
+    session = ConversationSession(profile)
+    session.ml_prediction = prediction
+    session.skills_selected = ['Python', 'SQL', 'Excel', 'Tableau', 'Statistics']
+    # The postings show_jobs would have offered, so "Tell me about #n" times
+    # the job-detail path rather than a dead end
+    job_matches = open_job_index().match(user_skills(session), profile['industry'], k=JOB_MATCHES)
+
+    catalog = open_catalog().current
+    for flow_type, step_name in catalog.steps():
+        for button in catalog.buttons(flow_type, step_name):
+            def click():
+                session.conversation_flow = flow_type
+                session.conversation_step = step_name
+                session.skills_selected = ['Python', 'SQL', 'Excel', 'Tableau', 'Statistics']
+                session.job_matches = list(job_matches)
+                session.job_selected = job_matches[0]
+                session.jobs_applied = []
+                handle_user_response(session, button)
+                complete_reply(session)
+            results[f'dispatch.{flow_type}.{step_name}.{button}'] = measure(click)
+
+
+def bench_reruns(results, repeat):
+    """Server time per click: a whole-script rerun, or just the fragment it redraws"""
+    from streamlit.testing.v1 import AppTest
+
+    def rerun_timings(at, action, setup=None):
+        timings = []
+        for _ in range(repeat):
+            if setup:
+                setup(at)
+            start = time.perf_counter()
+            action(at)
+            timings.append(time.perf_counter() - start)
+        return {'median': statistics.median(timings), 'min': min(timings), 'calls': repeat}
+
+    def button(at, label):
+        # After a fragment rerun AppTest only holds that fragment's elements
+        for refresh in (False, True):
+            if refresh:
+                at.run()
+            for b in list(at.sidebar.button) + list(at.button):
+                if b.label == label:
+                    return b
+        raise LookupError(label)
+
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.run()
+    results['rerun.landing'] = rerun_timings(at, lambda at: at.run())
+
+    button(at, "Load User Profile").click().run()
+    results['rerun.profile_loaded'] = rerun_timings(at, lambda at: at.run())
+
+    results['rerun.start_nudge'] = rerun_timings(
+        at, lambda at: button(at, "🔄 Refresh CV Nudge").click().run(), setup=lambda at: at.run())
+    results['rerun.chat_click'] = rerun_timings(
+        at, lambda at: button(at, "Why does this help?").click().run(),
+        setup=lambda at: button(at, "🔄 Refresh CV Nudge").click().run())
+
+    button(at, "⚡ Add Skills Nudge").click().run()
+    button(at, "Yes, show me").click().run()
+    results['rerun.skill_toggle'] = rerun_timings(at, lambda at: button(at, "Python").click().run())
+
+
+def compare(results, baseline, threshold):
+    """Benchmarks whose median grew by more than threshold (a fraction)"""
+    regressions = []
+    for name, current in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None or before['median'] <= 0:
+            continue
+        ratio = current['median'] / before['median']
+        if ratio > 1 + threshold:
+            regressions.append((name, before['median'], current['median'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Rafiq benchmark suite")
+    parser.add_argument('--output', default='bench.json', help="where to write results")
+    parser.add_argument('--compare', help="baseline JSON to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed slowdown before flagging, e.g. 0.25 = 25%%")
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help="synthetic population sizes for batch scoring")
+    parser.add_argument('--catalog-rows', type=int, default=300000,
+                        help="synthetic job catalog size for matching")
+    parser.add_argument('--reminders', type=int, default=200000,
+                        help="reminders to schedule and fire")
+    parser.add_argument('--cohort-rows', type=int, default=200000,
+                        help="synthetic profile store size for cohort aggregation")
+    parser.add_argument('--reruns', type=int, default=10,
+                        help="AppTest reruns per scenario (0 to skip)")
+    parser.add_argument('--only', help="run only benchmarks whose name starts with this")
+    args = parser.parse_args()
+
+    # Keep AppTest sessions out of the app's real session database
+    os.environ.setdefault('RAFIQ_SESSION_DB', os.path.join(tempfile.mkdtemp(), 'sessions.db'))
+
+    results = {}
+    groups = [
+        ('import', lambda: bench_imports(results)),
+        ('scoring', lambda: bench_scoring(results, [int(s) for s in args.sizes.split(',')])),
+        ('what_if', lambda: bench_what_if(results)),
+        ('jobs', lambda: bench_jobs(results, args.catalog_rows)),
+        ('reminders', lambda: bench_reminders(results, args.reminders)),
+        ('cohorts', lambda: bench_cohorts(results, args.cohort_rows)),
+        ('render', lambda: bench_rendering(results)),
+        ('dispatch', lambda: bench_dispatch(results)),
+        ('rerun', lambda: bench_reruns(results, args.reruns) if args.reruns else None)
+    ]
+    for prefix, run in groups:
+        if args.only and not (prefix.startswith(args.only) or args.only.startswith(prefix)):
+            continue
+        run()
+    if args.only:
+        results = {k: v for k, v in results.items() if k.startswith(args.only)}
+
+    for name, timing in sorted(results.items()):
+        print(f"{name:70s} {timing['median'] * 1e6:14.2f} us")
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'meta': {
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform()
+            },
+            'results': results
+        }, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: {before * 1e6:.2f} us -> {after * 1e6:.2f} us ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Bounded chat history for one session.
+
+The most recent turns live in a fixed-size ring buffer. Turns that fall
+out of it are packed into zlib-compressed blocks (the session's archive),
+so memory per session grows with the compressed size of old turns rather
+than with Python objects per message, and a rerun only renders the window
+unless older turns are explicitly requested.
+"""
+import json
+import struct
+import sys
+import time
+import zlib
+from collections import deque, namedtuple
+
+# role is interned, timestamp is seconds since the epoch
+ChatMessage = namedtuple('ChatMessage', ['role', 'content', 'timestamp'])
+
+# to_bytes header: window, block_size, archived count, number of blocks
+_HEADER = struct.Struct('<IIII')
+_BLOCK_LENGTH = struct.Struct('<I')
+
+
+class ChatHistory:
+    """Ring buffer of recent messages backed by a compressed archive"""
+
+    def __init__(self, window=30, block_size=50):
+        self.block_size = block_size
+        self._recent = deque(maxlen=window)
+        self._spill = []        # evicted messages not yet compressed
+        self._blocks = []       # compressed blocks, oldest first
+        self._archived = 0
+        self.revision = 0       # bumped on every change, for change tracking
+
+    def append(self, role, content, timestamp=None):
+        if len(self._recent) == self._recent.maxlen:
+            self._spill.append(self._recent[0])
+            self._archived += 1
+            if len(self._spill) == self.block_size:
+                self._blocks.append(zlib.compress(json.dumps(self._spill).encode('utf-8')))
+                self._spill = []
+        self._recent.append(ChatMessage(
+            sys.intern(role),
+            content,
+            time.time() if timestamp is None else timestamp
+        ))
+        self.revision += 1
+
+    def recent(self):
+        """Messages in the in-memory window, oldest first"""
+        return list(self._recent)
+
+    def earlier(self, count):
+        """
+        The last `count` archived messages, oldest first. Only the blocks
+        holding them are decompressed.
+        """
+        count = min(count, self._archived)
+        messages = list(self._spill[-count:]) if count else []
+        block = len(self._blocks)
+        while len(messages) < count and block:
+            block -= 1
+            unpacked = json.loads(zlib.decompress(self._blocks[block]))
+            messages[:0] = [ChatMessage(sys.intern(r), c, t) for r, c, t in unpacked]
+        return messages[len(messages) - count:]
+
+    @property
+    def archived_count(self):
+        return self._archived
+
+    def clear(self):
+        self._recent.clear()
+        self._spill = []
+        self._blocks = []
+        self._archived = 0
+        self.revision += 1
+
+    def to_bytes(self):
+        """
+        Compact binary form: a fixed header, the already compressed archive
+        blocks as they are, then the window and spill compressed together.
+        """
+        parts = [_HEADER.pack(self._recent.maxlen, self.block_size, self._archived, len(self._blocks))]
+        for block in self._blocks:
+            parts.append(_BLOCK_LENGTH.pack(len(block)))
+            parts.append(block)
+        tail = json.dumps([self._spill, list(self._recent)], separators=(',', ':'))
+        parts.append(zlib.compress(tail.encode('utf-8')))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        window, block_size, archived, block_count = _HEADER.unpack_from(data)
+        history = cls(window=window, block_size=block_size)
+        offset = _HEADER.size
+        for _ in range(block_count):
+            length, = _BLOCK_LENGTH.unpack_from(data, offset)
+            offset += _BLOCK_LENGTH.size
+            history._blocks.append(data[offset:offset + length])
+            offset += length
+        spill, recent = json.loads(zlib.decompress(data[offset:]))
+        history._spill = [ChatMessage(sys.intern(r), c, t) for r, c, t in spill]
+        history._recent.extend(ChatMessage(sys.intern(r), c, t) for r, c, t in recent)
+        history._archived = archived
+        return history
+
+    def __len__(self):
+        return self._archived + len(self._recent)
+
+    def __iter__(self):
+        """Every message, oldest first (decompresses the whole archive)"""
+        yield from self.earlier(self._archived)
+        yield from self._recent
@@ -0,0 +1,293 @@
+"""
+Population cohort analytics over profile stores.
+
+One streaming pass per store, chunk_size rows at a time: a chunk's numeric
+columns are read from the memory-mapped store, scored with the model and
+folded into per-group sketches for two groupings, industry and
+recommended nudge. Memory holds one chunk plus the sketches, however large
+the store is.
+
+For each group and numeric feature a sketch keeps the count, sum, sum of
+squares, min and max, and a log-bucketed histogram (as in DDSketch): a
+value v >= 1 lands in bucket ceil(log_gamma(v)) + 1, with
+gamma = (1 + a) / (1 - a), so every quantile reads back within relative
+error a = RELATIVE_ACCURACY. Values below 1 share bucket 0 and read back
+as 0; the features are counts. Each group also counts its recommended
+nudges.
+
+Every part of a sketch is a sum, a min or a max, so sketches merge
+exactly, in any order: the stats of several stores (daily partitions,
+say) are their sketches merged. With a state directory each store's
+sketch is saved under a key of its path, size, write time and model
+version, and a refresh only reads the stores that are new or rewritten.
+
+    python cohort_stats.py profiles/2026-10-16 profiles/2026-10-17 --state cohorts/
+"""
+import argparse
+import json
+import math
+import os
+from hashlib import blake2b
+
+import numpy as np
+
+from profile_store import ProfileStore
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+# Histogram buckets per feature; the last one also takes anything past
+# GAMMA ** (BUCKETS - 2), about 7e8
+BUCKETS = 1024
+
+DIMENSIONS = ('industry', 'nudge')
+
+QUANTILES = (0.1, 0.5, 0.9, 0.99)
+
+# Bump when the saved layout changes, so old state is recomputed
+_STATE_VERSION = 1
+
+_LOG_GAMMA = math.log(GAMMA)
+
+
+def bucket_index(values):
+    """Histogram bucket of each value"""
+    values = np.asarray(values, dtype=np.float64)
+    buckets = np.ceil(np.log(np.maximum(values, 1)) / _LOG_GAMMA).astype(np.int64) + 1
+    return np.where(values >= 1, np.minimum(buckets, BUCKETS - 1), 0)
+
+
+def bucket_value(bucket):
+    """Representative value of a bucket, within RELATIVE_ACCURACY of any value in it"""
+    return 0.0 if bucket == 0 else 2 * GAMMA ** (bucket - 1) / (GAMMA + 1)
+
+
+class GroupSketch:
+    """Sketches of every feature for each group of one dimension"""
+
+    def __init__(self, features, nudges):
+        self.features = tuple(features)
+        self.nudges = tuple(nudges)
+        self.groups = []
+        self._rows = {}
+        shape = (0, len(self.features))
+        self.count = np.zeros(0, dtype=np.int64)
+        self.sum = np.zeros(shape)
+        self.sum_squares = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.histogram = np.zeros(shape + (BUCKETS,), dtype=np.int64)
+        self.nudge_counts = np.zeros((0, len(self.nudges)), dtype=np.int64)
+
+    _ARRAYS = ('count', 'sum', 'sum_squares', 'min', 'max', 'histogram', 'nudge_counts')
+    _FILL = {'min': np.inf, 'max': -np.inf}
+
+    def _row(self, group):
+        """The group's row, added if it is new"""
+        row = self._rows.get(group)
+        if row is None:
+            row = self._rows[group] = len(self.groups)
+            self.groups.append(group)
+            for name in self._ARRAYS:
+                array = getattr(self, name)
+                extra = np.full((1,) + array.shape[1:], self._FILL.get(name, 0), dtype=array.dtype)
+                setattr(self, name, np.concatenate([array, extra]))
+        return row
+
+    def add(self, group_codes, group_names, values, nudge_codes):
+        """
+        Fold in one chunk: per row, the index of its group in group_names,
+        its feature values (rows x features) and its nudge's index in nudges
+        """
+        rows = np.asarray([self._row(name) for name in group_names], dtype=np.int64)[group_codes]
+        groups, features = len(self.groups), len(self.features)
+        self.count += np.bincount(rows, minlength=groups)
+        for f in range(features):
+            column = values[:, f]
+            self.sum[:, f] += np.bincount(rows, weights=column, minlength=groups)
+            self.sum_squares[:, f] += np.bincount(rows, weights=column * column, minlength=groups)
+        # Per-group extremes by reducing over runs of sorted rows; ufunc.at
+        # takes several times longer
+        order = np.argsort(rows, kind='stable')
+        ordered = values[order]
+        starts = np.flatnonzero(np.diff(rows[order], prepend=-1))
+        present = rows[order][starts]
+        self.min[present] = np.minimum(self.min[present], np.minimum.reduceat(ordered, starts))
+        self.max[present] = np.maximum(self.max[present], np.maximum.reduceat(ordered, starts))
+        cells = (rows[:, None] * features + np.arange(features)) * BUCKETS + bucket_index(values)
+        self.histogram += np.bincount(cells.ravel(), minlength=groups * features * BUCKETS).reshape(
+            self.histogram.shape)
+        self.nudge_counts += np.bincount(rows * len(self.nudges) + nudge_codes,
+                                         minlength=groups * len(self.nudges)).reshape(self.nudge_counts.shape)
+
+    def merge(self, other):
+        """Add other's groups into this sketch"""
+        rows = np.asarray([self._row(group) for group in other.groups], dtype=np.int64)
+        for name in ('count', 'sum', 'sum_squares', 'histogram', 'nudge_counts'):
+            getattr(self, name)[rows] += getattr(other, name)
+        self.min[rows] = np.minimum(self.min[rows], other.min)
+        self.max[rows] = np.maximum(self.max[rows], other.max)
+        return self
+
+    def quantile(self, row, f, q):
+        """Estimated q-quantile of feature f in a group"""
+        cumulative = np.cumsum(self.histogram[row, f])
+        bucket = int(np.searchsorted(cumulative, round(q * (cumulative[-1] - 1)), side='right'))
+        return float(min(max(bucket_value(bucket), self.min[row, f]), self.max[row, f]))
+
+    def summary(self):
+        """
+        Per group, largest first: {'group', 'count', 'nudges': nudge ->
+        share, 'features': feature -> {'mean', 'std', 'min', 'max', 'p10',
+        'p50', 'p90', 'p99'}}
+        """
+        results = []
+        for row in np.argsort(-self.count, kind='stable').tolist():
+            n = int(self.count[row])
+            if not n:
+                continue
+            features = {}
+            for f, feature in enumerate(self.features):
+                mean = self.sum[row, f] / n
+                stats = {
+                    'mean': float(mean),
+                    'std': float(math.sqrt(max(self.sum_squares[row, f] / n - mean * mean, 0.0))),
+                    'min': float(self.min[row, f]),
+                    'max': float(self.max[row, f])
+                }
+                for q in QUANTILES:
+                    stats[f'p{round(q * 100)}'] = self.quantile(row, f, q)
+                features[feature] = stats
+            results.append({
+                'group': self.groups[row],
+                'count': n,
+                'nudges': dict(zip(self.nudges, (self.nudge_counts[row] / n).tolist())),
+                'features': features
+            })
+        return results
+
+
+class CohortStats:
+    """Sketches by industry and by recommended nudge for a population"""
+
+    def __init__(self, features, nudges):
+        self.features = tuple(features)
+        self.nudges = tuple(nudges)
+        self.rows = 0
+        self.sketches = {dimension: GroupSketch(self.features, self.nudges) for dimension in DIMENSIONS}
+
+    def add(self, columns, industry_codes, industries, nudge_codes):
+        """Fold in a chunk: feature columns, industry codes into industries, nudge codes"""
+        values = np.column_stack([np.asarray(columns[f], dtype=np.float64) for f in self.features])
+        self.sketches['industry'].add(industry_codes, industries, values, nudge_codes)
+        self.sketches['nudge'].add(nudge_codes, self.nudges, values, nudge_codes)
+        self.rows += len(values)
+
+    def merge(self, other):
+        if other.features != self.features or other.nudges != self.nudges:
+            raise ValueError("Only stats over the same features and nudges merge")
+        for dimension, sketch in self.sketches.items():
+            sketch.merge(other.sketches[dimension])
+        self.rows += other.rows
+        return self
+
+    def summary(self, dimension):
+        return self.sketches[dimension].summary()
+
+    def save(self, path):
+        """Write to path (.npz) atomically"""
+        arrays = {'features': np.asarray(self.features), 'nudges': np.asarray(self.nudges),
+                  'rows': np.asarray(self.rows)}
+        for dimension, sketch in self.sketches.items():
+            arrays[f'{dimension}.groups'] = np.asarray(sketch.groups, dtype=str)
+            for name in GroupSketch._ARRAYS:
+                arrays[f'{dimension}.{name}'] = getattr(sketch, name)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as saved:
+            stats = cls(saved['features'].tolist(), saved['nudges'].tolist())
+            stats.rows = int(saved['rows'])
+            for dimension, sketch in stats.sketches.items():
+                sketch.groups = saved[f'{dimension}.groups'].tolist()
+                sketch._rows = {group: i for i, group in enumerate(sketch.groups)}
+                for name in GroupSketch._ARRAYS:
+                    setattr(sketch, name, saved[f'{dimension}.{name}'])
+        return stats
+
+
+def aggregate_store(store, predict_batch, model_features, nudges, chunk_size=65536):
+    """CohortStats for one store, read and scored chunk_size rows at a time"""
+    stats = CohortStats(store.numeric_fields, nudges)
+    industry = store.column('industry')
+    for start in range(0, store.rows, chunk_size):
+        end = min(start + chunk_size, store.rows)
+        columns = {f: np.asarray(store.column(f)[start:end]) for f in store.numeric_fields}
+        probabilities = predict_batch({f: columns[f] for f in model_features})['all_predictions']
+        # argmax keeps the first nudge on ties, like the model's own pick
+        stats.add(columns, np.asarray(industry[start:end]), store.industries,
+                  probabilities.argmax(axis=1))
+    return stats
+
+
+def _state_key(store, model_version):
+    meta = os.stat(os.path.join(store.path, 'meta.json'))
+    key = f'{_STATE_VERSION}:{os.path.abspath(store.path)}:{store.rows}:{meta.st_mtime_ns}:{model_version}'
+    return blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def cohort_stats(stores, predict_batch, model_features, model_version, nudges,
+                 state_dir=None, chunk_size=65536):
+    """
+    Merged CohortStats over stores. With state_dir, a store whose sketch
+    was saved by an earlier call is loaded instead of read again.
+    """
+    total = None
+    for store in stores:
+        path = None
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+            path = os.path.join(state_dir, f'{_state_key(store, model_version)}.npz')
+        if path and os.path.exists(path):
+            stats = CohortStats.load(path)
+        else:
+            stats = aggregate_store(store, predict_batch, model_features, nudges, chunk_size)
+            if path:
+                stats.save(path)
+        total = stats if total is None else total.merge(stats)
+    return total
+
+
+def main():
+    # Deferred so `--help` stays fast; rafiq_core loads the models
+    from rafiq_core import NUDGES, open_model
+
+    parser = argparse.ArgumentParser(description="Cohort statistics for profile stores")
+    parser.add_argument('stores', nargs='+', help="profile store directories")
+    parser.add_argument('--state', help="directory to keep per-store sketches in")
+    parser.add_argument('--chunk-size', type=int, default=65536)
+    parser.add_argument('--by', choices=DIMENSIONS, default='industry')
+    parser.add_argument('--json', action='store_true', help="print the summary as JSON")
+    args = parser.parse_args()
+
+    model = open_model()
+    stats = cohort_stats([ProfileStore(path) for path in args.stores], model.predict_batch,
+                         model.features, model.version, NUDGES, args.state, args.chunk_size)
+    summary = stats.summary(args.by)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"{stats.rows:,} profiles by {args.by}")
+    for group in summary:
+        nudges = ', '.join(f"{n} {share:.0%}" for n, share in group['nudges'].items())
+        print(f"{group['group']}: {group['count']:,} ({nudges})")
+        for feature, s in group['features'].items():
+            print(f"  {feature:26s} mean {s['mean']:9.2f}  p50 {s['p50']:9.1f}  "
+                  f"p90 {s['p90']:9.1f}  p99 {s['p99']:9.1f}  max {s['max']:9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Conversation catalog: every flow's messages, buttons and where each button
+leads, kept in a file so copy can change without a redeploy.
+
+The source is JSON (data/conversation_catalog.json):
+
+    {"refresh_cv": {
+        "initial": {
+            "message": ["Hey {name}! 👋 ...", "", "Want me to refresh it?"],
+            "buttons": {"Yes, refresh it": "success",
+                        "Find jobs for me": "apply_job/show_jobs",
+                        "Not right now": "end"}
+        }, ...}, ...}
+
+A message is a str.format template written as a list of lines. A button
+leads to a step of the same flow, to "flow/step" in another flow, to "end"
+(close the conversation) or to "select_skill" (toggle a skill and stay).
+A button leading to another flow's "initial" step starts that flow afresh,
+the way a nudge does, rather than jumping into the middle of it.
+add_skill/show_skills lists no buttons: its grid comes from the trending
+skill index.
+
+The source is compiled into a binary file next to it, SOURCE.<digest>.bin,
+that every process maps read-only, so all workers share one copy in the
+page cache:
+
+    header      magic and table sizes
+    strings     uint32 offsets, then each distinct string once, UTF-8
+    steps       per step: flow, name, message text, its segments and buttons
+    segments    templates pre-split into (literal length, field, conversion, spec)
+    buttons     per button: label, action, target flow and step
+
+Tables are uint32 string ids and ranges, read in place through memoryview
+casts. Step names and every button's transition are indexed once when a
+version is mapped, so a click is one dict lookup; message text is decoded
+only when a message is rendered.
+
+ConversationCatalog.refresh() notices an edited source, compiles and maps
+the new version and swaps it in with one assignment. A source that fails
+to compile, or lacks a step the engine names, is counted and skipped, and
+the previous version stays live.
+Versions are named by the digest of their source and a conversation keeps
+using the one it started on, so an edit never changes the buttons under a
+user in the middle of a flow. release() drops the old versions no
+conversation uses any more, along with their compiled files.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+from hashlib import blake2b
+from string import Formatter
+
+import metrics
+
+# Special transition targets
+END = 'end'                     # Close the conversation, no more buttons
+SELECT_SKILL = 'select_skill'   # Toggle a skill, stay on the same step
+
+# Action of a button that leads to another flow's initial step
+START = 'start'
+
+# A compiled transition: action is 'goto', START, END or SELECT_SKILL; flow/step
+# is where the conversation stands afterwards (None once it has ended)
+Transition = namedtuple('Transition', ['action', 'flow', 'step'])
+
+# A message parsed once: literal text interleaved with the fields to fill in.
+# segments holds (literal, field, conversion, format_spec); field is None for
+# trailing text. fields is the set of names the template needs.
+CompiledTemplate = namedtuple('CompiledTemplate', ['segments', 'fields'])
+
+_CONVERSIONS = {None: None, 's': str, 'r': repr, 'a': ascii}
+
+# Codes stored in the binary tables
+_CONVERSION_FUNCTIONS = tuple(_CONVERSIONS.values())
+_ACTIONS = ('goto', END, SELECT_SKILL, START)
+
+# Native byte order is part of the magic: files are rebuilt, never moved
+_MAGIC = b'RFQCAT2' + (b'<' if sys.byteorder == 'little' else b'>')
+_HEADER = struct.Struct('<8s5I')     # magic, strings, heap bytes, steps, segments, buttons
+_STEP, _SEGMENT, _BUTTON = 7, 4, 4   # uint32s per table row
+
+
+@lru_cache(maxsize=None)
+def compile_template(template):
+    """Parse a str.format template into a CompiledTemplate"""
+    segments = []
+    for literal, field, format_spec, conversion in Formatter().parse(template):
+        if field is not None and not field.isidentifier():
+            raise ValueError(f"Template field {{{field}}} must be a plain name")
+        if format_spec and '{' in format_spec:
+            raise ValueError(f"Template field {{{field}}} uses a nested format spec")
+        segments.append((literal, field, _CONVERSIONS[conversion], format_spec or ''))
+    fields = frozenset(seg[1] for seg in segments if seg[1] is not None)
+    return CompiledTemplate(tuple(segments), fields)
+
+
+def _padded(size):
+    return -(-size // 4) * 4
+
+
+def compile_catalog(flows, available_fields, required_steps=None):
+    """
+    Check a parsed source and encode it as a binary image. Every field a
+    message uses must be in available_fields(flow, step), every target must
+    exist and every button must lead somewhere. required_steps maps each
+    (flow, step) the engine names to how many leading buttons it relies on,
+    which must all lead to a step.
+    """
+    if not isinstance(flows, dict) or not flows:
+        raise ValueError("A catalog maps flow names to their steps")
+    known = set()
+    for flow_type, steps in flows.items():
+        if not isinstance(steps, dict) or 'initial' not in steps:
+            raise ValueError(f"Flow {flow_type} needs an 'initial' step")
+        for step_name in steps:
+            if '/' in flow_type or '/' in step_name:
+                raise ValueError(f"{flow_type}/{step_name}: names cannot contain '/'")
+            known.add((flow_type, step_name))
+    for (flow_type, step_name), button_count in (required_steps or {}).items():
+        if (flow_type, step_name) not in known:
+            raise ValueError(f"The engine needs step {flow_type}/{step_name}")
+        step = flows[flow_type][step_name]
+        buttons = step.get('buttons', {}) if isinstance(step, dict) else {}
+        targets = list(buttons.values())[:button_count] if isinstance(buttons, dict) else []
+        if len(targets) < button_count or any(t in (END, SELECT_SKILL) for t in targets):
+            raise ValueError(f"{flow_type}/{step_name} needs {button_count} leading buttons "
+                             "that go to a step")
+
+    strings = {}
+
+    def intern(text):
+        return strings.setdefault(text, len(strings))
+
+    step_rows, segment_rows, button_rows = array('I'), array('I'), array('I')
+    for flow_type, steps in flows.items():
+        for step_name, step in steps.items():
+            where = f"{flow_type}/{step_name}"
+            message = step.get('message') if isinstance(step, dict) else None
+            if isinstance(message, list) and all(isinstance(line, str) for line in message):
+                message = '\n'.join(message)
+            if not isinstance(message, str):
+                raise ValueError(f"{where} needs a message: a string or a list of lines")
+            template = compile_template(message)
+            missing = template.fields - set(available_fields(flow_type, step_name))
+            if missing:
+                raise ValueError(f"{where} references {sorted(missing)}, which the engine doesn't provide")
+
+            # A message's literal text is stored as one string, cut by length
+            step_rows.extend((intern(flow_type), intern(step_name),
+                              intern(''.join(seg[0] for seg in template.segments)),
+                              len(segment_rows) // _SEGMENT))
+            for literal, field, conversion, format_spec in template.segments:
+                segment_rows.extend((
+                    len(literal),
+                    0 if field is None else intern(field) + 1,
+                    _CONVERSION_FUNCTIONS.index(conversion),
+                    intern(format_spec)
+                ))
+            step_rows.extend((len(segment_rows) // _SEGMENT, len(button_rows) // _BUTTON))
+
+            buttons = step.get('buttons', {})
+            if not isinstance(buttons, dict):
+                raise ValueError(f"{where} buttons must map each label to its target")
+            for button, target in buttons.items():
+                if not isinstance(target, str):
+                    raise ValueError(f"{where} button {button!r} has no target")
+                if target in (END, SELECT_SKILL):
+                    action = _ACTIONS.index(target)
+                    next_flow, next_step = (None, None) if target == END else (flow_type, step_name)
+                else:
+                    next_flow, _, next_step = target.rpartition('/')
+                    next_flow = next_flow or flow_type
+                    if (next_flow, next_step) not in known:
+                        raise ValueError(f"{where} button {button!r} leads to unknown step {next_flow}/{next_step}")
+                    entering = next_flow != flow_type and next_step == 'initial'
+                    action = _ACTIONS.index(START) if entering else 0
+                button_rows.extend((
+                    intern(button), action,
+                    0 if next_flow is None else intern(next_flow) + 1,
+                    0 if next_step is None else intern(next_step) + 1
+                ))
+            step_rows.append(len(button_rows) // _BUTTON)
+
+    heap = bytearray()
+    offsets = array('I', [0])
+    for text in strings:
+        heap += text.encode('utf-8')
+        offsets.append(len(heap))
+    heap += bytes(_padded(len(heap)) - len(heap))
+    header = _HEADER.pack(_MAGIC, len(strings), len(heap), len(step_rows) // _STEP,
+                          len(segment_rows) // _SEGMENT, len(button_rows) // _BUTTON)
+    return b''.join((header, offsets.tobytes(), bytes(heap), step_rows.tobytes(),
+                     segment_rows.tobytes(), button_rows.tobytes()))
+
+
+class CompiledCatalog:
+    """One version of the catalog, read straight from its mapped binary file"""
+
+    def __init__(self, path, digest):
+        self.path = path
+        self.digest = digest
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise ValueError(f"{path} is not a compiled catalog")
+        magic, n_strings, heap_size, n_steps, n_segments, n_buttons = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a compiled catalog")
+
+        view = memoryview(self._map)
+        position = _HEADER.size
+
+        def table(count):
+            nonlocal position
+            start, position = position, position + 4 * count
+            return view[start:position].cast('I')
+
+        self._offsets = table(n_strings + 1)
+        self._heap = position
+        position += heap_size
+        self._steps = table(n_steps * _STEP)
+        self._segments = table(n_segments * _SEGMENT)
+        self._buttons = table(n_buttons * _BUTTON)
+        # (flow, step) -> row, decoded field names and every button's
+        # transition: the only strings held per process
+        self._names = {}
+        self._rows = {
+            (self._string(self._steps[i]), self._string(self._steps[i + 1])): i
+            for i in range(0, len(self._steps), _STEP)
+        }
+        self._transitions = {
+            (flow_type, step_name, self._string(self._buttons[i])): Transition(
+                _ACTIONS[self._buttons[i + 1]], self._optional(self._buttons[i + 2]),
+                self._optional(self._buttons[i + 3]))
+            for flow_type, step_name in self._rows
+            for i in self._button_range(flow_type, step_name)
+        }
+
+    def _string(self, string_id):
+        start = self._heap + self._offsets[string_id]
+        return str(self._map[start:self._heap + self._offsets[string_id + 1]], 'utf-8')
+
+    def _name(self, string_id):
+        """A field name or format spec, decoded once: there are only a few"""
+        name = self._names.get(string_id)
+        if name is None:
+            name = self._names[string_id] = self._string(string_id)
+        return name
+
+    def _optional(self, string_id):
+        return None if string_id == 0 else self._string(string_id - 1)
+
+    def steps(self):
+        """(flow, step) of every step, in source order"""
+        return list(self._rows)
+
+    def __contains__(self, flow_step):
+        return flow_step in self._rows
+
+    def template(self, flow_type, step_name):
+        """The step's message as a CompiledTemplate; KeyError for unknown steps"""
+        row = self._rows[(flow_type, step_name)]
+        text = self._string(self._steps[row + 2])
+        table = self._segments[self._steps[row + 3] * _SEGMENT:self._steps[row + 4] * _SEGMENT].tolist()
+        segments = []
+        end = 0
+        for i in range(0, len(table), _SEGMENT):
+            length, field, conversion, format_spec = table[i:i + _SEGMENT]
+            start, end = end, end + length
+            segments.append((text[start:end], self._name(field - 1) if field else None,
+                             _CONVERSION_FUNCTIONS[conversion], self._name(format_spec)))
+        return CompiledTemplate(tuple(segments), frozenset(s[1] for s in segments if s[1] is not None))
+
+    def _button_range(self, flow_type, step_name):
+        row = self._rows.get((flow_type, step_name))
+        if row is None:
+            return range(0)
+        return range(self._steps[row + 5] * _BUTTON, self._steps[row + 6] * _BUTTON, _BUTTON)
+
+    def buttons(self, flow_type, step_name):
+        """The step's button labels in display order ([] for unknown steps)"""
+        return [self._string(self._buttons[i]) for i in self._button_range(flow_type, step_name)]
+
+    def transition(self, flow_type, step_name, button):
+        """Where a button leads, as a Transition, or None if the step doesn't offer it"""
+        return self._transitions.get((flow_type, step_name, button))
+
+
+class ConversationCatalog:
+    """A catalog source and the compiled versions of it this process has mapped"""
+
+    def __init__(self, path, available_fields, required_steps=None):
+        self.path = path
+        self.available_fields = available_fields
+        self.required_steps = required_steps
+        self.current = None
+        self._versions = {}         # digest -> CompiledCatalog
+        self._signature = None      # (size, mtime) of the source last compiled
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _compiled_path(self, digest):
+        return f'{self.path}.{digest}.bin'
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            source = f.read()
+        digest = blake2b(source, digest_size=8).hexdigest()
+        if digest in self._versions:
+            return self._versions[digest]
+        # Always compiled, so the source is checked against this code's fields
+        image = compile_catalog(json.loads(source), self.available_fields, self.required_steps)
+        path = self._compiled_path(digest)
+        try:
+            with open(path, 'rb') as f:
+                unchanged = f.read() == image
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(image)
+            os.replace(tmp_path, path)
+        version = self._versions[digest] = CompiledCatalog(path, digest)
+        return version
+
+    def refresh(self):
+        """
+        Switch to the source's latest version if it changed since the last
+        call; True if it did. Only the first load raises on a bad source.
+        """
+        stat = os.stat(self.path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self._signature:
+            return False
+        with self._lock:
+            if signature == self._signature:
+                return False
+            self._signature = signature
+            try:
+                version = self._load()
+            except Exception:
+                if self.current is None:
+                    raise
+                metrics.count('catalog_reload_failed')
+                return False
+            previous, self.current = self.current, version
+        if previous is not None and version is not previous:
+            metrics.count('catalog_reloads')
+        return version is not previous
+
+    def release(self, pinned):
+        """
+        Drop every version but the current one whose digest isn't in pinned
+        (the versions live conversations started on), and delete their
+        compiled files. A dropped version is unmapped once the last request
+        using it lets go. Returns how many this process had mapped.
+        """
+        self.refresh()
+        with self._lock:
+            keep = set(pinned) | {self.current.digest}
+            dropped = [digest for digest in self._versions if digest not in keep]
+            for digest in dropped:
+                del self._versions[digest]
+        directory, prefix = os.path.split(self.path)
+        prefix += '.'
+        for name in os.listdir(directory or '.'):
+            if (name.startswith(prefix) and name.endswith('.bin')
+                    and name[len(prefix):-len('.bin')] not in keep):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass    # another process removed it first
+        return len(dropped)
+
+    def version(self, digest):
+        """
+        The version with this digest, e.g. the one a conversation started
+        on; the current version if digest is None or no longer available
+        """
+        if digest is None:
+            return self.current
+        version = self._versions.get(digest)
+        if version is not None:
+            return version
+        with self._lock:
+            try:
+                version = self._versions[digest] = CompiledCatalog(self._compiled_path(digest), digest)
+            except (OSError, ValueError):
+                return self.current
+        return version
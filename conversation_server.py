@@ -0,0 +1,533 @@
+"""
+Headless asyncio server for Rafiq conversations.
+
+Serves the conversation engine from rafiq_core over plain HTTP/JSON and
+WebSocket, without Streamlit. Sessions are kept in memory while in use and
+evicted after --ttl seconds without a request. With --session-db they are
+also written through to SQLite, so an evicted session is restored on its
+next request and conversations survive a restart.
+
+With --reminders DIR, reaching a step that promises a reminder ("remind me
+next week") schedules one in DIR, and when it comes due the flow restarts
+in that session. Starting the same flow before then cancels it.
+
+With --transcript FILE, every request is appended to FILE as a JSON line,
+ready for `python -m benchmarks.load_test --replay FILE`.
+
+HTTP (one request per connection, JSON bodies):
+    POST /sessions                      {"user_id": ...} -> new session
+    GET  /sessions/<id>                 current state
+    POST /sessions/<id>/<action>        start | respond | toggle_skill |
+                                        submit_skills | reset
+    GET  /health
+
+WebSocket:
+    GET  /sessions/<id>/ws              send {"action": ..., ...} frames,
+                                        receive the state after each one
+
+With --workers N, N server processes listen on the ports after --port and
+a router on --port forwards each connection to the worker that owns its
+session. Session ids start with the owning worker's index, so routing
+is sticky without any shared state.
+
+    python conversation_server.py --port 8600 --workers 4 --session-db sessions.db
+
+Predictions come from the backend named by RAFIQ_MODEL_BACKEND (and
+RAFIQ_MODEL_PATH for the tree model), as in the Streamlit app. Replies
+come whole from the producer named by RAFIQ_REPLY_PRODUCER, run in a
+thread so a slow one doesn't hold up other connections.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import secrets
+import struct
+import time
+
+import metrics
+from prediction_cache import PredictionCache
+from rafiq_core import (
+    MIN_SKILLS_SELECTED,
+    REMINDER_STEPS,
+    SESSION_RETENTION,
+    ConversationSession,
+    complete_reply,
+    current_buttons,
+    handle_user_response,
+    next_monday,
+    open_model,
+    open_profile_store,
+    release_catalog_versions,
+    skill_options,
+    start_conversation,
+    submit_skills,
+    toggle_skill,
+)
+from reminders import ReminderScheduler
+from session_backend import MemorySessionBackend, SessionStore, SQLiteSessionBackend
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MAX_BODY = 1 << 20
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ConversationServer:
+    """Maps requests onto the conversation engine for one worker"""
+
+    def __init__(self, worker_index=0, ttl=1800, session_db=None, retention=SESSION_RETENTION,
+                 reminder_dir=None, transcript=None):
+        self.worker_index = worker_index
+        backend = SQLiteSessionBackend(session_db) if session_db else MemorySessionBackend()
+        self.sessions = SessionStore(backend, ConversationSession, ttl)
+        self.retention = retention
+        self.profiles = open_profile_store()
+        self.model = open_model()
+        self.predictions = PredictionCache(self.model.features)
+        self.reminders = ReminderScheduler(reminder_dir) if reminder_dir else None
+        self.transcript = open(transcript, 'a', encoding='utf-8', buffering=1) if transcript else None
+
+    def record(self, session_id, action, body):
+        """Append a request to the transcript, if one is kept"""
+        if self.transcript:
+            self.transcript.write(json.dumps({
+                'ts': time.time(),
+                'session_id': session_id,
+                'action': action,
+                'body': body
+            }) + '\n')
+
+    def state(self, session_id, session):
+        return {
+            'session_id': session_id,
+            'flow': session.conversation_flow,
+            'step': session.conversation_step,
+            'buttons': current_buttons(session),
+            'skills_selected': list(session.skills_selected),
+            'messages': [m._asdict() for m in session.messages.recent()]
+        }
+
+    def create_session(self, body):
+        user_id = body.get('user_id')
+        if not isinstance(user_id, str) or user_id not in self.profiles:
+            raise HTTPError(404, f"Unknown user {user_id}")
+        session_id = f"{self.worker_index}.{secrets.token_urlsafe(12)}"
+        session = ConversationSession(self.profiles[user_id], user_id=user_id)
+        self.sessions.add(session_id, session)
+        self.record(session_id, 'create', {'user_id': user_id})
+        return self.state(session_id, session)
+
+    def session(self, session_id):
+        try:
+            return self.sessions.get(session_id)
+        except KeyError:
+            raise HTTPError(404, f"Unknown session {session_id}")
+
+    async def act(self, session_id, action, body):
+        """Apply one action to a session and return its new state"""
+        session = self.session(session_id)
+        self.record(session_id, action, body)
+        if action == 'start':
+            prediction = self.predictions.get_or_compute(
+                session.user_profile, self.model.version, self.model.predict)
+            flow_type = body.get('flow') or prediction['nudge']
+            if not isinstance(flow_type, str) or flow_type not in prediction['all_predictions']:
+                raise HTTPError(400, f"Unknown flow {flow_type}")
+            if session.reminder and session.reminder['flow'] == flow_type:
+                # Back before the reminder: no need for it any more
+                self.cancel_reminder(session)
+            start_conversation(session, flow_type, prediction)
+        elif action == 'respond':
+            step = (session.conversation_flow, session.conversation_step)
+            handle_user_response(session, str(body.get('response', '')))
+            if (session.conversation_flow, session.conversation_step) != step:
+                self.schedule_reminder(session_id, session)
+        elif action == 'toggle_skill':
+            skill = body.get('skill')
+            if session.conversation_step != 'show_skills' or skill not in skill_options(session):
+                raise HTTPError(400, f"No skill {skill} to select here")
+            toggle_skill(session, skill)
+        elif action == 'submit_skills':
+            if session.conversation_step != 'show_skills':
+                raise HTTPError(400, "No skills to submit here")
+            if len(session.skills_selected) < MIN_SKILLS_SELECTED:
+                raise HTTPError(400, f"Select at least {MIN_SKILLS_SELECTED} skills")
+            submit_skills(session)
+        elif action == 'reset':
+            self.cancel_reminder(session)
+            session.reset()
+        elif action != 'state':
+            raise HTTPError(404, f"Unknown action {action}")
+        # Replies go out whole: clients get the state after each action
+        await self.finish_reply(session_id, session)
+        return self.state(session_id, session)
+
+    async def finish_reply(self, session_id, session):
+        """
+        Produce the session's pending reply, then persist the session. A
+        producer may block for seconds (a generation backend, 'simulated'),
+        so it runs in a thread and the event loop keeps serving the other
+        connections meanwhile.
+        """
+        if session.pending_reply is not None:
+            await asyncio.get_running_loop().run_in_executor(None, complete_reply, session)
+        self.sessions.commit(session_id)
+
+    def schedule_reminder(self, session_id, session):
+        """Schedule the reminder the current step promises, replacing a pending one"""
+        flow = REMINDER_STEPS.get((session.conversation_flow, session.conversation_step))
+        if flow is None or self.reminders is None:
+            return
+        self.cancel_reminder(session)
+        due = next_monday(time.time())
+        session.reminder = {
+            'id': self.reminders.schedule(due, session_id=session_id, flow=flow),
+            'flow': flow,
+            'due': due
+        }
+
+    def cancel_reminder(self, session):
+        """
+        Drop the session's pending reminder. Without a scheduler (no
+        --reminders) one restored from disk is only forgotten.
+        """
+        if session.reminder and self.reminders is not None:
+            self.reminders.cancel(session.reminder['id'])
+        session.reminder = None
+
+    def fire_reminders(self, reminders):
+        """
+        Restart the reminded flow in each reminder's session. Returns the
+        ids of the restarted sessions, whose replies are still pending.
+        """
+        restarted = []
+        for reminder in reminders:
+            try:
+                session = self.sessions.get(reminder['session_id'])
+            except KeyError:
+                metrics.count('reminders_expired')     # session purged meanwhile
+                continue
+            if session.reminder is None or session.reminder['id'] != reminder['id']:
+                continue
+            session.reminder = None
+            prediction = self.predictions.get_or_compute(
+                session.user_profile, self.model.version, self.model.predict)
+            start_conversation(session, reminder['flow'], prediction)
+            self.sessions.commit(reminder['session_id'])
+            restarted.append(reminder['session_id'])
+            metrics.count('reminders_fired', flow=reminder['flow'])
+        return restarted
+
+    async def remind_forever(self, interval):
+        """Fire due reminders a batch at a time, serving requests in between"""
+        while True:
+            await asyncio.sleep(interval)
+            while True:
+                due = self.reminders.next_due()
+                if due is None or due > time.time():
+                    break
+                restarted = []
+                self.reminders.run_due(
+                    lambda batch: restarted.extend(self.fire_reminders(batch)), max_batches=1)
+                await asyncio.gather(*(
+                    self.finish_reply(session_id, self.sessions.get(session_id))
+                    for session_id in restarted))
+                await asyncio.sleep(0)
+
+    async def evict_forever(self, interval):
+        """
+        Periodically drop idle sessions from memory, old ones from disk and
+        catalog versions no session uses any more
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self.sessions.evict_idle()
+            self.sessions.backend.purge(self.retention)
+            release_catalog_versions(self.sessions)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            method, path, headers = await read_request_head(reader)
+            parts = [p for p in path.split('?', 1)[0].split('/') if p]
+
+            if headers.get('upgrade', '').lower() == 'websocket':
+                if len(parts) != 3 or parts[0] != 'sessions' or parts[2] != 'ws':
+                    raise HTTPError(404, f"No WebSocket endpoint at {path}")
+                self.session(parts[1])
+                await accept_websocket(writer, headers)
+                await self.websocket_loop(parts[1], reader, writer)
+                return
+
+            body = await read_json_body(reader, headers)
+            if parts == ['health']:
+                result = {'worker': self.worker_index, 'sessions': len(self.sessions)}
+            elif parts == ['sessions'] and method == 'POST':
+                result = self.create_session(body)
+            elif len(parts) == 2 and parts[0] == 'sessions' and method == 'GET':
+                result = await self.act(parts[1], 'state', body)
+            elif len(parts) == 3 and parts[0] == 'sessions' and method == 'POST':
+                result = await self.act(parts[1], parts[2], body)
+            else:
+                raise HTTPError(404, f"No endpoint for {method} {path}")
+            await write_response(writer, 200, result)
+        except HTTPError as e:
+            await write_response(writer, e.status, {'error': str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            self.report_error(e)
+            await write_response(writer, 500, {'error': "Internal server error"})
+        finally:
+            writer.close()
+
+    def report_error(self, error):
+        """Count and log an unexpected error; the client gets a 500"""
+        metrics.count('server_errors')
+        asyncio.get_running_loop().call_exception_handler({
+            'message': "Unhandled error serving a request",
+            'exception': error
+        })
+
+    async def websocket_loop(self, session_id, reader, writer):
+        while True:
+            opcode, payload = await read_frame(reader)
+            if opcode == 0x8:
+                await write_frame(writer, 0x8, payload[:2])
+                return
+            if opcode == 0x9:
+                await write_frame(writer, 0xA, payload)
+                continue
+            if opcode != 0x1:
+                continue
+            try:
+                body = json.loads(payload)
+                result = await self.act(session_id, body.get('action', 'state'), body)
+            except HTTPError as e:
+                result = {'error': str(e), 'status': e.status}
+            except (ValueError, AttributeError, TypeError):
+                result = {'error': "Frames must be JSON objects", 'status': 400}
+            except Exception as e:
+                self.report_error(e)
+                result = {'error': "Internal server error", 'status': 500}
+            await write_frame(writer, 0x1, json.dumps(result).encode('utf-8'))
+
+
+# ----------------------------------------------------------------------------
+# HTTP / WebSocket plumbing
+# ----------------------------------------------------------------------------
+
+async def read_request_head(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, path, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return method, path, headers
+
+
+async def read_json_body(reader, headers):
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise HTTPError(400, "Malformed Content-Length")
+    if length > MAX_BODY:
+        raise HTTPError(413, "Request body too large")
+    if not length:
+        return {}
+    try:
+        body = json.loads(await reader.readexactly(length))
+    except ValueError:
+        raise HTTPError(400, "Body must be JSON")
+    if not isinstance(body, dict):
+        raise HTTPError(400, "Body must be a JSON object")
+    return body
+
+
+async def write_response(writer, status, result):
+    body = json.dumps(result).encode('utf-8')
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+              500: 'Internal Server Error'}
+    writer.write(
+        f"HTTP/1.1 {status} {reason.get(status, '')}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode('latin-1') + body
+    )
+    await writer.drain()
+
+
+async def accept_websocket(writer, headers):
+    key = headers.get('sec-websocket-key')
+    if not key:
+        raise HTTPError(400, "Missing Sec-WebSocket-Key")
+    accept = base64.b64encode(hashlib.sha1(key.encode('latin-1') + WEBSOCKET_GUID).digest())
+    writer.write(
+        b"HTTP/1.1 101 Switching Protocols\r\n"
+        b"Upgrade: websocket\r\n"
+        b"Connection: Upgrade\r\n"
+        b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+    )
+    await writer.drain()
+
+
+async def read_frame(reader):
+    """Read one (unfragmented) client frame; returns (opcode, payload)"""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    if length > MAX_BODY:
+        raise ConnectionError("WebSocket frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return first & 0x0F, payload
+
+
+async def write_frame(writer, opcode, payload):
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 1 << 16:
+        header += bytes([126]) + struct.pack('!H', len(payload))
+    else:
+        header += bytes([127]) + struct.pack('!Q', len(payload))
+    writer.write(header + payload)
+    await writer.drain()
+
+
+# ----------------------------------------------------------------------------
+# Workers and sticky routing
+# ----------------------------------------------------------------------------
+
+async def serve(host, port, worker_index=0, ttl=1800, session_db=None, reminder_dir=None,
+                transcript=None):
+    server = ConversationServer(worker_index, ttl, session_db, reminder_dir=reminder_dir,
+                                transcript=transcript)
+    tasks = [asyncio.ensure_future(server.evict_forever(min(ttl, 60)))]
+    if server.reminders:
+        tasks.append(asyncio.ensure_future(server.remind_forever(5)))
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def run_worker(host, port, worker_index, ttl, session_db, reminder_dir, transcript):
+    metrics.start_worker_exporters(worker_index)
+    asyncio.run(serve(host, port, worker_index, ttl, session_db, reminder_dir, transcript))
+
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def route(host, port, worker_ports):
+    """
+    Forward each connection to a worker: new sessions round-robin, existing
+    ones to the worker named by their session id prefix.
+    """
+    next_worker = itertools.cycle(range(len(worker_ports)))
+
+    async def handle(reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        path = head.split(b' ', 2)[1].decode('latin-1') if head.count(b' ') >= 2 else '/'
+        parts = [p for p in path.split('?', 1)[0].split('/') if p]
+
+        worker = None
+        if len(parts) >= 2 and parts[0] == 'sessions':
+            prefix = parts[1].split('.', 1)[0]
+            if prefix.isdigit() and int(prefix) < len(worker_ports):
+                worker = int(prefix)
+        if worker is None:
+            worker = next(next_worker)
+
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(
+                '127.0.0.1', worker_ports[worker])
+        except OSError:
+            writer.close()
+            return
+        upstream_writer.write(head)
+        await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer))
+
+    listener = await asyncio.start_server(handle, host, port)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Rafiq conversations over HTTP/WebSocket")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--ttl', type=float, default=1800,
+                        help="seconds before an idle session is evicted from memory")
+    parser.add_argument('--session-db', help="SQLite file to persist sessions in")
+    parser.add_argument('--reminders', help="directory to keep scheduled reminders in")
+    parser.add_argument('--transcript', help="JSONL file to append every request to")
+    args = parser.parse_args()
+
+    def reminder_dir(worker_index):
+        # Each worker fires the reminders of the sessions it owns
+        return args.reminders and os.path.join(args.reminders, f'worker{worker_index}')
+
+    if args.workers <= 1:
+        asyncio.run(serve(args.host, args.port, 0, args.ttl, args.session_db, reminder_dir(0),
+                          args.transcript))
+        return
+
+    worker_ports = [args.port + 1 + i for i in range(args.workers)]
+    workers = [
+        multiprocessing.Process(target=run_worker, daemon=True, args=(
+            '127.0.0.1', p, i, args.ttl, args.session_db, reminder_dir(i), args.transcript))
+        for i, p in enumerate(worker_ports)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        asyncio.run(route(args.host, args.port, worker_ports))
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == "__main__":
+    main()
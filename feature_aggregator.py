@@ -0,0 +1,302 @@
+"""
+Incremental model features from the raw activity event stream.
+
+Events are (user_id, type, ts) records, ts in seconds since the epoch,
+with a `job_id` on apply events and a `skill` on skill_added events:
+
+    view          an employer viewed the user's CV
+    login         the user logged in
+    search        the user ran a job search
+    apply         the user applied to a job
+    cv_refresh    the user refreshed their CV
+    skill_added   the user added a skill to their profile
+
+Windowed counts are kept per user as a ring of daily buckets plus a
+running total: views, logins and searches over the last 7 days, to match
+the "this week" copy and the weekly thresholds of the scoring rules, and
+applications over the last 30. An event adds to one bucket; moving a user
+forward in time clears at most `window` buckets, so the cost per event is
+bounded by the window length, never by the user's history. All users
+live in shared NumPy arrays and events are applied a batch at a time.
+
+Every user touched by a batch is marked dirty. rescore() scores exactly
+the dirty users and clears the marks, so users without new activity are
+neither re-aggregated nor re-scored. Counts that only change because time
+passed (views ageing out of the week) are picked up by the nightly
+campaign, not here.
+
+    python feature_aggregator.py events.jsonl predictions.jsonl --chunk-size 100000
+"""
+import argparse
+import json
+
+import numpy as np
+
+import metrics
+from rafiq_core import MODEL_FEATURES, batch_ml_prediction, open_profile_store
+
+EVENT_TYPES = ('view', 'login', 'search', 'apply', 'cv_refresh', 'skill_added')
+
+# feature -> (event type, window in days)
+WINDOWED_FEATURES = {
+    'emp_cv_views_last_week': ('view', 7),
+    'login_count': ('login', 7),
+    'job_searches': ('search', 7),
+    'applications_count': ('apply', 30)
+}
+
+# feature -> (event type, payload key whose distinct values are counted)
+DISTINCT_FEATURES = {
+    'unique_jobs_applied': ('apply', 'job_id'),
+    'unique_skills_added': ('skill_added', 'skill')
+}
+
+DERIVED_FEATURES = (
+    tuple(WINDOWED_FEATURES) + tuple(DISTINCT_FEATURES)
+    + ('cv_refresh_count', 'days_since_last_refresh')
+)
+
+DAY_SECONDS = 86400
+
+_TYPE_CODES = {t: i for i, t in enumerate(EVENT_TYPES)}
+
+
+class WindowCounter:
+    """Per-user event counts over the last `window` days, in daily buckets"""
+
+    def __init__(self, window, capacity):
+        self.window = window
+        self.buckets = np.zeros((capacity, window), dtype=np.int32)
+        self.total = np.zeros(capacity, dtype=np.int64)
+        self.head = np.zeros(capacity, dtype=np.int64)     # newest day seen per user
+
+    def grow(self, capacity):
+        extra = capacity - len(self.total)
+        self.buckets = np.concatenate([self.buckets, np.zeros((extra, self.window), np.int32)])
+        self.total = np.concatenate([self.total, np.zeros(extra, np.int64)])
+        self.head = np.concatenate([self.head, np.zeros(extra, np.int64)])
+
+    def advance(self, rows, days):
+        """Move each row's window forward to end on days (rows must be unique)"""
+        head = self.head[rows]
+        gap = np.minimum(days - head, self.window)
+        for step in range(1, self.window + 1):
+            expiring = gap >= step
+            if not expiring.any():
+                break
+            r = rows[expiring]
+            slot = (head[expiring] + step) % self.window
+            self.total[r] -= self.buckets[r, slot]
+            self.buckets[r, slot] = 0
+        self.head[rows] = np.maximum(head, days)
+
+    def add(self, rows, days):
+        """Count one event per (row, day); events already out of the window are dropped"""
+        unique, inverse = np.unique(rows, return_inverse=True)
+        newest = np.full(len(unique), np.iinfo(np.int64).min)
+        np.maximum.at(newest, inverse, days)
+        self.advance(unique, newest)
+
+        live = days > self.head[rows] - self.window
+        np.add.at(self.buckets, (rows[live], days[live] % self.window), 1)
+        np.add.at(self.total, rows[live], 1)
+
+    def counts(self, rows, day):
+        """Counts for the window ending on day"""
+        unique = np.unique(rows)
+        self.advance(unique, np.full(len(unique), day))
+        return self.total[rows]
+
+
+class FeatureAggregator:
+    """Derived features for every user seen so far, plus the dirty set"""
+
+    def __init__(self, capacity=1024):
+        self._rows = {}             # user id -> row
+        self._user_ids = []
+        self._capacity = capacity
+        self.windows = {
+            feature: WindowCounter(window, capacity)
+            for feature, (_, window) in WINDOWED_FEATURES.items()
+        }
+        self.cv_refresh_count = np.zeros(capacity, dtype=np.int64)
+        # Day of the last refresh; first day seen until the user refreshes
+        self.last_refresh_day = np.zeros(capacity, dtype=np.int64)
+        self.distinct = {feature: {} for feature in DISTINCT_FEATURES}    # row -> set
+        self.distinct_seeded = {feature: {} for feature in DISTINCT_FEATURES}   # row -> count
+        self.dirty = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    def __contains__(self, user_id):
+        return user_id in self._rows
+
+    def _row_for(self, user_id, day):
+        row = self._rows.get(user_id)
+        if row is None:
+            row = len(self._user_ids)
+            if row == self._capacity:
+                self._grow(self._capacity * 2)
+            self._rows[user_id] = row
+            self._user_ids.append(user_id)
+            self.last_refresh_day[row] = day
+        return row
+
+    def _grow(self, capacity):
+        extra = capacity - self._capacity
+        for counter in self.windows.values():
+            counter.grow(capacity)
+        self.cv_refresh_count = np.concatenate([self.cv_refresh_count, np.zeros(extra, np.int64)])
+        self.last_refresh_day = np.concatenate([self.last_refresh_day, np.zeros(extra, np.int64)])
+        self.dirty = np.concatenate([self.dirty, np.zeros(extra, bool)])
+        self._capacity = capacity
+
+    def add_user(self, user_id, now):
+        """Start tracking a user first seen at `now`, before any of their events"""
+        self._row_for(user_id, int(now // DAY_SECONDS))
+
+    def seed(self, user_id, profile, now):
+        """
+        Start a user from a profile snapshot taken at `now`. Only lifetime
+        features carry over; windowed counts need the events themselves.
+        """
+        day = int(now // DAY_SECONDS)
+        row = self._row_for(user_id, day)
+        self.cv_refresh_count[row] = profile.get('cv_refresh_count', 0)
+        self.last_refresh_day[row] = day - profile.get('days_since_last_refresh', 0)
+        for feature in DISTINCT_FEATURES:
+            # Only the count is known, not the values behind it
+            self.distinct_seeded[feature][row] = profile.get(feature, 0)
+        self.dirty[row] = True
+
+    @metrics.timed('ingest_events')
+    def ingest(self, events):
+        """Apply a batch of event dicts; returns how many were applied"""
+        rows, types, days = [], [], []
+        for event in events:
+            code = _TYPE_CODES.get(event['type'])
+            if code is None:
+                continue
+            day = int(event['ts'] // DAY_SECONDS)
+            row = self._row_for(event['user_id'], day)
+            rows.append(row)
+            types.append(code)
+            days.append(day)
+
+            if event['type'] == 'cv_refresh':
+                self.cv_refresh_count[row] += 1
+                self.last_refresh_day[row] = max(self.last_refresh_day[row], day)
+            for feature, (event_type, key) in DISTINCT_FEATURES.items():
+                if event['type'] == event_type and event.get(key) is not None:
+                    self.distinct[feature].setdefault(row, set()).add(event[key])
+
+        if not rows:
+            return 0
+        rows = np.asarray(rows, dtype=np.int64)
+        types = np.asarray(types)
+        days = np.asarray(days, dtype=np.int64)
+        for feature, (event_type, _) in WINDOWED_FEATURES.items():
+            of_type = types == _TYPE_CODES[event_type]
+            if of_type.any():
+                self.windows[feature].add(rows[of_type], days[of_type])
+        self.dirty[rows] = True
+        return len(rows)
+
+    def feature_columns(self, user_ids, now):
+        """Derived feature columns for known users, as of `now`"""
+        day = int(now // DAY_SECONDS)
+        rows = np.asarray([self._rows[u] for u in user_ids], dtype=np.int64)
+        columns = {
+            feature: counter.counts(rows, day)
+            for feature, counter in self.windows.items()
+        }
+        for feature in DISTINCT_FEATURES:
+            values = self.distinct[feature]
+            seeded = self.distinct_seeded[feature]
+            columns[feature] = np.asarray(
+                [len(values.get(r, ())) + seeded.get(r, 0) for r in rows.tolist()], dtype=np.int64)
+        columns['cv_refresh_count'] = self.cv_refresh_count[rows]
+        columns['days_since_last_refresh'] = np.maximum(day - self.last_refresh_day[rows], 0)
+        return columns
+
+    def features(self, user_id, now):
+        """One user's derived features as a plain dict"""
+        return {f: int(c[0]) for f, c in self.feature_columns([user_id], now).items()}
+
+    def drain_dirty(self):
+        """User ids with activity since the last drain, clearing their marks"""
+        rows = np.flatnonzero(self.dirty[:len(self._user_ids)])
+        self.dirty[rows] = False
+        return [self._user_ids[r] for r in rows.tolist()]
+
+    def rescore(self, profiles, now, predict_batch=batch_ml_prediction, features=MODEL_FEATURES):
+        """
+        Score the dirty users in one batch. Features not derived from events
+        (e.g. profile_completeness) come from profiles[user_id]. Returns
+        (user_ids, batch prediction) with rows in user_ids order.
+        """
+        user_ids = self.drain_dirty()
+        if not user_ids:
+            return [], None
+        derived = self.feature_columns(user_ids, now)
+        columns = {
+            f: derived[f] if f in derived else [profiles[u][f] for u in user_ids]
+            for f in features
+        }
+        return user_ids, predict_batch(columns)
+
+
+def read_event_chunks(path, chunk_size):
+    """Lists of up to chunk_size events from a JSONL file"""
+    with open(path, 'rb') as f:
+        chunk = []
+        for line in f:
+            if line.strip():
+                chunk.append(json.loads(line))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an event stream and rescore users as it goes")
+    parser.add_argument('events', help="JSONL events in time order: user_id, type, ts")
+    parser.add_argument('output', help="JSONL file to write each rescoring to")
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help="events applied between rescorings")
+    args = parser.parse_args()
+
+    # Non-event features come from the profile store ($RAFIQ_PROFILE_STORE)
+    profiles = open_profile_store()
+    aggregator = FeatureAggregator()
+    total_events = total_scored = 0
+
+    with open(args.output, 'w', encoding='utf-8') as out:
+        for chunk in read_event_chunks(args.events, args.chunk_size):
+            known = [e for e in chunk if e['user_id'] in profiles]
+            for event in known:
+                # Lifetime counts start from the stored profile
+                if event['user_id'] not in aggregator:
+                    aggregator.seed(event['user_id'], profiles[event['user_id']], event['ts'])
+            total_events += aggregator.ingest(known)
+            now = max(e['ts'] for e in chunk)
+            user_ids, batch = aggregator.rescore(profiles, now)
+            for user_id, nudge, confidence in zip(user_ids, batch['nudge'].tolist() if batch else (),
+                                                  batch['confidence'].tolist() if batch else ()):
+                out.write(json.dumps({
+                    'user_id': user_id,
+                    'ts': now,
+                    'nudge': nudge,
+                    'confidence': confidence
+                }) + '\n')
+            total_scored += len(user_ids)
+
+    print(f"Applied {total_events} events, rescored {total_scored} times "
+          f"for {len(aggregator)} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Job matching against a catalog of postings.
+
+The catalog is a JSONL file, one posting per line:
+
+    {"id": "j1042", "title": "Senior Data Analyst", "company": "DataCo",
+     "industry": "Data Analytics", "skills": ["Python", "SQL", "Tableau"],
+     "optional": ["Hadoop"], "posted": 1760000000, "min_years": 5,
+     "salary": "$95K-115K", "location": "Remote", "highlights": [...]}
+
+Building the index reads the file once. Postings are grouped by industry,
+and each posting becomes a sparse vector over its required skills. The
+vector is stored transposed: for every skill, the rows of the postings
+that require it and that skill's share of the posting's requirements. A
+share is idf-weighted, so rare skills count for more than "Communication",
+and a posting's shares sum to 1. A user's match with every posting in
+their industry is then one bincount over the inverted lists of the skills
+they have.
+
+Ranking blends the match with freshness, which halves every
+FRESHNESS_HALF_LIFE_DAYS. Only the selected postings are decoded, straight
+from the memory-mapped catalog. The arrays are saved next to the catalog
+(CATALOG.index.npz) and reused while the catalog file is unchanged.
+"""
+import json
+import mmap
+import os
+import time
+
+import numpy as np
+
+# Weight of the skill match in the ranking; the rest goes to freshness
+MATCH_WEIGHT = 0.75
+FRESHNESS_HALF_LIFE_DAYS = 7
+
+_INDEX_VERSION = 1
+
+
+def _skill_key(skill):
+    return skill.strip().casefold()
+
+
+class JobIndex:
+    """Sparse skill index over a postings catalog"""
+
+    def __init__(self, path, arrays):
+        self.path = path
+        self.starts = arrays['starts']          # byte range of each posting's line
+        self.ends = arrays['ends']
+        self.posted = arrays['posted']
+        self.indptr = arrays['indptr']          # skill id -> slice of inv_rows/inv_share
+        self.inv_rows = arrays['inv_rows']
+        self.inv_share = arrays['inv_share']
+        self.skill_ids = {skill: i for i, skill in enumerate(arrays['skills'].tolist())}
+        self.industry_ranges = {
+            name: (int(start), int(end))
+            for name, start, end in zip(arrays['industries'].tolist(),
+                                        arrays['industry_start'], arrays['industry_end'])
+        }
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.rows else b''
+
+    @property
+    def rows(self):
+        return len(self.posted)
+
+    @classmethod
+    def from_file(cls, path, cache=True):
+        """Open the index for a catalog, building (and caching) it if needed"""
+        stat = os.stat(path)
+        signature = np.asarray([_INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        cache_path = path + '.index.npz'
+        if cache and os.path.exists(cache_path):
+            with np.load(cache_path, allow_pickle=False) as saved:
+                if np.array_equal(saved['signature'], signature):
+                    return cls(path, {name: saved[name] for name in saved.files})
+
+        arrays = build_arrays(path)
+        if cache:
+            tmp_path = cache_path + '.tmp.npz'
+            np.savez(tmp_path, signature=signature, **arrays)
+            os.replace(tmp_path, cache_path)
+        return cls(path, arrays)
+
+    def posting(self, row):
+        """Decode one posting from the catalog"""
+        return json.loads(self._data[self.starts[row]:self.ends[row]])
+
+    def match(self, skills, industry, k=3, now=None, exclude_ids=()):
+        """
+        The k best postings for someone with `skills` in `industry`, as
+        posting dicts with 'match' (0-1 share of the requirements covered)
+        and 'age_days' added. Falls back to the whole catalog for an
+        industry with fewer than k postings.
+        """
+        now = time.time() if now is None else now
+        start, end = self.industry_ranges.get(industry, (0, self.rows))
+        if end - start < k:
+            start, end = 0, self.rows
+        if end == start:
+            return []
+
+        rows, shares = [], []
+        for skill_id in {self.skill_ids.get(_skill_key(s)) for s in skills} - {None}:
+            lo, hi = self.indptr[skill_id], self.indptr[skill_id + 1]
+            skill_rows = self.inv_rows[lo:hi]
+            # Inverted lists are sorted, so the industry is a contiguous slice
+            a, b = np.searchsorted(skill_rows, (start, end))
+            rows.append(skill_rows[a:b])
+            shares.append(self.inv_share[lo + a:lo + b])
+        if rows:
+            match = np.bincount(np.concatenate(rows) - start, weights=np.concatenate(shares),
+                                minlength=end - start)
+        else:
+            match = np.zeros(end - start)
+
+        age_days = np.maximum(now - self.posted[start:end], 0) / 86400
+        rank = MATCH_WEIGHT * match + (1 - MATCH_WEIGHT) * 0.5 ** (age_days / FRESHNESS_HALF_LIFE_DAYS)
+
+        exclude_ids = set(exclude_ids)
+        take = min(k + len(exclude_ids), end - start)
+        best = np.argpartition(-rank, take - 1)[:take]
+        best = best[np.argsort(-rank[best], kind='stable')]
+
+        results = []
+        for i in best.tolist():
+            posting = self.posting(start + i)
+            if posting.get('id') in exclude_ids:
+                continue
+            posting['match'] = float(min(match[i], 1.0))
+            posting['age_days'] = int(age_days[i])
+            results.append(posting)
+            if len(results) == k:
+                break
+        return results
+
+
+def build_arrays(path):
+    """Scan a catalog and build the index arrays"""
+    industries, skill_lists, posted, starts, ends = [], [], [], [], []
+    with open(path, 'rb') as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                posting = json.loads(line)
+                industries.append(posting['industry'])
+                skill_lists.append(dict.fromkeys(_skill_key(s) for s in posting['skills']))
+                posted.append(posting['posted'])
+                starts.append(offset)
+                ends.append(offset + len(line))
+            offset += len(line)
+
+    # Group postings by industry; within one, keep file order
+    names, codes = np.unique(np.asarray(industries, dtype=str), return_inverse=True)
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    industry_start = np.searchsorted(sorted_codes, np.arange(len(names)), side='left')
+    industry_end = np.searchsorted(sorted_codes, np.arange(len(names)), side='right')
+
+    # Skill ids and idf weights
+    vocabulary = {}
+    for skills in skill_lists:
+        for skill in skills:
+            vocabulary.setdefault(skill, len(vocabulary))
+    entry_rows, entry_skills = [], []
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    for row, skills in zip(position.tolist(), skill_lists):
+        entry_rows.extend([row] * len(skills))
+        entry_skills.extend(vocabulary[s] for s in skills)
+    entry_rows = np.asarray(entry_rows, dtype=np.int64)
+    entry_skills = np.asarray(entry_skills, dtype=np.int64)
+
+    doc_freq = np.bincount(entry_skills, minlength=len(vocabulary))
+    idf = np.log1p(len(order) / np.maximum(doc_freq, 1))
+    weight = idf[entry_skills]
+    row_total = np.bincount(entry_rows, weights=weight, minlength=len(order))
+    share = weight / row_total[entry_rows]
+
+    # Transpose to per-skill lists, rows ascending within each skill
+    by_skill = np.lexsort((entry_rows, entry_skills))
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(doc_freq, out=indptr[1:])
+
+    return {
+        'starts': np.asarray(starts, dtype=np.int64)[order],
+        'ends': np.asarray(ends, dtype=np.int64)[order],
+        'posted': np.asarray(posted, dtype=np.float64)[order],
+        'indptr': indptr,
+        'inv_rows': entry_rows[by_skill].astype(np.int32),
+        'inv_share': share[by_skill].astype(np.float32),
+        'skills': np.asarray(list(vocabulary), dtype=str),
+        'industries': names,
+        'industry_start': industry_start,
+        'industry_end': industry_end
+    }
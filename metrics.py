@@ -0,0 +1,245 @@
+"""
+Low-overhead timing histograms and counters for Rafiq's hot paths.
+
+Metrics are off unless RAFIQ_METRICS=1 is set when the process starts.
+Disabled, @timed returns the function untouched and timer() hands back a
+shared no-op context manager, so instrumented code pays nothing beyond a
+flag check.
+
+Enabled, they are exported as Prometheus text:
+    RAFIQ_METRICS_PORT=9108     serve GET /metrics on that port
+    RAFIQ_METRICS_FILE=path     rewrite the file every RAFIQ_METRICS_INTERVAL
+                                seconds (default 15)
+
+A server with worker processes (conversation_server --workers N) exports
+each worker on its own: worker i serves RAFIQ_METRICS_PORT + 1 + i and
+writes path.worker<i>, the way its requests are served on --port + 1 + i.
+The parent process keeps the base port and file.
+"""
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+ENABLED = os.environ.get('RAFIQ_METRICS', '') not in ('', '0')
+
+PREFIX = 'rafiq_'
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Bucket upper bounds: 1us to ~2 minutes, four buckets per doubling (~19% wide)
+BUCKET_BOUNDS = tuple(1e-6 * 2 ** (i / 4) for i in range(4 * 27))
+
+
+class Histogram:
+    """Fixed log-scale buckets; quantiles are read off the bucket bounds"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect_left(BUCKET_BOUNDS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.total += seconds
+            self.count += 1
+
+    def quantile(self, q):
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else float('inf')
+        return float('inf')
+
+
+class Counter:
+    """Monotonic counter split by label values"""
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values):
+        # Labels are exported as strings anyway; None (e.g. no flow yet)
+        # becomes '', so label tuples always sort
+        label_values = tuple('' if v is None else str(v) for v in label_values)
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + 1
+
+
+_histograms = {}
+_counters = {}
+
+
+def histogram(name, help_text=''):
+    if name not in _histograms:
+        _histograms[name] = Histogram(name, help_text or f"Time spent in {name}")
+    return _histograms[name]
+
+
+def counter(name, labels, help_text=''):
+    if name not in _counters:
+        _counters[name] = Counter(name, help_text or name.replace('_', ' '), labels)
+    return _counters[name]
+
+
+def timed(name):
+    """Decorator recording each call's duration (exceptions included)"""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        hist = histogram(name)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+_NOOP = contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def _timing(hist):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        hist.observe(time.perf_counter() - start)
+
+
+def timer(name):
+    """Context manager timing a block"""
+    return _timing(histogram(name)) if ENABLED else _NOOP
+
+
+def observe(name, seconds):
+    """Record a duration measured by the caller, e.g. across a generator"""
+    if ENABLED:
+        histogram(name).observe(seconds)
+
+
+def count(name, **labels):
+    """Increment a counter, e.g. count('nudges_started', flow='refresh_cv')"""
+    if ENABLED:
+        counter(name, tuple(labels)).inc(*labels.values())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for hist in list(_histograms.values()):
+        name = f'{PREFIX}{hist.name}_seconds'
+        lines.append(f'# HELP {name} {hist.help}')
+        lines.append(f'# TYPE {name} summary')
+        for q in QUANTILES:
+            lines.append(f'{name}{{quantile="{q}"}} {hist.quantile(q):.9g}')
+        lines.append(f'{name}_sum {hist.total:.9g}')
+        lines.append(f'{name}_count {hist.count}')
+    for ctr in list(_counters.values()):
+        name = f'{PREFIX}{ctr.name}_total'
+        lines.append(f'# HELP {name} {ctr.help}')
+        lines.append(f'# TYPE {name} counter')
+        with ctr._lock:
+            values = sorted(ctr.values.items())
+        for label_values, value in values:
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(ctr.labels, label_values))
+            lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def start_http_server(port, host='0.0.0.0'):
+    """Serve /metrics from a daemon thread"""
+    # Imported here: http.server is slow to import and most processes
+    # never export over HTTP
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def start_file_writer(path, interval=15.0):
+    """Atomically rewrite path with the current metrics every interval seconds"""
+    def write_forever():
+        while True:
+            time.sleep(interval)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(render_prometheus())
+            os.replace(tmp_path, path)
+    thread = threading.Thread(target=write_forever, name='metrics-file', daemon=True)
+    thread.start()
+    return thread
+
+
+def _start_exporters(worker=None):
+    port = os.environ.get('RAFIQ_METRICS_PORT')
+    if port:
+        try:
+            start_http_server(int(port) + (0 if worker is None else 1 + worker))
+        except OSError:
+            pass    # another process already serves this port
+    path = os.environ.get('RAFIQ_METRICS_FILE')
+    if path:
+        if worker is not None:
+            path = f'{path}.worker{worker}'
+        start_file_writer(path, float(os.environ.get('RAFIQ_METRICS_INTERVAL', 15)))
+
+
+def start_worker_exporters(worker):
+    """Export this worker process's metrics on its own port and file"""
+    if ENABLED:
+        _start_exporters(worker)
+
+
+def _in_child_process():
+    # A spawned multiprocessing child imports this module again; only the
+    # parent exports on import, workers call start_worker_exporters().
+    # Forked children share the parent's imported module and skip this.
+    mp = sys.modules.get('multiprocessing')
+    return mp is not None and mp.parent_process() is not None
+
+
+if ENABLED and not _in_child_process():
+    _start_exporters()
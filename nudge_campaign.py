@@ -0,0 +1,233 @@
+"""
+Offline nudge campaign: score a profile file and write one nudge per user.
+
+Reads profiles from a CSV (with header) or JSONL file in chunks, scores each
+chunk with the model the app uses (RAFIQ_MODEL_BACKEND), renders the chosen
+flow's 'initial' message and writes one JSON line per user:
+
+    {"user_id": ..., "nudge": ..., "confidence": ..., "message": ...}
+
+Memory stays bounded: only a few chunks are in flight at any time, and with
+--workers N they are scored by a process pool but written back in input
+order, so the output is identical whatever the worker count.
+
+After every chunk the input/output byte offsets are checkpointed (to
+OUTPUT.ckpt by default). If the job dies, running the same command again
+truncates the output to the last checkpoint and carries on from there.
+
+    python nudge_campaign.py profiles.jsonl nudges.jsonl --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from rafiq_core import (
+    NUMERIC_PROFILE_FIELDS,
+    format_message,
+    open_catalog,
+    open_model,
+)
+
+
+def detect_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+class _CountedLines:
+    """
+    A binary file's lines, decoded, counting the bytes read. csv pulls a
+    line at a time, so after each record offset is where the next starts,
+    even when a quoted field spans lines.
+    """
+
+    def __init__(self, f, offset):
+        self._f = f
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self._f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode('utf-8')
+
+
+def read_header(path, fmt):
+    """CSV field names and the byte offset where the data starts"""
+    if fmt != 'csv':
+        return None, 0
+    with open(path, 'rb') as f:
+        lines = _CountedLines(f, 0)
+        return next(csv.reader(lines)), lines.offset
+
+
+def read_chunks(path, fmt, fieldnames, start_offset, chunk_size):
+    """
+    Yield (end_offset, records) for consecutive chunks of input, starting
+    at a byte offset: CSV rows as dicts of strings, JSONL lines unparsed,
+    so the rest of the parsing happens in the workers.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start_offset)
+        lines = _CountedLines(f, start_offset)
+        if fmt == 'csv':
+            records = csv.DictReader(lines, fieldnames=fieldnames)
+        else:
+            records = (line for line in lines if line.strip())
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == chunk_size:
+                yield lines.offset, chunk
+                chunk = []
+        if chunk:
+            yield lines.offset, chunk
+
+
+def parse_records(records, fmt):
+    """Profile dicts with integer features from a chunk's records"""
+    if fmt != 'csv':
+        return [json.loads(line) for line in records]
+    for row in records:
+        # Only the columns the file has; the model and templates say
+        # which ones they need
+        for field in NUMERIC_PROFILE_FIELDS:
+            if row.get(field) not in (None, ''):
+                row[field] = int(row[field])
+    return records
+
+
+@lru_cache(maxsize=None)
+def _model():
+    """The configured scoring backend, loaded once per process"""
+    return open_model()
+
+
+def score_chunk(records, fmt):
+    """Score one chunk and return its output as encoded JSON lines"""
+    profiles = parse_records(records, fmt)
+    if not profiles:
+        return b''
+
+    model = _model()
+    batch = model.predict_batch({f: [p[f] for p in profiles] for f in model.features})
+    # Decoded from the shared catalog once per chunk, not once per profile
+    catalog = open_catalog().current
+    templates = {nudge: catalog.template(nudge, 'initial') for nudge in set(batch['nudge'].tolist())}
+
+    out = []
+    for profile, nudge, confidence in zip(profiles, batch['nudge'].tolist(),
+                                          batch['confidence'].tolist()):
+        message = format_message(
+            templates[nudge],
+            profile,
+            confidence=int(confidence * 100)
+        )
+        out.append(json.dumps({
+            'user_id': profile['user_id'],
+            'nudge': nudge,
+            'confidence': confidence,
+            'message': message
+        }, ensure_ascii=False))
+    return ('\n'.join(out) + '\n').encode('utf-8')
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    """Atomically replace the checkpoint file"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def scored_chunks(chunks, fmt, workers):
+    """
+    Yield (end_offset, output) in input order. With more than one worker,
+    up to 2 * workers chunks are scored concurrently.
+    """
+    if workers <= 1:
+        for end_offset, records in chunks:
+            yield end_offset, score_chunk(records, fmt)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for end_offset, records in chunks:
+            in_flight.append((end_offset, pool.submit(score_chunk, records, fmt)))
+            if len(in_flight) >= 2 * workers:
+                end_offset, future = in_flight.popleft()
+                yield end_offset, future.result()
+        while in_flight:
+            end_offset, future = in_flight.popleft()
+            yield end_offset, future.result()
+
+
+def run_campaign(input_path, output_path, fmt=None, chunk_size=10000, workers=1,
+                 checkpoint_path=None):
+    """Run (or resume) a campaign and return the number of users written"""
+    fmt = fmt or detect_format(input_path)
+    checkpoint_path = checkpoint_path or output_path + '.ckpt'
+    fieldnames, data_offset = read_header(input_path, fmt)
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is None:
+        checkpoint = {'input_offset': data_offset, 'output_offset': 0, 'rows': 0}
+        open(output_path, 'wb').close()
+
+    with open(output_path, 'r+b') as out:
+        # Drop anything written after the last checkpoint
+        out.truncate(checkpoint['output_offset'])
+        out.seek(checkpoint['output_offset'])
+
+        chunks = read_chunks(input_path, fmt, fieldnames, checkpoint['input_offset'], chunk_size)
+        for end_offset, output in scored_chunks(chunks, fmt, workers):
+            out.write(output)
+            out.flush()
+            os.fsync(out.fileno())
+            checkpoint = {
+                'input_offset': end_offset,
+                'output_offset': out.tell(),
+                'rows': checkpoint['rows'] + output.count(b'\n')
+            }
+            save_checkpoint(checkpoint_path, checkpoint)
+
+    os.remove(checkpoint_path)
+    return checkpoint['rows']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a profile file and write per-user nudges")
+    parser.add_argument('input', help="profiles as .csv (with header) or .jsonl")
+    parser.add_argument('output', help="JSONL file to write nudges to")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help="input format (default: from the file extension)")
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes scoring chunks in parallel")
+    parser.add_argument('--checkpoint', help="checkpoint file (default: OUTPUT.ckpt)")
+    args = parser.parse_args()
+
+    rows = run_campaign(args.input, args.output, args.format, args.chunk_size,
+                        args.workers, args.checkpoint)
+    print(f"Wrote {rows:,} nudges to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Append-only log of served nudges and their observed outcomes.
+
+Two kinds of JSON lines:
+
+    {"kind": "served", "id": "...", "user_id": "...", "nudge": "refresh_cv",
+     "confidence": 0.41, "expected_outcome": "emp_cv_views", "ts": 1760000000.0}
+    {"kind": "outcome", "id": "...", "user_id": "...", "nudge": "refresh_cv",
+     "confidence": 0.41, "outcome": "completed", "hit": true, "ts": 1760000100.0}
+
+Outcome lines repeat the user, nudge and confidence of the serve they
+belong to, so the report needs no join: a single pass keeps a few counters per
+(nudge, outcome, confidence bin) however large the log is. A serve without
+an outcome line counts as a miss. Log at most one outcome line per serve
+and outcome name.
+
+Logging never blocks the caller. served() and outcome() only append to an
+in-memory batch; a background thread encodes and writes batches every
+flush_interval seconds (sooner when batch_size records are waiting), one
+O_APPEND write per batch, so several processes can share one log. If the
+writer falls behind by max_pending records, new records are dropped and
+counted rather than queued.
+
+    python outcome_log.py outcomes.jsonl --bins 10
+"""
+import argparse
+import atexit
+import json
+import os
+import secrets
+import threading
+import time
+
+import metrics
+
+
+class OutcomeLog:
+    """Buffered writer for one log file"""
+
+    def __init__(self, path, flush_interval=1.0, batch_size=1000, max_pending=100000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = []
+        self._closed = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._thread = threading.Thread(target=self._run, name='outcome-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def served(self, nudge, confidence, expected_outcome, user_id=None):
+        """Log a nudge being shown; returns the record to pass to outcome()"""
+        record = {
+            'kind': 'served',
+            'id': secrets.token_hex(8),
+            'user_id': user_id,
+            'nudge': nudge,
+            'confidence': confidence,
+            'expected_outcome': expected_outcome,
+            'ts': time.time()
+        }
+        self._append(record)
+        return record
+
+    def outcome(self, served, outcome, hit=True):
+        """Log what was observed after a served nudge"""
+        self._append({
+            'kind': 'outcome',
+            'id': served['id'],
+            # Serves logged before user ids were recorded have none
+            'user_id': served.get('user_id'),
+            'nudge': served['nudge'],
+            'confidence': served['confidence'],
+            'outcome': outcome,
+            'hit': hit,
+            'ts': time.time()
+        })
+
+    def _append(self, record):
+        with self._lock:
+            if len(self._pending) >= self.max_pending or self._closed:
+                self.dropped += 1
+                metrics.count('outcome_log_dropped')
+                return
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._pending and not self._closed:
+                    self._wakeup.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        """Write everything buffered so far"""
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if batch and self._fd is not None:
+                data = b''.join(json.dumps(r, separators=(',', ':')).encode('utf-8') + b'\n'
+                                for r in batch)
+                while data:
+                    data = data[os.write(self._fd, data):]
+
+    def close(self):
+        """Flush and stop the writer; later records are dropped"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        with self._write_lock:
+            os.close(self._fd)
+            self._fd = None
+
+
+class CalibrationReport:
+    """Per-nudge hit rates and calibration curves, accumulated record by record"""
+
+    def __init__(self, bins=10):
+        self.bins = bins
+        self.served = {}        # nudge -> [count, sum p, sum p^2] per bin
+        self.hits = {}          # (nudge, outcome) -> [count, sum p] per bin
+
+    def _bin(self, confidence):
+        return min(max(int(confidence * self.bins), 0), self.bins - 1)
+
+    def add(self, record):
+        b = self._bin(record['confidence'])
+        p = record['confidence']
+        if record['kind'] == 'served':
+            counts = self.served.setdefault(record['nudge'], [[0, 0.0, 0.0] for _ in range(self.bins)])
+            counts[b][0] += 1
+            counts[b][1] += p
+            counts[b][2] += p * p
+        elif record['kind'] == 'outcome' and record.get('hit'):
+            counts = self.hits.setdefault((record['nudge'], record['outcome']),
+                                          [[0, 0.0] for _ in range(self.bins)])
+            counts[b][0] += 1
+            counts[b][1] += p
+
+    def report(self):
+        """
+        nudge -> {'served', 'mean_confidence', 'outcomes': outcome -> {'hits',
+        'hit_rate', 'brier', 'ece', 'curve': [(bin low, bin high, served,
+        mean confidence, hit rate)]}}
+        """
+        results = {}
+        for nudge, served in sorted(self.served.items()):
+            n = sum(c[0] for c in served)
+            sum_p = sum(c[1] for c in served)
+            sum_p2 = sum(c[2] for c in served)
+            outcomes = {}
+            for (hit_nudge, outcome), hits in sorted(self.hits.items()):
+                if hit_nudge != nudge:
+                    continue
+                h = sum(c[0] for c in hits)
+                curve = []
+                ece = 0.0
+                for b, ((count, bin_p, _), (bin_hits, _)) in enumerate(zip(served, hits)):
+                    if not count:
+                        continue
+                    mean_p, rate = bin_p / count, bin_hits / count
+                    curve.append((b / self.bins, (b + 1) / self.bins, count, mean_p, rate))
+                    ece += count / n * abs(mean_p - rate)
+                outcomes[outcome] = {
+                    'hits': h,
+                    'hit_rate': h / n,
+                    # mean (p - y)^2 expanded into the running sums
+                    'brier': (sum_p2 - 2 * sum(c[1] for c in hits) + h) / n,
+                    'ece': ece,
+                    'curve': curve
+                }
+            results[nudge] = {'served': n, 'mean_confidence': sum_p / n, 'outcomes': outcomes}
+        return results
+
+
+def read_log(path):
+    """Records of a log, streamed; a torn final line is skipped"""
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.endswith(b'\n'):
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibration report for an outcome log")
+    parser.add_argument('log', help="outcome log (JSONL)")
+    parser.add_argument('--bins', type=int, default=10)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = CalibrationReport(args.bins)
+    for record in read_log(args.log):
+        report.add(record)
+    results = report.report()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for nudge, summary in results.items():
+        print(f"{nudge}: served {summary['served']}, mean confidence {summary['mean_confidence']:.3f}")
+        for outcome, stats in summary['outcomes'].items():
+            print(f"  {outcome}: hit rate {stats['hit_rate']:.3f}, "
+                  f"Brier {stats['brier']:.4f}, ECE {stats['ece']:.4f}")
+            for low, high, count, mean_p, rate in stats['curve']:
+                print(f"    [{low:.1f}, {high:.1f})  n={count:<8d} predicted {mean_p:.3f}  observed {rate:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Process-wide LRU cache of model predictions, keyed on feature values.
+
+Two profiles with the same model features share one entry, whoever they
+belong to, and an entry stays valid until those features change. Every
+lookup carries the model version; when it differs from the version the
+cached entries were computed with, the cache empties itself first.
+"""
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """Bounded, thread-safe LRU cache with hit/miss/eviction counters"""
+
+    def __init__(self, features, maxsize=10000):
+        self.features = tuple(features)
+        self.maxsize = maxsize
+        self.model_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, profile):
+        """Canonical key: the feature values in a fixed order"""
+        return tuple(profile[f] for f in self.features)
+
+    def get_or_compute(self, profile, model_version, compute):
+        """
+        Return the cached prediction for profile's features, calling
+        compute(profile) on a miss. Cached predictions are shared between
+        sessions and must not be mutated.
+        """
+        key = self.key(profile)
+        with self._lock:
+            if model_version != self.model_version:
+                self._entries.clear()
+                self.model_version = model_version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        # Compute outside the lock; a concurrent miss on the same key just
+        # computes the same value twice
+        prediction = compute(profile)
+
+        with self._lock:
+            if model_version == self.model_version:
+                self._entries[key] = prediction
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return prediction
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'model_version': self.model_version,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
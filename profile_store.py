@@ -0,0 +1,237 @@
+"""
+Columnar, memory-mapped user profile store.
+
+A store is a directory holding one file per column:
+
+    meta.json            row count, numeric field names, industry dictionary
+    <field>.i4           one int32 per user for every numeric feature
+    industry.codes       one uint16 per user, indexing meta.json's industries
+    name.heap/.offsets   UTF-8 names back to back + int64 start offsets (n+1)
+    user_id.heap/.offsets  same layout for the user ids
+    skills.heap/.offsets   same layout, each user's skills joined by newlines
+    id_index.hash/.rows  user id hashes sorted, with the row of each hash
+
+Nothing is loaded up front: columns are np.memmap views, so opening a store
+with tens of millions of users costs a few page mappings. meta.json is
+written last, so a store whose writer crashed half way cannot be opened.
+"""
+import json
+import os
+from collections.abc import Mapping
+from hashlib import blake2b
+
+import numpy as np
+
+NUMERIC_DTYPE = np.dtype('<i4')
+CODE_DTYPE = np.dtype('<u2')
+OFFSET_DTYPE = np.dtype('<i8')
+HASH_DTYPE = np.dtype('<u8')
+
+# Profile fields stored outside the numeric columns
+STRING_FIELDS = ('name', 'industry', 'skills')
+
+# Variable-length fields, stored as a heap of bytes plus row offsets
+HEAPS = ('name', 'user_id', 'skills')
+
+
+def _id_hash(user_id):
+    """Stable 64-bit hash of a user id (hash() is salted per process)"""
+    return int.from_bytes(blake2b(user_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def write_profile_store(path, profiles, numeric_fields, chunk_size=65536):
+    """
+    Write (user_id, profile) pairs to a new store at path.
+    profiles can be any iterable, including a generator over a file too
+    large for memory; rows are buffered and flushed chunk_size at a time.
+    """
+    os.makedirs(path, exist_ok=True)
+    numeric_fields = tuple(numeric_fields)
+    industries = {}
+    hashes = []
+    rows = 0
+
+    files = {field: open(os.path.join(path, f'{field}.i4'), 'wb') for field in numeric_fields}
+    files['industry'] = open(os.path.join(path, 'industry.codes'), 'wb')
+    for heap in HEAPS:
+        files[f'{heap}.heap'] = open(os.path.join(path, f'{heap}.heap'), 'wb')
+        files[f'{heap}.offsets'] = open(os.path.join(path, f'{heap}.offsets'), 'wb')
+    heap_ends = dict.fromkeys(HEAPS, 0)
+
+    def flush(chunk):
+        for i, field in enumerate(numeric_fields):
+            np.asarray([row[1][i] for row in chunk], dtype=NUMERIC_DTYPE).tofile(files[field])
+        np.asarray([row[2] for row in chunk], dtype=CODE_DTYPE).tofile(files['industry'])
+        for heap, column in (('user_id', 0), ('name', 3), ('skills', 5)):
+            encoded = [row[column] for row in chunk]
+            lengths = np.fromiter((len(b) for b in encoded), dtype=OFFSET_DTYPE, count=len(encoded))
+            ends = heap_ends[heap] + np.cumsum(lengths)
+            ends.tofile(files[f'{heap}.offsets'])
+            files[f'{heap}.heap'].write(b''.join(encoded))
+            if len(ends):
+                heap_ends[heap] = int(ends[-1])
+        hashes.append(np.asarray([row[4] for row in chunk], dtype=HASH_DTYPE))
+
+    try:
+        # Offsets have n+1 entries so row i spans offsets[i]:offsets[i+1]
+        for heap in HEAPS:
+            np.zeros(1, dtype=OFFSET_DTYPE).tofile(files[f'{heap}.offsets'])
+
+        chunk = []
+        for user_id, profile in profiles:
+            industry = profile['industry']
+            if industry not in industries:
+                if len(industries) > np.iinfo(CODE_DTYPE).max:
+                    raise ValueError("Too many distinct industries for a uint16 code")
+                industries[industry] = len(industries)
+            chunk.append((
+                user_id.encode('utf-8'),
+                [profile[field] for field in numeric_fields],
+                industries[industry],
+                profile['name'].encode('utf-8'),
+                _id_hash(user_id),
+                '\n'.join(profile.get('skills', ())).encode('utf-8')
+            ))
+            if len(chunk) == chunk_size:
+                flush(chunk)
+                rows += len(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+            rows += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+
+    # Sorted hash index for lookup by user id
+    all_hashes = np.concatenate(hashes) if hashes else np.empty(0, dtype=HASH_DTYPE)
+    order = np.argsort(all_hashes, kind='stable')
+    all_hashes[order].tofile(os.path.join(path, 'id_index.hash'))
+    order.astype(OFFSET_DTYPE).tofile(os.path.join(path, 'id_index.rows'))
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': 2,
+            'rows': rows,
+            'numeric_fields': list(numeric_fields),
+            'industries': list(industries)
+        }, f)
+
+
+class ProfileView(Mapping):
+    """Read-only, dict-compatible view of one stored profile"""
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, field):
+        return self._store.value(self._row, field)
+
+    def __iter__(self):
+        return iter(self._store.fields)
+
+    def __len__(self):
+        return len(self._store.fields)
+
+    def __repr__(self):
+        return f"ProfileView({dict(self)!r})"
+
+
+class ProfileStore(Mapping):
+    """
+    Memory-mapped profile store, usable like TEST_USERS: a mapping of
+    user id -> profile, iterated in the order users were written.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.path = path
+        self.rows = meta['rows']
+        self.numeric_fields = tuple(meta['numeric_fields'])
+        self.industries = tuple(meta['industries'])
+        # Version 1 stores predate the skills heap
+        heaps = HEAPS if meta['version'] >= 2 else ('name', 'user_id')
+        self.fields = ('name',) + self.numeric_fields + ('industry',)
+        if 'skills' in heaps:
+            self.fields += ('skills',)
+
+        self._columns = {
+            field: self._map(f'{field}.i4', NUMERIC_DTYPE) for field in self.numeric_fields
+        }
+        self._columns['industry'] = self._map('industry.codes', CODE_DTYPE)
+        self._heaps = {
+            heap: (self._map(f'{heap}.heap', np.uint8), self._map(f'{heap}.offsets', OFFSET_DTYPE))
+            for heap in heaps
+        }
+        self._id_hashes = self._map('id_index.hash', HASH_DTYPE)
+        self._id_rows = self._map('id_index.rows', OFFSET_DTYPE)
+
+    def _map(self, filename, dtype):
+        full_path = os.path.join(self.path, filename)
+        # np.memmap refuses empty files, which an empty store has
+        if os.path.getsize(full_path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(full_path, dtype=dtype, mode='r')
+
+    def _string(self, heap, row):
+        data, offsets = self._heaps[heap]
+        return data[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+    def column(self, field):
+        """Zero-copy view of a numeric column (industry gives its codes)"""
+        return self._columns[field]
+
+    def columns(self, fields):
+        """Mapping of field -> column view, e.g. for batch_ml_prediction"""
+        return {field: self._columns[field] for field in fields}
+
+    def user_id(self, row):
+        return self._string('user_id', row)
+
+    def row_of(self, user_id):
+        """Row number of a user id; raises KeyError if it is not stored"""
+        target = np.uint64(_id_hash(user_id))
+        i = int(np.searchsorted(self._id_hashes, target))
+        # Walk the (almost always length-one) run of equal hashes
+        while i < len(self._id_hashes) and self._id_hashes[i] == target:
+            row = int(self._id_rows[i])
+            if self.user_id(row) == user_id:
+                return row
+            i += 1
+        raise KeyError(user_id)
+
+    def value(self, row, field):
+        """A single field of a single row, as a plain Python value"""
+        if field == 'name':
+            return self._string('name', row)
+        if field == 'industry':
+            return self.industries[self._columns['industry'][row]]
+        if field == 'skills' and 'skills' in self._heaps:
+            skills = self._string('skills', row)
+            return skills.split('\n') if skills else []
+        if field in self._columns:
+            return int(self._columns[field][row])
+        raise KeyError(field)
+
+    def profile(self, row):
+        return ProfileView(self, row)
+
+    def __getitem__(self, user_id):
+        return ProfileView(self, self.row_of(user_id))
+
+    def __contains__(self, user_id):
+        try:
+            self.row_of(user_id)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return (self.user_id(row) for row in range(self.rows))
+
+    def __len__(self):
+        return self.rows
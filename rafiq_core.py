@@ -0,0 +1,778 @@
+"""
+Rafiq's core: mock data, the scoring models, message rendering and the
+UI-independent conversation engine. The flows themselves (messages,
+buttons, transitions) live in the conversation catalog, see
+conversation_catalog.py.
+
+Nothing here imports Streamlit or touches a page, so batch jobs, the
+conversation server and process-pool workers can import it cheaply. Keep
+it that way: `python -m benchmarks.bench_import` fails if a cold import
+pulls in Streamlit or goes over its time budget.
+"""
+import os
+import tempfile
+import time
+from collections import namedtuple
+from functools import lru_cache, partial
+import numpy as np
+import metrics
+from chat_history import ChatHistory
+from conversation_catalog import (
+    END,
+    SELECT_SKILL,
+    START,
+    ConversationCatalog,
+    Transition,
+    compile_template,
+)
+from job_index import JobIndex
+from outcome_log import OutcomeLog
+from profile_store import STRING_FIELDS, ProfileStore, write_profile_store
+from response_stream import load_producer, stream
+from skill_index import SkillIndex
+from tree_model import TreeEnsemble
+
+# ============================================================================
+# MOCK DATA & ML MODEL
+# ============================================================================
+
+# Simulated user profiles for testing
+TEST_USERS = {
+    'fatima_hassan': {
+        'name': 'Fatima Hassan',
+        'cv_refresh_count': 0,
+        'days_since_last_refresh': 14,
+        'profile_completeness': 68,
+        'emp_cv_views_last_week': 3,
+        'applications_count': 1,
+        'unique_jobs_applied': 3,
+        'login_count': 4,
+        'unique_skills_added': 3,
+        'job_searches': 5,
+        'industry': 'Data Analytics',
+        'skills': ['Excel', 'SQL', 'Communication']
+    },
+    'omar_khalil': {
+        'name': 'Omar Khalil',
+        'cv_refresh_count': 2,
+        'days_since_last_refresh': 2,
+        'profile_completeness': 45,
+        'emp_cv_views_last_week': 0,
+        'applications_count': 0,
+        'unique_jobs_applied': 1,
+        'login_count': 2,
+        'unique_skills_added': 2,
+        'job_searches': 8,
+        'industry': 'Software Engineering',
+        'skills': ['JavaScript', 'Git']
+    },
+    'layla_mansour': {
+        'name': 'Layla Mansour',
+        'cv_refresh_count': 1,
+        'days_since_last_refresh': 3,
+        'profile_completeness': 85,
+        'emp_cv_views_last_week': 8,
+        'applications_count': 0,
+        'unique_jobs_applied': 5,
+        'login_count': 6,
+        'unique_skills_added': 7,
+        'job_searches': 12,
+        'industry': 'Marketing',
+        'skills': ['SEO', 'Social Media', 'Copywriting', 'Content Marketing',
+                   'Email Marketing', 'Canva', 'Google Analytics']
+    },
+    'youssef_ahmed': {
+        'name': 'Youssef Ahmed',
+        'cv_refresh_count': 3,
+        'days_since_last_refresh': 21,
+        'profile_completeness': 55,
+        'emp_cv_views_last_week': 1,
+        'applications_count': 2,
+        'unique_jobs_applied': 2,
+        'login_count': 1,
+        'unique_skills_added': 4,
+        'job_searches': 3,
+        'industry': 'Finance',
+        'skills': ['Excel', 'Accounting', 'Budgeting', 'Audit']
+    },
+    'amira_said': {
+        'name': 'Amira Said',
+        'cv_refresh_count': 0,
+        'days_since_last_refresh': 7,
+        'profile_completeness': 92,
+        'emp_cv_views_last_week': 12,
+        'applications_count': 5,
+        'unique_jobs_applied': 8,
+        'login_count': 10,
+        'unique_skills_added': 9,
+        'job_searches': 15,
+        'industry': 'Project Management',
+        'skills': ['Agile', 'Scrum', 'Stakeholder Management', 'Risk Management', 'PMP',
+                   'MS Project', 'Budgeting', 'Communication', 'Leadership']
+    }
+}
+
+# Fields every user profile provides
+PROFILE_FIELDS = (
+    'name',
+    'cv_refresh_count',
+    'days_since_last_refresh',
+    'profile_completeness',
+    'emp_cv_views_last_week',
+    'applications_count',
+    'unique_jobs_applied',
+    'login_count',
+    'unique_skills_added',
+    'job_searches',
+    'industry',
+    'skills'
+)
+
+# Profile fields kept in fixed-width numeric columns by the profile store
+NUMERIC_PROFILE_FIELDS = tuple(f for f in PROFILE_FIELDS if f not in STRING_FIELDS)
+
+# Nudges the model scores, in column order of the prediction matrix
+NUDGES = ('refresh_cv', 'add_skill', 'apply_job')
+
+# Outcome each nudge is expected to move
+EXPECTED_OUTCOMES = {
+    'refresh_cv': 'emp_cv_views',
+    'add_skill': 'emp_contact_flips',
+    'apply_job': 'emp_reveals'
+}
+
+# Step where each nudge's conversation reaches its goal; getting there is
+# logged as the served nudge's 'completed' outcome
+NUDGE_GOALS = {
+    'refresh_cv': 'success',
+    'add_skill': 'skills_added',
+    'apply_job': 'application_submitted'
+}
+
+# Profile features the model reads
+MODEL_FEATURES = (
+    'days_since_last_refresh',
+    'profile_completeness',
+    'job_searches',
+    'applications_count'
+)
+
+@metrics.timed('batch_ml_prediction')
+def batch_ml_prediction(feature_columns):
+    """
+    Scores a whole population at once.
+    Takes a mapping of feature name -> column (list or NumPy array, one entry
+    per user) and applies the same rules as mock_ml_prediction to every row.
+    Returns the normalized probability matrix (columns ordered as NUDGES) with
+    the top nudge, confidence and expected outcome per row.
+    """
+    days = np.asarray(feature_columns['days_since_last_refresh'])
+    completeness = np.asarray(feature_columns['profile_completeness'])
+    searches = np.asarray(feature_columns['job_searches'])
+    applications = np.asarray(feature_columns['applications_count'])
+    
+    scores = np.empty((len(days), len(NUDGES)))
+    
+    # Rule 1: Refresh CV if stale
+    scores[:, 0] = np.where(days > 7, 0.65 + (days - 7) * 0.02, 0.15)
+    
+    # Rule 2: Add skills if profile incomplete
+    scores[:, 1] = np.where(completeness < 70, 0.50 + (70 - completeness) * 0.01, 0.10)
+    
+    # Rule 3: Apply to jobs if searching but not applying
+    scores[:, 2] = np.select(
+        [(searches > 3) & (applications == 0), (searches > 0) & (applications < 2)],
+        [0.70, 0.45],
+        default=0.20
+    )
+    
+    # Normalize to sum to 1.0 (summed left to right, like the per-user loop)
+    total = scores[:, 0] + scores[:, 1] + scores[:, 2]
+    return summarize_predictions(scores / total[:, np.newaxis])
+
+def summarize_predictions(predictions):
+    """Top nudge, confidence and expected outcome for each row of a probability matrix"""
+    # Get top prediction (argmax keeps the first nudge on ties, like max())
+    top = predictions.argmax(axis=1)
+    
+    return {
+        'nudge': np.asarray(NUDGES)[top],
+        'confidence': predictions[np.arange(len(top)), top],
+        'all_predictions': predictions,
+        'expected_outcomes': np.asarray([EXPECTED_OUTCOMES[n] for n in NUDGES])[top]
+    }
+
+# Features the what-if explorer varies, and the values it tries for each
+WHAT_IF_AXES = {
+    'days_since_last_refresh': np.arange(0, 61),
+    'profile_completeness': np.arange(0, 101),
+    'job_searches': np.arange(0, 21)
+}
+
+# Every combination of the axes' values, scored: probabilities has one
+# dimension per axis (in the order of `axes`) plus one for NUDGES
+WhatIfGrid = namedtuple('WhatIfGrid', ['axes', 'values', 'probabilities'])
+
+@metrics.timed('what_if_grid')
+def what_if_grid(predict_batch, features, profile, axes=WHAT_IF_AXES):
+    """
+    Score the whole grid of axis values in one batch, every other feature
+    held at the profile's value. The default axes are ~130,000 points.
+    """
+    names = tuple(axes)
+    mesh = np.meshgrid(*(axes[name] for name in names), indexing='ij')
+    columns = {f: np.full(mesh[0].size, profile[f]) for f in features if f not in axes}
+    columns.update((name, m.ravel()) for name, m in zip(names, mesh))
+    probabilities = predict_batch(columns)['all_predictions'].astype(np.float32)
+    return WhatIfGrid(names, dict(axes), probabilities.reshape(mesh[0].shape + (len(NUDGES),)))
+
+def what_if_slice(grid, free, point):
+    """
+    Probabilities along the `free` axes (in that order), with every other
+    axis at the grid value nearest to point[axis]. Indexing only, no scoring.
+    """
+    index = tuple(
+        slice(None) if name in free else int(np.abs(grid.values[name] - point[name]).argmin())
+        for name in grid.axes
+    )
+    kept = [name for name in grid.axes if name in free]
+    return grid.probabilities[index].transpose([kept.index(name) for name in free] + [len(free)])
+
+# Chat turns kept in memory per session, and how many older ones
+# each "load earlier" click brings back
+HISTORY_WINDOW = 30
+HISTORY_PAGE_SIZE = 20
+
+# Seconds a session stays in memory after its last request
+SESSION_TTL = 1800
+
+# Seconds a persisted session is kept after its last request
+SESSION_RETENTION = 7 * 86400
+
+# Users listed per page of the demo's user picker
+USER_PAGE_SIZE = 100
+
+# Skills offered in the show_skills selection grid
+SKILL_GRID_SIZE = 8
+
+# Skills to select before the grid can be submitted
+MIN_SKILLS_SELECTED = 5
+
+# Postings offered on the show_jobs step
+JOB_MATCHES = 3
+
+# Profiles don't carry years of experience yet
+YEARS_EXPERIENCE = 6
+
+# Steps that promise a reminder: (flow, step) -> flow the reminder restarts
+REMINDER_STEPS = {('refresh_cv', 'remind_set'): 'refresh_cv'}
+
+# Reminders go out at this local hour on the following Monday
+REMINDER_HOUR = 9
+
+# Bundled data files (job postings, job catalog)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Bump whenever the scoring rules change, so cached predictions are dropped
+MODEL_VERSION = 'mock-rules-1'
+
+# Mock ML Model (simulates XGBoost until real one is ready)
+@metrics.timed('mock_ml_prediction')
+def mock_ml_prediction(user_features):
+    """
+    Simulates ML model predictions based on user behavioral features.
+    Returns the best nudge recommendation with confidence score.
+    """
+    return single_prediction(batch_ml_prediction, MODEL_FEATURES, user_features)
+
+def single_prediction(predict_batch, features, user_features):
+    """Score one profile with a batch scorer, as a plain-Python prediction dict"""
+    batch = predict_batch({f: [user_features[f]] for f in features})
+    
+    predictions = dict(zip(NUDGES, batch['all_predictions'][0].tolist()))
+    top_nudge = str(batch['nudge'][0])
+    
+    return {
+        'nudge': top_nudge,
+        'confidence': predictions[top_nudge],
+        'all_predictions': predictions,
+        'expected_outcomes': EXPECTED_OUTCOMES[top_nudge]
+    }
+
+def tree_batch_prediction(ensemble, feature_columns):
+    """batch_ml_prediction's contract, scored by a TreeEnsemble"""
+    probabilities = ensemble.predict_proba(feature_columns)
+    return summarize_predictions(probabilities[:, [ensemble.classes.index(n) for n in NUDGES]])
+
+# A scoring backend: predict(profile) and predict_batch(columns) follow the
+# contracts of mock_ml_prediction and batch_ml_prediction
+Model = namedtuple('Model', ['backend', 'version', 'features', 'predict', 'predict_batch'])
+
+MODEL_BACKENDS = ('mock', 'trees')
+
+def load_model(backend='mock', model_path=None):
+    """
+    Load a scoring backend: 'mock' for the rules above, 'trees' for a
+    gradient-boosted tree ensemble read from model_path.
+    """
+    if backend == 'mock':
+        return Model('mock', MODEL_VERSION, MODEL_FEATURES, mock_ml_prediction, batch_ml_prediction)
+    if backend == 'trees':
+        if not model_path:
+            raise ValueError("The trees backend needs a model file (RAFIQ_MODEL_PATH)")
+        ensemble = TreeEnsemble.from_json(model_path, MODEL_FEATURES, NUDGES)
+        missing = set(NUDGES) - set(ensemble.classes)
+        if missing:
+            raise ValueError(f"{model_path} does not score {sorted(missing)}")
+        
+        predict_batch = metrics.timed('tree_batch_prediction')(partial(tree_batch_prediction, ensemble))
+        predict = metrics.timed('tree_prediction')(
+            partial(single_prediction, predict_batch, ensemble.feature_names))
+        return Model('trees', f'trees-{ensemble.digest}', ensemble.feature_names,
+                     predict, predict_batch)
+    raise ValueError(f"Unknown model backend {backend!r}; choose from {MODEL_BACKENDS}")
+
+# ============================================================================
+# MESSAGE TEMPLATES
+# ============================================================================
+
+# Extra fields a step is rendered with on top of the user profile
+STEP_FIELDS = {
+    ('refresh_cv', 'initial'): ('confidence',),
+    ('add_skill', 'initial'): ('confidence',),
+    ('add_skill', 'skills_added'): ('new_completeness', 'improvement', 'old_skills',
+                                    'new_skills', 'skills_added'),
+    ('apply_job', 'initial'): ('confidence',),
+    ('apply_job', 'why_now'): ('confidence',),
+    ('apply_job', 'show_jobs'): ('job_list',),
+    ('apply_job', 'job_details'): ('job_title', 'company', 'highlights', 'requirements', 'match',
+                                   'location', 'salary', 'posted', 'gap_summary'),
+    ('apply_job', 'not_qualified'): ('match', 'skills_have', 'skills_total', 'min_years',
+                                     'years', 'gap'),
+    ('apply_job', 'application_submitted'): ('job_title', 'company')
+}
+
+def available_fields(flow_type, step_name):
+    """Fields a step's message may use: the profile's plus its STEP_FIELDS"""
+    return set(PROFILE_FIELDS).union(STEP_FIELDS.get((flow_type, step_name), ()))
+
+# Steps this module names, each with the number of leading buttons it relies
+# on: the first JOB_MATCHES on show_jobs are the "Tell me about #n" buttons.
+# A catalog without them is rejected, so a reload can't drop a step in use.
+REQUIRED_STEPS = {
+    **{(nudge, 'initial'): 0 for nudge in NUDGES},
+    **{(nudge, goal): 0 for nudge, goal in NUDGE_GOALS.items()},
+    **{step: 0 for step in STEP_FIELDS},
+    **{step: 0 for step in REMINDER_STEPS},
+    ('add_skill', 'show_skills'): 0,
+    ('apply_job', 'show_jobs'): JOB_MATCHES
+}
+
+@metrics.timed('format_message')
+def format_message(template, user_profile, **kwargs):
+    """Format message template with user data"""
+    if isinstance(template, str):
+        template = compile_template(template)
+    
+    parts = []
+    for literal, field, conversion, format_spec in template.segments:
+        parts.append(literal)
+        if field is None:
+            continue
+        value = kwargs[field] if field in kwargs else user_profile[field]
+        if conversion is not None:
+            value = conversion(value)
+        parts.append(format(value, format_spec))
+    return ''.join(parts)
+
+# ============================================================================
+# CONVERSATION ENGINE
+# ============================================================================
+
+def open_profile_store():
+    """
+    Open the profile store at $RAFIQ_PROFILE_STORE.
+    Without it, a store is built from TEST_USERS in a temporary directory.
+    """
+    path = os.environ.get('RAFIQ_PROFILE_STORE')
+    if not path:
+        path = tempfile.mkdtemp(prefix='rafiq_profiles_')
+        write_profile_store(path, TEST_USERS.items(), NUMERIC_PROFILE_FIELDS)
+    return ProfileStore(path)
+
+@lru_cache(maxsize=None)
+def open_skill_index():
+    """
+    Trending-skill index over the job postings at $RAFIQ_JOB_POSTINGS
+    (default data/job_postings.jsonl), shared by the whole process
+    """
+    path = os.environ.get('RAFIQ_JOB_POSTINGS', os.path.join(DATA_DIR, 'job_postings.jsonl'))
+    return SkillIndex.from_file(path)
+
+@lru_cache(maxsize=None)
+def open_job_index():
+    """
+    Job-matching index over the catalog at $RAFIQ_JOB_CATALOG (default
+    data/job_catalog.jsonl), shared by the whole process
+    """
+    path = os.environ.get('RAFIQ_JOB_CATALOG', os.path.join(DATA_DIR, 'job_catalog.jsonl'))
+    return JobIndex.from_file(path)
+
+@lru_cache(maxsize=None)
+def open_catalog():
+    """
+    Conversation catalog compiled from $RAFIQ_CATALOG (default
+    data/conversation_catalog.json), shared by the whole process
+    """
+    path = os.environ.get('RAFIQ_CATALOG', os.path.join(DATA_DIR, 'conversation_catalog.json'))
+    return ConversationCatalog(path, available_fields, REQUIRED_STEPS)
+
+@lru_cache(maxsize=None)
+def open_reply_producer():
+    """
+    Reply producer named by $RAFIQ_REPLY_PRODUCER: 'template' (default) or
+    'simulated', see response_stream.py
+    """
+    return load_producer(os.environ.get('RAFIQ_REPLY_PRODUCER', 'template'))
+
+@lru_cache(maxsize=None)
+def open_outcome_log():
+    """
+    Outcome log at $RAFIQ_OUTCOME_LOG, shared by the whole process, or
+    None when outcomes aren't recorded
+    """
+    path = os.environ.get('RAFIQ_OUTCOME_LOG')
+    return OutcomeLog(path) if path else None
+
+def open_model(backend=None):
+    """
+    The scoring backend named by backend or $RAFIQ_MODEL_BACKEND (default
+    'mock'). The tree backend reads its model from $RAFIQ_MODEL_PATH.
+    """
+    return load_model(backend or os.environ.get('RAFIQ_MODEL_BACKEND', 'mock'),
+                      os.environ.get('RAFIQ_MODEL_PATH'))
+
+class ConversationSession:
+    """
+    One user's conversation with Rafiq, independent of any UI.
+    The Streamlit app keeps one in st.session_state; the conversation
+    server keeps one per session id.
+    """
+    
+    def __init__(self, user_profile=None, history_window=HISTORY_WINDOW, user_id=None, owner=None):
+        self.user_profile = user_profile
+        self.user_id = user_id      # whose profile it is, for the outcome log
+        self.owner = owner          # digest of the secret a client must show to resume it
+        self.messages = ChatHistory(window=history_window)
+        self.conversation_flow = None
+        self.conversation_step = None
+        self.ml_prediction = None
+        self.skills_selected = []
+        self.job_matches = []       # postings offered on show_jobs, best first
+        self.job_selected = None    # the posting being discussed
+        self.jobs_applied = []      # ids of postings applied to
+        self.served = None          # outcome log record of the nudge being followed up
+        self.reminder = None        # pending reminder: {'id', 'flow', 'due'}
+        self.catalog = None         # digest of the catalog version the flow started on
+        self.pending_reply = None   # reply not streamed yet: {'flow', 'step', 'draft', 'queued'}
+    
+    def reset(self):
+        """Clear the conversation but keep the profile"""
+        self.messages.clear()
+        self.conversation_flow = None
+        self.conversation_step = None
+        self.skills_selected = []
+        self.job_matches = []
+        self.job_selected = None
+        self.served = None
+        self.catalog = None
+        self.pending_reply = None
+        self.reminder = None        # a reset conversation isn't restarted on Monday
+
+def next_monday(now):
+    """Timestamp of REMINDER_HOUR local time on the Monday after now"""
+    t = time.localtime(now)
+    return time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 7 - t.tm_wday,
+                        REMINDER_HOUR, 0, 0, 0, 0, -1))
+
+def add_message(session, role, content):
+    """Add message to chat history"""
+    session.messages.append(role, content)
+
+def queue_reply(session, flow_type, step_name, draft):
+    """
+    Queue the assistant's reply to be produced and streamed; it joins the
+    history once complete. A reply still pending is dropped.
+    """
+    if session.pending_reply is not None:
+        metrics.count('replies_dropped', flow=session.pending_reply['flow'],
+                      step=session.pending_reply['step'])
+    session.pending_reply = {'flow': flow_type, 'step': step_name, 'draft': draft,
+                             'queued': time.time()}
+
+def stream_reply(session, producer=None):
+    """
+    Iterator over the chunks of the pending reply, as the producer (default
+    open_reply_producer()) makes them. After the last chunk the reply is
+    added to the history. Empty if no reply is pending.
+    """
+    reply = session.pending_reply
+    if reply is None:
+        return iter(())
+    
+    def commit(text):
+        if session.pending_reply is reply:
+            session.pending_reply = None
+            add_message(session, 'assistant', text)
+    
+    return stream(producer or open_reply_producer(), session, reply, commit)
+
+def complete_reply(session, producer=None):
+    """Produce the pending reply in full, for callers that don't stream"""
+    for _ in stream_reply(session, producer):
+        pass
+
+def session_catalog(session):
+    """The catalog version the session's conversation started on"""
+    return open_catalog().version(session.catalog)
+
+def release_catalog_versions(sessions):
+    """Drop the catalog versions no session in a SessionStore started on"""
+    return open_catalog().release(sessions.field_values('catalog'))
+
+def start_conversation(session, flow_type, ml_prediction):
+    """Start a new conversation flow on the latest catalog"""
+    catalog = open_catalog()
+    catalog.refresh()
+    session.catalog = catalog.current.digest
+    session.conversation_flow = flow_type
+    session.conversation_step = 'initial'
+    session.ml_prediction = ml_prediction
+    metrics.count('nudges_started', flow=flow_type)
+    
+    log = open_outcome_log()
+    if log is not None:
+        session.served = log.served(flow_type, ml_prediction['all_predictions'][flow_type],
+                                    EXPECTED_OUTCOMES[flow_type], session.user_id)
+    
+    # Get initial message
+    confidence = int(ml_prediction['confidence'] * 100)
+    message = format_message(
+        catalog.current.template(flow_type, 'initial'),
+        session.user_profile,
+        confidence=confidence
+    )
+    
+    queue_reply(session, flow_type, 'initial', message)
+
+def record_goal(session, flow_type, step_name):
+    """Log the served nudge as completed once its flow reaches the goal step"""
+    served = session.served
+    if served is None or served['nudge'] != flow_type or NUDGE_GOALS[flow_type] != step_name:
+        return
+    log = open_outcome_log()
+    if log is not None:
+        log.outcome(served, 'completed')
+    session.served = None
+
+def render_step(session, flow_type, step_name):
+    """Render a step's message with the fields STEP_FIELDS promises it"""
+    user_profile = session.user_profile
+    template = session_catalog(session).template(flow_type, step_name)
+    
+    # Special handling for skills_added
+    if step_name == 'skills_added':
+        old_completeness = user_profile['profile_completeness']
+        skills_added = len(session.skills_selected)
+        new_completeness = min(100, old_completeness + (skills_added * 3))
+        
+        return format_message(
+            template,
+            user_profile,
+            new_completeness=new_completeness,
+            improvement=new_completeness - old_completeness,
+            old_skills=user_profile['unique_skills_added'],
+            new_skills=user_profile['unique_skills_added'] + skills_added,
+            skills_added=skills_added
+        )
+    
+    confidence = int(session.ml_prediction['confidence'] * 100)
+    return format_message(template, user_profile, years=YEARS_EXPERIENCE, confidence=confidence,
+                          **job_fields(session, flow_type, step_name))
+
+def job_buttons(catalog):
+    """"Tell me about #n" buttons, in match order"""
+    return catalog.buttons('apply_job', 'show_jobs')[:JOB_MATCHES]
+
+JOB_LINE = compile_template("""**{rank}. {title} at {company}**
+Match: {match}% | Posted: {posted}{fresh}  
+Salary: {salary} | {location}  """)
+
+def posted_ago(age_days):
+    if age_days == 0:
+        return 'today'
+    return '1 day ago' if age_days == 1 else f'{age_days} days ago'
+
+def user_skills(session):
+    """Skills on the profile plus any added in this conversation"""
+    return list(session.user_profile.get('skills', ())) + session.skills_selected
+
+def _is_are(items):
+    """'A is' or 'A, B are'"""
+    return f"{', '.join(items)} {'is' if len(items) == 1 else 'are'}"
+
+def job_fields(session, flow_type, step_name):
+    """
+    Fields describing matched postings for the apply_job steps. Rendering
+    show_jobs runs the match and remembers the postings it offered.
+    """
+    if flow_type != 'apply_job':
+        return {}
+    
+    if step_name == 'show_jobs':
+        session.job_matches = open_job_index().match(
+            user_skills(session), session.user_profile['industry'], k=JOB_MATCHES,
+            exclude_ids=session.jobs_applied)
+        lines = [
+            format_message(JOB_LINE, job, rank=rank, match=round(job['match'] * 100),
+                           posted=posted_ago(job['age_days']),
+                           fresh=' | 🔥 Fresh' if job['age_days'] <= 2 else '')
+            for rank, job in enumerate(session.job_matches, 1)
+        ]
+        return {'job_list': '\n\n'.join(lines) or "No open roles match your profile right now."}
+    
+    job = session.job_selected
+    if job is None:
+        return {}
+    have = {s.casefold() for s in user_skills(session)}
+    missing = [s for s in job['skills'] if s.casefold() not in have]
+    optional = [s for s in job.get('optional', ()) if s.casefold() not in have]
+    
+    requirements = [
+        f"✅ {s} - You have this" if s not in missing else f"❌ {s} - Not on your profile yet"
+        for s in job['skills']
+    ]
+    requirements.append(
+        f"{'✅' if YEARS_EXPERIENCE >= job['min_years'] else '⚠️'} {job['min_years']}+ years "
+        f"experience - You have {YEARS_EXPERIENCE} years")
+    requirements.extend(f"⚠️ {s} - Nice to have (optional)" for s in optional)
+    
+    if missing:
+        gap_summary = f"You already have {len(job['skills']) - len(missing)} of the {len(job['skills'])} required skills"
+        gap = f"{_is_are(missing)} all that's missing from the requirements."
+    elif optional:
+        gap_summary = f"You're missing only {len(optional)} optional skill{'s' if len(optional) > 1 else ''}"
+        gap = f'{_is_are(optional)} listed as "nice to have", not required.'
+    else:
+        gap_summary = "You have every skill they ask for"
+        gap = "There isn't one: you have every skill they list."
+    
+    return {
+        'job_title': job['title'],
+        'company': job['company'],
+        'highlights': '\n'.join(f"• {h}" for h in job.get('highlights', ())),
+        'requirements': '  \n'.join(requirements),
+        'match': round(job['match'] * 100),
+        'location': job['location'],
+        'salary': job['salary'],
+        'posted': posted_ago(job['age_days']),
+        'gap_summary': gap_summary,
+        'gap': gap,
+        'skills_have': len(job['skills']) - len(missing),
+        'skills_total': len(job['skills']),
+        'min_years': job['min_years']
+    }
+
+@metrics.timed('handle_user_response')
+def handle_user_response(session, response):
+    """Handle user button click"""
+    # Add user's response to chat
+    add_message(session, 'user', response)
+    
+    catalog = session_catalog(session)
+    transition = catalog.transition(session.conversation_flow, session.conversation_step, response)
+    
+    # The skill grid is not in the table: any skill it offers is selectable
+    if session.conversation_step == 'show_skills' and response in skill_options(session):
+        transition = Transition(SELECT_SKILL, session.conversation_flow, 'show_skills')
+    
+    # Details can only be asked for postings that were offered
+    offered = job_buttons(catalog) if session.conversation_step == 'show_jobs' else ()
+    if transition is not None and response in offered:
+        rank = offered.index(response)
+        if rank < len(session.job_matches):
+            session.job_selected = session.job_matches[rank]
+        else:
+            transition = None
+    
+    if transition is None:
+        metrics.count('dead_end_clicks', flow=session.conversation_flow, step=session.conversation_step)
+        return
+    
+    metrics.count('button_transitions', flow=session.conversation_flow,
+                  step=session.conversation_step, action=transition.action)
+    
+    if (transition.step == 'application_submitted' and session.job_selected
+            and session.job_selected['id'] not in session.jobs_applied):
+        session.jobs_applied.append(session.job_selected['id'])
+    
+    if transition.action == SELECT_SKILL:
+        if response not in session.skills_selected:
+            session.skills_selected.append(response)
+        return  # Don't send message yet, wait for more selections
+    
+    if transition.action == START:
+        # Another nudge, started and logged like the first one
+        start_conversation(session, transition.flow, session.ml_prediction)
+        return
+    
+    session.conversation_flow = transition.flow
+    session.conversation_step = transition.step
+    record_goal(session, transition.flow, transition.step)
+    
+    if transition.action == END:
+        return
+    
+    # Send next message
+    queue_reply(session, transition.flow, transition.step,
+                render_step(session, transition.flow, transition.step))
+
+def skill_options(session):
+    """
+    Skills offered on the show_skills step: the industry's trending skills
+    the user doesn't list yet, plus anything already selected
+    """
+    index = open_skill_index()
+    index.refresh()
+    profile = session.user_profile
+    options = index.top_skills(profile['industry'], SKILL_GRID_SIZE,
+                               exclude=profile.get('skills', ()))
+    return options + [s for s in session.skills_selected if s not in options]
+
+def toggle_skill(session, skill):
+    """Select or deselect a skill in the selection grid"""
+    if skill in session.skills_selected:
+        session.skills_selected.remove(skill)
+    else:
+        session.skills_selected.append(skill)
+
+def submit_skills(session):
+    """Add the selected skills and move on to skills_added"""
+    session.conversation_flow = 'add_skill'
+    session.conversation_step = 'skills_added'
+    record_goal(session, 'add_skill', 'skills_added')
+    queue_reply(session, 'add_skill', 'skills_added', render_step(session, 'add_skill', 'skills_added'))
+
+def current_buttons(session):
+    """Buttons to offer for the current step (none once a flow has ended)"""
+    if not session.conversation_flow or not session.conversation_step:
+        return []
+    if session.conversation_step == 'show_skills':
+        return skill_options(session)
+    catalog = session_catalog(session)
+    buttons = catalog.buttons(session.conversation_flow, session.conversation_step)
+    if session.conversation_step == 'show_jobs':
+        # Only offer details for the postings actually shown
+        hidden = job_buttons(catalog)[len(session.job_matches):]
+        return [b for b in buttons if b not in hidden]
+    return buttons
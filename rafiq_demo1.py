@@ -1,6 +1,37 @@
 import streamlit as st
-from datetime import datetime, timedelta
-import random
+import functools
+import os
+import numpy as np
+import pandas as pd
+import secrets
+import tempfile
+from hashlib import blake2b
+import metrics
+from cohort_stats import DIMENSIONS, QUANTILES, cohort_stats
+from prediction_cache import PredictionCache
+from rafiq_core import (
+    HISTORY_PAGE_SIZE,
+    MIN_SKILLS_SELECTED,
+    MODEL_BACKENDS,
+    NUDGES,
+    SESSION_RETENTION,
+    SESSION_TTL,
+    USER_PAGE_SIZE,
+    WHAT_IF_AXES,
+    ConversationSession,
+    current_buttons,
+    handle_user_response,
+    open_model,
+    open_profile_store,
+    release_catalog_versions,
+    start_conversation,
+    stream_reply,
+    submit_skills,
+    toggle_skill,
+    what_if_grid,
+    what_if_slice,
+)
+from session_backend import SessionStore, SQLiteSessionBackend
 
 # Page config
 st.set_page_config(
@@ -10,545 +41,243 @@ st.set_page_config(
 )
 
 # ============================================================================
-# MOCK DATA & ML MODEL
+# STREAMLIT APP
 # ============================================================================
 
-# Simulated user profiles for testing
-TEST_USERS = {
-    'fatima_hassan': {
-        'name': 'Fatima Hassan',
-        'cv_refresh_count': 0,
-        'days_since_last_refresh': 14,
-        'profile_completeness': 68,
-        'emp_cv_views_last_week': 3,
-        'applications_count': 1,
-        'unique_jobs_applied': 3,
-        'login_count': 4,
-        'unique_skills_added': 3,
-        'job_searches': 5,
-        'industry': 'Data Analytics'
-    },
-    'omar_khalil': {
-        'name': 'Omar Khalil',
-        'cv_refresh_count': 2,
-        'days_since_last_refresh': 2,
-        'profile_completeness': 45,
-        'emp_cv_views_last_week': 0,
-        'applications_count': 0,
-        'unique_jobs_applied': 1,
-        'login_count': 2,
-        'unique_skills_added': 2,
-        'job_searches': 8,
-        'industry': 'Software Engineering'
-    },
-    'layla_mansour': {
-        'name': 'Layla Mansour',
-        'cv_refresh_count': 1,
-        'days_since_last_refresh': 3,
-        'profile_completeness': 85,
-        'emp_cv_views_last_week': 8,
-        'applications_count': 0,
-        'unique_jobs_applied': 5,
-        'login_count': 6,
-        'unique_skills_added': 7,
-        'job_searches': 12,
-        'industry': 'Marketing'
-    },
-    'youssef_ahmed': {
-        'name': 'Youssef Ahmed',
-        'cv_refresh_count': 3,
-        'days_since_last_refresh': 21,
-        'profile_completeness': 55,
-        'emp_cv_views_last_week': 1,
-        'applications_count': 2,
-        'unique_jobs_applied': 2,
-        'login_count': 1,
-        'unique_skills_added': 4,
-        'job_searches': 3,
-        'industry': 'Finance'
-    },
-    'amira_said': {
-        'name': 'Amira Said',
-        'cv_refresh_count': 0,
-        'days_since_last_refresh': 7,
-        'profile_completeness': 92,
-        'emp_cv_views_last_week': 12,
-        'applications_count': 5,
-        'unique_jobs_applied': 8,
-        'login_count': 10,
-        'unique_skills_added': 9,
-        'job_searches': 15,
-        'industry': 'Project Management'
-    }
-}
-
-# Mock ML Model (simulates XGBoost until real one is ready)
-def mock_ml_prediction(user_features):
+@st.cache_resource
+def load_profile_store():
+    """Profile store shared by all sessions"""
+    return open_profile_store()
+
+@st.cache_resource
+def get_model(backend):
+    """Scoring backend, loaded once per process"""
+    return open_model(backend)
+
+def selected_backend():
+    """Backend picked in the sidebar, else the configured default"""
+    return st.session_state.get('model_backend') or os.environ.get('RAFIQ_MODEL_BACKEND', 'mock')
+
+@st.cache_resource
+def get_prediction_cache(backend):
+    """Prediction cache shared by all sessions, one per backend"""
+    return PredictionCache(get_model(backend).features, maxsize=10000)
+
+def cached_prediction(profile):
+    """Score a profile, reusing the result while its features are unchanged"""
+    model = get_model(selected_backend())
+    return get_prediction_cache(model.backend).get_or_compute(profile, model.version, model.predict)
+
+@st.cache_resource(max_entries=256)
+def get_what_if_grid(backend, version, features):
+    """What-if grid for one set of feature values, shared by all sessions"""
+    model = get_model(backend)
+    return what_if_grid(model.predict_batch, model.features, dict(features))
+
+def profile_what_if_grid(profile):
+    """The profile's what-if grid: scored on first use, then only sliced"""
+    model = get_model(selected_backend())
+    return get_what_if_grid(model.backend, model.version,
+                            tuple((f, profile[f]) for f in model.features))
+
+@st.cache_resource
+def get_session_store():
     """
-    Simulates ML model predictions based on user behavioral features.
-    Returns the best nudge recommendation with confidence score.
+    Conversation sessions persisted to SQLite at $RAFIQ_SESSION_DB (default:
+    a file in the temp directory), shared by all browser sessions. Profiles
+    and histories are stored unencrypted: fine for the demo, not for real
+    users' data.
     """
-    predictions = {}
-    
-    # Rule 1: Refresh CV if stale
-    if user_features['days_since_last_refresh'] > 7:
-        predictions['refresh_cv'] = 0.65 + (user_features['days_since_last_refresh'] - 7) * 0.02
-    else:
-        predictions['refresh_cv'] = 0.15
-    
-    # Rule 2: Add skills if profile incomplete
-    if user_features['profile_completeness'] < 70:
-        gap = 70 - user_features['profile_completeness']
-        predictions['add_skill'] = 0.50 + (gap * 0.01)
-    else:
-        predictions['add_skill'] = 0.10
-    
-    # Rule 3: Apply to jobs if searching but not applying
-    if user_features['job_searches'] > 3 and user_features['applications_count'] == 0:
-        predictions['apply_job'] = 0.70
-    elif user_features['job_searches'] > 0 and user_features['applications_count'] < 2:
-        predictions['apply_job'] = 0.45
-    else:
-        predictions['apply_job'] = 0.20
-    
-    # Normalize to sum to 1.0
-    total = sum(predictions.values())
-    predictions = {k: v/total for k, v in predictions.items()}
-    
-    # Get top prediction
-    top_nudge = max(predictions, key=predictions.get)
-    confidence = predictions[top_nudge]
-    
-    return {
-        'nudge': top_nudge,
-        'confidence': confidence,
-        'all_predictions': predictions,
-        'expected_outcomes': {
-            'refresh_cv': 'emp_cv_views',
-            'add_skill': 'emp_contact_flips',
-            'apply_job': 'emp_reveals'
-        }[top_nudge]
-    }
-
-# ============================================================================
-# CONVERSATION FLOWS
-# ============================================================================
-
-CONVERSATION_FLOWS = {
-    'refresh_cv': {
-        'initial': {
-            'message': """Hey {name}! 👋 I've been analyzing your job search activity, and I found something that could really boost your visibility.
-
-**What I noticed:**
-Your profile got {emp_cv_views_last_week} employer views this week, but it's been {days_since_last_refresh} days since your last CV refresh.
-
-**Here's what our data shows:**
-Users in your situation who refresh their CV see an average of **3x more employer views** in the next week. I'm pretty confident ({confidence}% probability) this would help you too.
-
-Want me to refresh it for you right now? Takes 2 seconds.""",
-            'buttons': ['Yes, refresh it', 'Why does this help?', 'Not right now']
-        },
-        'why': {
-            'message': """Great question! Here's what happens behind the scenes:
-
-**The Algorithm:**
-When you refresh, your profile moves to the top of "Recently Updated" lists that employers browse. It's like bumping a post on social media.
-
-**The Data:**
-I analyzed thousands of users with similar patterns to yours:
-- {login_count} logins this week ✓
-- {applications_count} applications ✓
-- {days_since_last_refresh} days since last refresh ✓
-
-72% of them got more employer views after refreshing, with an average increase of **5-8 new views** in the next 48 hours.
-
-**Your Specific Situation:**
-You're active (great!), but employers might not see you because older profiles get pushed down in search results.
-
-Make sense? Should I refresh it?""",
-            'buttons': ['Yes, refresh it', 'Maybe later']
-        },
-        'success': {
-            'message': """Done! ✅ Your CV is now marked as "Updated today"
-
-**What to expect:**
-- Next 24-48 hours: 5-8 new employer views (based on prediction)
-- Increased chance of contact flips (18% probability)
-- Better visibility in employer searches
-
-**Pro tip:** Our model found that users who refresh every 7-10 days stay consistently visible. Want me to remind you next week?""",
-            'buttons': ['Yes, remind me', 'No thanks']
-        },
-        'remind_set': {
-            'message': """Perfect! Reminder set for next Monday. 📅
-
-By the way, I noticed your profile is {profile_completeness}% complete. While you're on a roll, want to quickly boost it? Adding 5-7 more skills could increase your contact flip rate even more.
-
-(This was my second-best recommendation for you)""",
-            'buttons': ['Sure, let\'s add skills', 'Maybe later', 'I\'m good for now']
-        },
-        'later': {
-            'message': """No problem! I'll check back in with you in a couple days.
-
-Quick tip: Even adding just your top 5 skills could make a big difference. It takes less than 2 minutes.
-
-Is there anything else I can help you with?""",
-            'buttons': ['Find jobs for me', 'Check my profile', 'I\'m all set']
-        }
-    },
-    
-    'add_skill': {
-        'initial': {
-            'message': """Hey {name}! 👋
-
-I ran a quick analysis of your profile and found an opportunity to significantly boost your visibility.
-
-**Current status:**
-- Profile completeness: {profile_completeness}%
-- Employer views this week: {emp_cv_views_last_week}
-
-**The opportunity:**
-Profiles above 85% complete get contacted **3x more often**. You're just a few skills away from hitting that threshold!
-
-Our model predicts ({confidence}% confidence) that adding 5-7 key skills would increase your employer contact rate by **2.8x**.
-
-Want me to show you which skills to add?""",
-            'buttons': ['Yes, show me', 'Why does this matter?', 'Not interested']
-        },
-        'show_skills': {
-            'message': """Perfect! Based on your work history in **{industry}**, here are 8 skills that match your background AND are trending in job postings right now:
-
-**Top Skills for {industry}:**
-
-Select your top 5-7 skills:""",
-            'buttons': ['Python', 'SQL', 'Tableau', 'Machine Learning', 
-                       'Data Visualization', 'Statistics', 'Excel', 'Communication']
-        },
-        'skills_added': {
-            'message': """Excellent choices! ✅ Skills added to your profile.
-
-**Your profile now:**
-- Completeness: {profile_completeness}% → {new_completeness}% (+{improvement}%)
-- Skills listed: {old_skills} → {new_skills} (+{skills_added})
-
-**Impact prediction:**
-Users who made similar updates saw:
-- **2.8x increase** in employer contact flips
-- **40% more** profile views within 7 days
-
-I'll track your results and check back next week to see if you hit these benchmarks!
-
-Anything else you need help with?""",
-            'buttons': ['Find jobs for me', 'What else can I improve?', 'I\'m all set']
-        },
-        'why_matters': {
-            'message': """Great question! Here's what the data shows:
-
-📊 **Profiles 85%+ complete:**
-• Get **3.2x more** employer views
-• Receive **2.8x more** contact reveals
-• Have **40% higher** application success rates
-
-**Why?**
-Employers use filters to search. Incomplete profiles often don't show up in results.
+    path = os.environ.get('RAFIQ_SESSION_DB',
+                          os.path.join(tempfile.gettempdir(), 'rafiq_sessions.sqlite3'))
+    return SessionStore(SQLiteSessionBackend(path), ConversationSession, ttl=SESSION_TTL)
 
-Think of it like a dating profile - the more someone knows about you (professionally!), the more likely they are to reach out.
+# Cookie holding this browser's resume secret
+RESUME_COOKIE = 'rafiq_resume'
 
-Plus, adding skills takes less than 2 minutes and has the biggest impact on visibility.
+def owner_digest(secret):
+    return blake2b(secret.encode('utf-8'), digest_size=16).hexdigest()
 
-Ready to fill in those gaps?""",
-            'buttons': ['Yes, let\'s do it', 'I\'ll do it later']
-        }
-    },
-    
-    'apply_job': {
-        'initial': {
-            'message': """Hey {name}! 👋 I've got a time-sensitive opportunity for you.
-
-**What I noticed:**
-You've searched for {job_searches} jobs this week but haven't applied yet.
-
-**The opportunity:**
-I found 3 roles that match your profile (85%+ match). Here's why timing matters:
-
-📊 **Applications in first 5 days:** 58% response rate  
-📊 **Applications after day 7:** 12% response rate
-
-Our model is {confidence}% confident that applying to 2-3 jobs this week would significantly increase your chances of getting contacted.
-
-Want to see the top matches?""",
-            'buttons': ['Yes, show me jobs', 'Why should I apply now?', 'Not interested']
-        },
-        'show_jobs': {
-            'message': """Here are your top 3 matches based on your {industry} background:
-
-**1. Senior Data Analyst at DataCo**
-Match: 92% | Posted: 1 day ago | 🔥 Fresh  
-Salary: $95K-115K | Remote  
-
-**2. Data Scientist at TechCorp**
-Match: 88% | Posted: 3 days ago  
-Salary: $100K-130K | Hybrid - SF  
-
-**3. Analytics Manager at FinanceHub**
-Match: 85% | Posted: 2 days ago  
-Salary: $110K-140K | Remote  
-
-**Why these?**
-They match your skills, are recently posted, and users with similar profiles got **58% response rates** when applying within 5 days.
-
-Which one interests you most?""",
-            'buttons': ['Tell me about #1', 'Tell me about #2', 'Tell me about #3', 'Not interested in any']
-        },
-        'job_details': {
-            'message': """**Senior Data Analyst at DataCo**
-
-**The Role:**
-• Lead analytics for product launches
-• Build predictive models
-• Work with cross-functional teams
-
-**Requirements:**
-✅ Python - You have this  
-✅ SQL - You have this  
-✅ Tableau - You have this  
-✅ 5+ years experience - You have {years} years  
-⚠️ Hadoop - Nice to have (optional)
-
-**Your Match: 92%**
-
-**Company Info:**
-• Series C startup, 200 employees
-• Known for: Strong data culture, remote-friendly
-• Glassdoor: 4.2/5
-
-**Why apply NOW:**
-• Posted yesterday (freshest applicants get seen first)
-• You're missing only 1 optional skill
-• 58% response rate for applications in first 5 days
-
-Ready to apply?""",
-            'buttons': ['Yes, apply now', 'I\'m not qualified enough', 'Maybe later']
-        },
-        'not_qualified': {
-            'message': """I hear you - that's totally normal! But let's look at the facts:
-
-**Skills Match: 92%**
-You have 11 out of 12 requirements. Most candidates have fewer.
-
-**Experience Match:**
-They want 5+ years, you have 6. ✓
-
-**The Gap:**
-Hadoop is listed as "nice to have", not required. Only about 30% of hired candidates have every single preferred skill.
-
-**Historical Data:**
-Users with 85%+ match rates who applied within 3 days got contacted **58% of the time**. You're at 92%.
-
-**What our model predicts:**
-If you apply now: **13% probability** of employer contact reveal  
-If you DON'T apply: **0% chance** 🤷‍♀️
-
-The worst that happens is they don't respond. The best? You get an interview.
-
-Want to go for it?""",
-            'buttons': ['Okay, let\'s apply', 'Still not sure']
-        },
-        'application_submitted': {
-            'message': """Submitted! ✅
-
-**Application sent to DataCo**  
-Role: Senior Data Analyst  
-Time: Just now  
-
-**What typically happens next:**
-• Days 1-7: They review applications
-• Days 7-14: First interviews scheduled
-• Average response time: 6 days
-
-**Your Success Probability:**
-Based on the model and this role's match rate:
-• 58% chance of getting viewed
-• 13% chance of contact reveal
-
-I'll track this for you and let you know if there's any activity!
-
-**Keep Momentum Going:**
-Want to apply to 1-2 more similar roles? Users who submit **3+ applications per week** have 40% higher overall success rates.""",
-            'buttons': ['Yes, show me more', 'I\'ll wait to hear back', 'I\'m done for now']
-        }
-    }
-}
-
-# Skills database for different industries
-INDUSTRY_SKILLS = {
-    'Data Analytics': ['Python', 'SQL', 'Tableau', 'Machine Learning', 
-                       'Data Visualization', 'Statistics', 'Excel', 'Communication'],
-    'Software Engineering': ['JavaScript', 'Python', 'React', 'Node.js', 
-                            'AWS', 'Docker', 'Git', 'Agile'],
-    'Marketing': ['SEO', 'Google Analytics', 'Content Marketing', 'Social Media', 
-                  'Email Marketing', 'Copywriting', 'A/B Testing', 'CRM']
-}
-
-# ============================================================================
-# STREAMLIT APP
-# ============================================================================
+def resumable(session_id, secret):
+    """
+    Whether this browser may resume the session named in its URL: only with
+    the secret the session was created under. A shared link alone doesn't
+    hand over a profile and its history.
+    """
+    store = get_session_store()
+    return (session_id is not None and secret is not None and session_id in store
+            and store.get(session_id).owner == owner_digest(secret))
 
 def initialize_session_state():
     """Initialize session state variables"""
-    if 'user_profile' not in st.session_state:
-        st.session_state.user_profile = None
-    if 'messages' not in st.session_state:
-        st.session_state.messages = []
-    if 'conversation_flow' not in st.session_state:
-        st.session_state.conversation_flow = None
-    if 'conversation_step' not in st.session_state:
-        st.session_state.conversation_step = None
-    if 'ml_prediction' not in st.session_state:
-        st.session_state.ml_prediction = None
-    if 'skills_selected' not in st.session_state:
-        st.session_state.skills_selected = []
-
-def format_message(template, user_profile, **kwargs):
-    """Format message template with user data"""
-    format_dict = {**user_profile, **kwargs}
-    return template.format(**format_dict)
-
-def add_message(role, content):
-    """Add message to chat history"""
-    st.session_state.messages.append({
-        'role': role,
-        'content': content,
-        'timestamp': datetime.now()
-    })
-
-def start_conversation(flow_type, user_profile, ml_prediction):
-    """Start a new conversation flow"""
-    st.session_state.conversation_flow = flow_type
-    st.session_state.conversation_step = 'initial'
-    st.session_state.ml_prediction = ml_prediction
-    
-    # Get initial message
-    flow = CONVERSATION_FLOWS[flow_type]
-    initial = flow['initial']
-    
-    confidence = int(ml_prediction['confidence'] * 100)
-    message = format_message(
-        initial['message'], 
-        user_profile,
-        confidence=confidence
-    )
-    
-    add_message('assistant', message)
-
-def handle_user_response(response):
-    """Handle user button click"""
-    # Add user's response to chat
-    add_message('user', response)
-    
-    current_flow = st.session_state.conversation_flow
-    current_step = st.session_state.conversation_step
-    user_profile = st.session_state.user_profile
-    
-    flow = CONVERSATION_FLOWS[current_flow]
-    
-    # Determine next step based on response
-    next_step = None
-    
-    if current_flow == 'refresh_cv':
-        if response == 'Yes, refresh it':
-            next_step = 'success'
-        elif response == 'Why does this help?':
-            next_step = 'why'
-        elif response == 'Not right now' or response == 'Maybe later':
-            next_step = 'later'
-        elif response == 'Yes, remind me':
-            next_step = 'remind_set'
-        elif response == "Sure, let's add skills":
-            # Switch to add_skill flow
-            st.session_state.conversation_flow = 'add_skill'
-            st.session_state.conversation_step = 'show_skills'
-            next_step = 'show_skills'
-            current_flow = 'add_skill'
-            flow = CONVERSATION_FLOWS['add_skill']
-    
-    elif current_flow == 'add_skill':
-        if response == 'Yes, show me':
-            next_step = 'show_skills'
-        elif response == 'Why does this matter?':
-            next_step = 'why_matters'
-        elif response in ['Yes, let\'s do it', 'I\'ll do it later']:
-            next_step = 'show_skills' if response == 'Yes, let\'s do it' else 'initial'
-        elif response in INDUSTRY_SKILLS.get(user_profile['industry'], []):
-            # User is selecting skills
-            if response not in st.session_state.skills_selected:
-                st.session_state.skills_selected.append(response)
-            return  # Don't send message yet, wait for more selections
-    
-    elif current_flow == 'apply_job':
-        if response == 'Yes, show me jobs':
-            next_step = 'show_jobs'
-        elif response in ['Tell me about #1', 'Tell me about #2', 'Tell me about #3']:
-            next_step = 'job_details'
-        elif response == 'Yes, apply now' or response == 'Okay, let\'s apply':
-            next_step = 'application_submitted'
-        elif response == 'I\'m not qualified enough':
-            next_step = 'not_qualified'
-    
-    # Send next message
-    if next_step and next_step in flow:
-        st.session_state.conversation_step = next_step
-        step_data = flow[next_step]
-        
-        # Special handling for skills_added
-        if next_step == 'skills_added':
-            old_completeness = user_profile['profile_completeness']
-            skills_added = len(st.session_state.skills_selected)
-            new_completeness = min(100, old_completeness + (skills_added * 3))
-            
-            message = format_message(
-                step_data['message'],
-                user_profile,
-                new_completeness=new_completeness,
-                improvement=new_completeness - old_completeness,
-                old_skills=user_profile['unique_skills_added'],
-                new_skills=user_profile['unique_skills_added'] + skills_added,
-                skills_added=skills_added
-            )
-        else:
-            message = format_message(step_data['message'], user_profile, years=6)
-        
-        add_message('assistant', message)
-
-def main():
-    initialize_session_state()
-    
-    # Header
-    st.title("🤝 Rafiq - Your AI Career Assistant")
-    st.caption("Powered by behavioral intelligence to maximize your job search success")
+    if 'session_id' not in st.session_state:
+        # ?session= plus the cookie's secret survive a server restart
+        session_id = st.query_params.get('session')
+        secret = st.context.cookies.get(RESUME_COOKIE)
+        if not isinstance(secret, str) or not secret:
+            secret = None
+        if not resumable(session_id, secret):
+            if secret is None:
+                secret = secrets.token_urlsafe(24)
+                st.html(f"<script>document.cookie = '{RESUME_COOKIE}={secret}; path=/; "
+                        f"max-age={30 * 86400}; SameSite=Strict'</script>",
+                        unsafe_allow_javascript=True)
+            session_id = secrets.token_urlsafe(12)
+            get_session_store().add(session_id, ConversationSession(owner=owner_digest(secret)))
+            st.query_params['session'] = session_id
+        st.session_state.session_id = session_id
+    if 'earlier_shown' not in st.session_state:
+        st.session_state.earlier_shown = 0
+
+def current_session():
+    """This browser session's conversation, restored if it was evicted"""
+    return get_session_store().get(st.session_state.session_id)
+
+@st.cache_resource(ttl=3600)
+def purge_old_sessions():
+    """
+    Delete sessions untouched for SESSION_RETENTION and the catalog versions
+    only they used; runs at most hourly
+    """
+    store = get_session_store()
+    store.backend.purge(SESSION_RETENTION)
+    release_catalog_versions(store)
+
+def save_session():
+    """Write through whatever this run changed, then drop idle and old sessions"""
+    if 'session_id' in st.session_state:
+        store = get_session_store()
+        store.commit(st.session_state.session_id)
+        store.evict_idle()
+        purge_old_sessions()
+
+# Fragments that rerun on their own. Clicks are handled in callbacks that
+# name the fragment to redraw, so a chat button redraws the chat, a skill
+# toggle only the grid, and the sidebar only its own controls.
+SIDEBAR = 'sidebar'
+CHAT = 'chat'
+SKILL_GRID = 'skill_grid'
+WHAT_IF = 'what_if'
+COHORTS = 'cohorts'
+
+def fragment(key):
+    """
+    st.fragment with a fixed key, timed as fragment_<key>. A fragment rerun
+    never reaches the end of the script, so it saves the session itself.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def run():
+            try:
+                with metrics.timer(f'fragment_{key}'):
+                    fn()
+            finally:
+                save_session()
+        return st.fragment(run, key=key)
+    return decorate
+
+@st.cache_resource
+def get_cohort_stats(backend, version):
+    """
+    Cohort sketches of the profile store, shared by all sessions. Under
+    $RAFIQ_COHORT_STATE they outlive the process, so a restart only reads
+    stores written since.
+    """
+    model = get_model(backend)
+    return cohort_stats([load_profile_store()], model.predict_batch, model.features,
+                        model.version, NUDGES, os.environ.get('RAFIQ_COHORT_STATE'))
+
+def load_profile(user_id):
+    session = current_session()
+    session.user_profile = load_profile_store()[user_id]
+    session.user_id = user_id
+    session.reset()
+    st.session_state.earlier_shown = 0
+    st.session_state.loaded_name = session.user_profile['name']
+    for feature in WHAT_IF_AXES:
+        st.session_state.pop(f'what_if_{feature}', None)
+    st.rerun()     # the whole page depends on the profile
+
+def run_prediction():
+    session = current_session()
+    session.ml_prediction = cached_prediction(session.user_profile)
+    st.session_state.show_prediction = True
+    st.rerun(SIDEBAR)
+
+def show_what_if():
+    st.rerun()     # the explorer is drawn in the main area
+
+def refresh_cohorts():
+    get_cohort_stats.clear()
+    st.rerun(COHORTS)
+
+def start_flow(flow_type):
+    session = current_session()
+    start_conversation(session, flow_type, cached_prediction(session.user_profile))
+    st.rerun(CHAT)
+
+def reset_conversation():
+    current_session().reset()
+    st.session_state.earlier_shown = 0
+    st.rerun(CHAT)
+
+def show_earlier():
+    st.session_state.earlier_shown += HISTORY_PAGE_SIZE
+    st.rerun(CHAT)
+
+def respond(button_text):
+    handle_user_response(current_session(), button_text)
+    st.rerun(CHAT)
+
+def toggle(skill):
+    toggle_skill(current_session(), skill)
+    st.rerun(SKILL_GRID)
+
+def add_skills():
+    submit_skills(current_session())
+    st.rerun(CHAT)
+
+@fragment(SIDEBAR)
+def sidebar_panel():
+    profiles = load_profile_store()
+    session = current_session()
     
-    # Sidebar - User Selection & Stats
     with st.sidebar:
         st.header("Demo Controls")
         
-        # User selection
+        # User selection. The store can hold millions of users, too many
+        # to list, so the selectbox only decodes one page of ids at a time
+        pages = max(-(-profiles.rows // USER_PAGE_SIZE), 1)
+        page = st.number_input("User page:", min_value=1, max_value=pages,
+                               key='user_page') if pages > 1 else 1
+        start = (page - 1) * USER_PAGE_SIZE
         user_id = st.selectbox(
             "Select Demo User:",
-            options=list(TEST_USERS.keys()),
-            format_func=lambda x: TEST_USERS[x]['name']
+            options=[profiles.user_id(row)
+                     for row in range(start, min(start + USER_PAGE_SIZE, profiles.rows))],
+            format_func=lambda x: profiles[x]['name']
         )
         
-        if st.button("Load User Profile"):
-            st.session_state.user_profile = TEST_USERS[user_id]
-            st.session_state.messages = []
-            st.session_state.conversation_flow = None
-            st.success(f"Loaded profile for {TEST_USERS[user_id]['name']}")
+        # Backend switch, once a tree model is configured
+        if os.environ.get('RAFIQ_MODEL_PATH'):
+            st.radio(
+                "Model backend:",
+                options=MODEL_BACKENDS,
+                index=MODEL_BACKENDS.index(os.environ.get('RAFIQ_MODEL_BACKEND', 'mock')),
+                key='model_backend',
+                horizontal=True
+            )
+        
+        st.button("Load User Profile", on_click=load_profile, args=(user_id,),
+                  disabled=user_id is None)
+        if 'loaded_name' in st.session_state:
+            st.success(f"Loaded profile for {st.session_state.pop('loaded_name')}")
         
         # Display user stats if loaded
-        if st.session_state.user_profile:
+        if session.user_profile:
             st.divider()
             st.subheader("User Profile")
-            profile = st.session_state.user_profile
+            profile = session.user_profile
             
             col1, col2 = st.columns(2)
             with col1:
@@ -561,9 +290,10 @@ def main():
             st.divider()
             
             # ML Model Prediction
-            if st.button("Run ML Model Prediction"):
-                prediction = mock_ml_prediction(profile)
-                st.session_state.ml_prediction = prediction
+            st.button("Run ML Model Prediction", on_click=run_prediction)
+            st.toggle("What-if explorer", key='what_if', on_change=show_what_if)
+            if st.session_state.pop('show_prediction', False):
+                prediction = session.ml_prediction
                 
                 st.subheader("ML Model Output")
                 st.write(f"**Top Recommendation:** `{prediction['nudge']}`")
@@ -574,33 +304,283 @@ def main():
                 for nudge, prob in sorted(prediction['all_predictions'].items(), 
                                          key=lambda x: x[1], reverse=True):
                     st.progress(prob, text=f"{nudge}: {prob:.1%}")
+                
+                cache_stats = get_prediction_cache(selected_backend()).stats()
+                st.caption(f"Prediction cache: {cache_stats['hits']} hits, "
+                           f"{cache_stats['misses']} misses, {cache_stats['size']} entries")
             
             st.divider()
             
             # Start conversation buttons
             st.subheader("Start Conversation")
-            if st.button("🔄 Refresh CV Nudge"):
-                start_conversation('refresh_cv', profile, 
-                                 mock_ml_prediction(profile))
-                st.rerun()
-            
-            if st.button("⚡ Add Skills Nudge"):
-                start_conversation('add_skill', profile, 
-                                 mock_ml_prediction(profile))
-                st.rerun()
+            st.button("🔄 Refresh CV Nudge", on_click=start_flow, args=('refresh_cv',))
+            st.button("⚡ Add Skills Nudge", on_click=start_flow, args=('add_skill',))
+            st.button("📋 Apply to Jobs Nudge", on_click=start_flow, args=('apply_job',))
+            st.button("🔄 Reset Conversation", on_click=reset_conversation)
+
+@fragment(CHAT)
+def chat_panel():
+    session = current_session()
+    
+    # Display chat messages, older turns only on request
+    history = session.messages
+    hidden = history.archived_count - st.session_state.earlier_shown
+    if hidden > 0:
+        st.button(f"⬆️ Load earlier messages ({hidden} more)", on_click=show_earlier)
+    
+    shown = min(st.session_state.earlier_shown, history.archived_count)
+    with metrics.timer('chat_render'):
+        for message in history.earlier(shown) + history.recent():
+            with st.chat_message(message.role):
+                st.markdown(message.content)
+    
+    # A queued reply is drawn chunk by chunk and joins the history when complete
+    if session.pending_reply is not None:
+        with st.chat_message('assistant'):
+            st.write_stream(stream_reply(session))
+    
+    # Display buttons for current conversation step
+    buttons = current_buttons(session)
+    if buttons:
+        st.divider()
+        
+        # Special handling for skill selection
+        if session.conversation_step == 'show_skills':
+            skill_grid()
+        else:
+            # Regular buttons
+            cols = st.columns(len(buttons))
+            for i, button_text in enumerate(buttons):
+                with cols[i]:
+                    st.button(button_text, key=f"btn_{i}", on_click=respond, args=(button_text,))
+
+    # Show welcome message if no conversation started
+    if not session.messages:
+        with st.chat_message("assistant"):
+            st.markdown(f"""
+            👋 Hi {session.user_profile['name']}! I'm **Rafiq**, your AI career assistant.
             
-            if st.button("📋 Apply to Jobs Nudge"):
-                start_conversation('apply_job', profile, 
-                                 mock_ml_prediction(profile))
-                st.rerun()
+            I analyze your job search activity to help you get more employer attention and land interviews faster.
             
-            if st.button("🔄 Reset Conversation"):
-                st.session_state.messages = []
-                st.session_state.conversation_flow = None
-                st.rerun()
+            Click one of the buttons in the sidebar to see how I can help you today!
+            """)
+
+@fragment(SKILL_GRID)
+def skill_grid():
+    session = current_session()
+    st.write("**Select 5-7 skills:**")
+    
+    # Trending skills for the user's industry
+    cols = st.columns(4)
+    for i, skill in enumerate(current_buttons(session)):
+        with cols[i % 4]:
+            st.button(
+                skill, 
+                key=f"skill_{skill}",
+                type="primary" if skill in session.skills_selected else "secondary",
+                on_click=toggle,
+                args=(skill,)
+            )
+    
+    st.write(f"Selected: {len(session.skills_selected)} skills")
+    
+    if len(session.skills_selected) >= MIN_SKILLS_SELECTED:
+        st.button("✅ Add These Skills", type="primary", on_click=add_skills)
+
+WHAT_IF_LABELS = {
+    'days_since_last_refresh': "Days since refresh",
+    'profile_completeness': "Profile completeness (%)",
+    'job_searches': "Job searches"
+}
+
+# (x, y) feature pairs the decision-boundary chart can plot
+WHAT_IF_CHARTS = [
+    ('days_since_last_refresh', 'profile_completeness'),
+    ('days_since_last_refresh', 'job_searches'),
+    ('profile_completeness', 'job_searches')
+]
+
+def decision_chart(probabilities, x, y, point):
+    """Vega-Lite heatmap of the top nudge over x and y, the what-if point marked"""
+    top = probabilities.argmax(axis=-1)
+    xs, ys = WHAT_IF_AXES[x], WHAT_IF_AXES[y]
+    data = pd.DataFrame({
+        x: xs.repeat(len(ys)),
+        y: ys[None, :].repeat(len(xs), axis=0).ravel(),
+        'nudge': pd.Categorical.from_codes(top.ravel(), NUDGES),
+        'confidence': probabilities.max(axis=-1).ravel()
+    })
+    color = {'field': 'nudge', 'type': 'nominal', 'scale': {'domain': list(NUDGES)}}
+    spec = {
+        'height': 320,
+        'layer': [
+            {
+                'mark': {'type': 'rect'},
+                'encoding': {
+                    'x': {'field': x, 'type': 'quantitative', 'bin': {'binned': True, 'step': 1},
+                          'title': WHAT_IF_LABELS[x]},
+                    'y': {'field': y, 'type': 'quantitative', 'bin': {'binned': True, 'step': 1},
+                          'title': WHAT_IF_LABELS[y]},
+                    'color': color,
+                    'opacity': {'field': 'confidence', 'type': 'quantitative', 'legend': None,
+                                'scale': {'range': [0.45, 1]}},
+                    'tooltip': [{'field': x}, {'field': y}, {'field': 'nudge'},
+                                {'field': 'confidence', 'format': '.1%'}]
+                }
+            },
+            {
+                'data': {'values': [{x: point[x], y: point[y]}]},
+                'mark': {'type': 'point', 'shape': 'cross', 'size': 200, 'color': 'black',
+                         'filled': True},
+                'encoding': {'x': {'field': x, 'type': 'quantitative'},
+                             'y': {'field': y, 'type': 'quantitative'}}
+            }
+        ]
+    }
+    return data, spec
+
+def sensitivity_chart(probabilities, feature):
+    """
+    Vega-Lite curves of every nudge's probability along one feature. Specs
+    are passed as dicts: st.line_chart goes through Altair and costs ~100 ms.
+    """
+    values = WHAT_IF_AXES[feature]
+    data = pd.DataFrame({
+        feature: values.repeat(len(NUDGES)),
+        'nudge': pd.Categorical.from_codes(np.tile(np.arange(len(NUDGES)), len(values)), NUDGES),
+        'probability': probabilities.ravel()
+    })
+    spec = {
+        'height': 200,
+        'mark': {'type': 'line'},
+        'encoding': {
+            'x': {'field': feature, 'type': 'quantitative', 'title': WHAT_IF_LABELS[feature]},
+            'y': {'field': 'probability', 'type': 'quantitative', 'axis': {'format': '.0%'}},
+            'color': {'field': 'nudge', 'type': 'nominal', 'scale': {'domain': list(NUDGES)}}
+        }
+    }
+    return data, spec
+
+@fragment(WHAT_IF)
+def what_if_panel():
+    session = current_session()
+    profile = session.user_profile
+    grid = profile_what_if_grid(profile)
+
+    with st.container(border=True):
+        st.subheader("What-if Explorer")
+        st.caption("How the recommendation changes as the profile's features vary. "
+                   "Moving a slider only re-slices this profile's scored grid.")
+
+        point = {}
+        clamped = []
+        cols = st.columns(len(WHAT_IF_AXES))
+        for col, (feature, values) in zip(cols, WHAT_IF_AXES.items()):
+            with col:
+                low, high = int(values[0]), int(values[-1])
+                if not low <= profile[feature] <= high:
+                    clamped.append(f"{WHAT_IF_LABELS[feature].lower()} ({profile[feature]})")
+                point[feature] = st.slider(WHAT_IF_LABELS[feature], low, high,
+                                           value=min(max(int(profile[feature]), low), high),
+                                           key=f'what_if_{feature}')
+
+        if clamped:
+            st.caption(f"This profile's {' and '.join(clamped)} "
+                       f"{'is' if len(clamped) == 1 else 'are'} outside the explorer's range, "
+                       "so the slider starts at the nearest end.")
+
+        probabilities = dict(zip(NUDGES, what_if_slice(grid, (), point).tolist()))
+        nudge = max(probabilities, key=probabilities.get)
+        # The real recommendation, not the grid's: the profile may lie off its axes
+        was = cached_prediction(profile)['nudge']
+        st.write(f"**Recommendation here:** `{nudge}` ({probabilities[nudge]:.1%})"
+                 + (f", flipped from `{was}`" if nudge != was else ""))
+
+        x, y = st.selectbox("Chart", WHAT_IF_CHARTS, key='what_if_chart',
+                            format_func=lambda pair: f"{WHAT_IF_LABELS[pair[0]]} × {WHAT_IF_LABELS[pair[1]]}")
+        data, spec = decision_chart(what_if_slice(grid, (x, y), point), x, y, point)
+        st.vega_lite_chart(data, spec, width='stretch')
+
+        # One curve per nudge along each charted feature
+        for col, feature in zip(st.columns(2), (x, y)):
+            with col:
+                data, spec = sensitivity_chart(what_if_slice(grid, (feature,), point), feature)
+                st.vega_lite_chart(data, spec, width='stretch')
+
+COHORT_LABELS = {'industry': "Industry", 'nudge': "Recommended nudge"}
+
+def nudge_mix_chart(summary):
+    """Vega-Lite bars of each group's recommended-nudge shares"""
+    data = pd.DataFrame([
+        {'group': g['group'], 'nudge': nudge, 'share': share}
+        for g in summary for nudge, share in g['nudges'].items()
+    ])
+    spec = {
+        'height': 40 + 28 * len(summary),
+        'mark': {'type': 'bar'},
+        'encoding': {
+            'y': {'field': 'group', 'type': 'nominal', 'sort': None, 'title': None},
+            'x': {'field': 'share', 'type': 'quantitative', 'stack': 'normalize',
+                  'axis': {'format': '%'}, 'title': "Share of users"},
+            'color': {'field': 'nudge', 'type': 'nominal', 'scale': {'domain': list(NUDGES)}},
+            'tooltip': [{'field': 'group'}, {'field': 'nudge'},
+                        {'field': 'share', 'format': '.1%'}]
+        }
+    }
+    return data, spec
+
+@fragment(COHORTS)
+def cohort_panel():
+    model = get_model(selected_backend())
+    stats = get_cohort_stats(model.backend, model.version)
+
+    st.subheader("Population Cohorts")
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        st.caption(f"{stats.rows:,} profiles, aggregated in one streaming pass over the "
+                   f"profile store and scored with `{model.version}`")
+    with col2:
+        st.button("🔄 Refresh", key='refresh_cohorts', on_click=refresh_cohorts, width='stretch')
+
+    col1, col2 = st.columns(2)
+    with col1:
+        dimension = st.radio("Group by", DIMENSIONS, format_func=COHORT_LABELS.get,
+                             horizontal=True, key='cohort_dimension')
+    with col2:
+        feature = st.selectbox("Feature", stats.features, key='cohort_feature',
+                               format_func=lambda f: f.replace('_', ' ').capitalize())
+    summary = stats.summary(dimension)
+
+    quantiles = [f'p{round(q * 100)}' for q in QUANTILES]
+    table = pd.DataFrame([
+        {COHORT_LABELS[dimension]: g['group'], 'Users': g['count'],
+         **{k: g['features'][feature][k] for k in ('mean', 'std', 'min', *quantiles, 'max')}}
+        for g in summary
+    ])
+    # Quantiles come from sketches, accurate to about 1%
+    st.dataframe(table, hide_index=True, width='stretch',
+                 column_config={k: st.column_config.NumberColumn(format='%.1f')
+                                for k in ('mean', 'std', *quantiles)})
+
+    if dimension == 'industry':
+        st.write("**Recommended nudges**")
+        data, spec = nudge_mix_chart(summary)
+        st.vega_lite_chart(data, spec, width='stretch')
+
+@metrics.timed('rerun')
+def main():
+    initialize_session_state()
+    session = current_session()
+    
+    # Header
+    st.title("🤝 Rafiq - Your AI Career Assistant")
+    st.caption("Powered by behavioral intelligence to maximize your job search success")
+    
+    # Sidebar - User Selection & Stats
+    sidebar_panel()
     
     # Main chat area
-    if not st.session_state.user_profile:
+    if not session.user_profile:
         st.info("👈 Select a demo user from the sidebar to get started!")
         
         # Show demo info
@@ -622,99 +602,17 @@ def main():
         4. Tracks outcomes to validate predictions
         """)
         
-        st.subheader("Demo Users")
-        for user_id, profile in TEST_USERS.items():
-            with st.expander(f"{profile['name']} - {profile['industry']}"):
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.write(f"**Profile:** {profile['profile_completeness']}%")
-                    st.write(f"**Views:** {profile['emp_cv_views_last_week']}")
-                with col2:
-                    st.write(f"**Applications:** {profile['applications_count']}")
-                    st.write(f"**Searches:** {profile['job_searches']}")
-                with col3:
-                    st.write(f"**Days Since Refresh:** {profile['days_since_last_refresh']}")
-                    st.write(f"**Skills:** {profile['unique_skills_added']}")
+        cohort_panel()
         
         return
     
-    # Display chat messages
-    for message in st.session_state.messages:
-        with st.chat_message(message['role']):
-            st.markdown(message['content'])
-    
-    # Display buttons for current conversation step
-    if st.session_state.conversation_flow and st.session_state.conversation_step:
-        flow = CONVERSATION_FLOWS[st.session_state.conversation_flow]
-        step = flow[st.session_state.conversation_step]
-        
-        if 'buttons' in step:
-            st.divider()
-            
-            # Special handling for skill selection
-            if st.session_state.conversation_step == 'show_skills':
-                st.write("**Select 5-7 skills:**")
-                
-                # Show industry-specific skills
-                industry = st.session_state.user_profile['industry']
-                skills = INDUSTRY_SKILLS.get(industry, [])
-                
-                cols = st.columns(4)
-                for i, skill in enumerate(skills):
-                    with cols[i % 4]:
-                        if st.button(
-                            skill, 
-                            key=f"skill_{skill}",
-                            type="primary" if skill in st.session_state.skills_selected else "secondary"
-                        ):
-                            if skill in st.session_state.skills_selected:
-                                st.session_state.skills_selected.remove(skill)
-                            else:
-                                st.session_state.skills_selected.append(skill)
-                            st.rerun()
-                
-                st.write(f"Selected: {len(st.session_state.skills_selected)} skills")
-                
-                if len(st.session_state.skills_selected) >= 5:
-                    if st.button("✅ Add These Skills", type="primary"):
-                        st.session_state.conversation_step = 'skills_added'
-                        
-                        profile = st.session_state.user_profile
-                        old_completeness = profile['profile_completeness']
-                        skills_added = len(st.session_state.skills_selected)
-                        new_completeness = min(100, old_completeness + (skills_added * 3))
-                        
-                        flow_data = CONVERSATION_FLOWS['add_skill']['skills_added']
-                        message = format_message(
-                            flow_data['message'],
-                            profile,
-                            new_completeness=new_completeness,
-                            improvement=new_completeness - old_completeness,
-                            old_skills=profile['unique_skills_added'],
-                            new_skills=profile['unique_skills_added'] + skills_added,
-                            skills_added=skills_added
-                        )
-                        add_message('assistant', message)
-                        st.rerun()
-            else:
-                # Regular buttons
-                cols = st.columns(len(step['buttons']))
-                for i, button_text in enumerate(step['buttons']):
-                    with cols[i]:
-                        if st.button(button_text, key=f"btn_{i}"):
-                            handle_user_response(button_text)
-                            st.rerun()
-    
-    # Show welcome message if no conversation started
-    if not st.session_state.messages:
-        with st.chat_message("assistant"):
-            st.markdown(f"""
-            👋 Hi {st.session_state.user_profile['name']}! I'm **Rafiq**, your AI career assistant.
-            
-            I analyze your job search activity to help you get more employer attention and land interviews faster.
-            
-            Click one of the buttons in the sidebar to see how I can help you today!
-            """)
+    if st.session_state.get('what_if'):
+        what_if_panel()
+    chat_panel()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        # Runs on st.rerun() too, which stops the script with an exception
+        save_session()
\ No newline at end of file
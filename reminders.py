@@ -0,0 +1,220 @@
+"""
+Persistent scheduler for reminders ("remind me next week").
+
+Reminders are kept on disk, bucketed by due time into slots of
+slot_seconds. Each slot has up to two append-only files:
+
+    <slot>.jsonl     reminders due in the slot, one JSON line each
+    <slot>.cancel    ids of the slot's reminders that were cancelled
+
+schedule() and cancel() are a single append each. A reminder's id starts
+with its slot, so cancelling needs no lookup. Memory holds only a min-heap
+of the slots that have reminders pending, whatever their number.
+
+A slot fires once its whole interval has passed, so a reminder goes out at
+most slot_seconds late. The slot's file is read in order from a cursor
+(slot and byte offset), one batch at a time, and the cursor is saved after
+each batch has been handed over. Fired slots are deleted. A restart lists
+the directory to rebuild the heap and resumes from the saved cursor; no
+reminder is read before its slot is due. Delivery is at least once: a batch
+that was being fired when the process died is fired again.
+
+One process owns a directory, and slot_seconds must not change for it.
+
+    scheduler = ReminderScheduler('reminders/')
+    reminder_id = scheduler.schedule(due, session_id='0.abc', flow='refresh_cv')
+    scheduler.cancel(reminder_id)
+    scheduler.run_due(fire_batch)
+"""
+import heapq
+import itertools
+import json
+import os
+import secrets
+import threading
+import time
+
+SLOT_SECONDS = 60
+
+# Slot files kept open for appending; most reminders land in a few slots
+MAX_OPEN_FILES = 64
+
+_CURSOR = 'cursor.json'
+
+
+class ReminderScheduler:
+    """Reminders persisted in a directory, fired in due-slot order"""
+
+    def __init__(self, directory, slot_seconds=SLOT_SECONDS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.slot_seconds = slot_seconds
+        self._lock = threading.Lock()
+        self._fire_lock = threading.Lock()
+        self._fds = {}              # path -> fd open for appending
+        self._ids = itertools.count()
+        self._id_prefix = secrets.token_hex(4)
+
+        self._pending = {int(name[:-len('.jsonl')]) for name in os.listdir(directory)
+                         if name.endswith('.jsonl')}
+        self._heap = list(self._pending)    # may hold slots no longer pending
+        heapq.heapify(self._heap)
+        self._cursor = (None, 0)
+        self._cancelled = None      # cancelled ids of the cursor's slot
+        try:
+            with open(os.path.join(directory, _CURSOR)) as f:
+                saved = json.load(f)
+            if saved['slot'] in self._pending:
+                self._cursor = (saved['slot'], saved['offset'])
+        except FileNotFoundError:
+            pass
+
+    def _path(self, slot, suffix):
+        return os.path.join(self.directory, f'{slot}{suffix}')
+
+    def _append(self, path, data):
+        fd = self._fds.get(path)
+        if fd is None:
+            if len(self._fds) >= MAX_OPEN_FILES:
+                self._close_files()
+            fd = self._fds[path] = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        while data:
+            data = data[os.write(fd, data):]
+
+    def _close_files(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+    def _add_slot(self, slot):
+        if slot not in self._pending:
+            self._pending.add(slot)
+            heapq.heappush(self._heap, slot)
+
+    def _record(self, due, fields):
+        slot = int(due // self.slot_seconds)
+        reminder_id = f'{slot}.{self._id_prefix}{next(self._ids):x}'
+        line = json.dumps(dict(fields, id=reminder_id, due=due), separators=(',', ':')) + '\n'
+        return slot, reminder_id, line.encode('utf-8')
+
+    def schedule(self, due, **fields):
+        """Add a reminder due at timestamp due; returns its id"""
+        slot, reminder_id, line = self._record(due, fields)
+        with self._lock:
+            self._append(self._path(slot, '.jsonl'), line)
+            self._add_slot(slot)
+        return reminder_id
+
+    def schedule_many(self, reminders):
+        """Add (due, fields) pairs with one write per slot; returns their ids"""
+        by_slot, ids = {}, []
+        for due, fields in reminders:
+            slot, reminder_id, line = self._record(due, fields)
+            by_slot.setdefault(slot, []).append(line)
+            ids.append(reminder_id)
+        with self._lock:
+            for slot, lines in by_slot.items():
+                self._append(self._path(slot, '.jsonl'), b''.join(lines))
+                self._add_slot(slot)
+        return ids
+
+    def cancel(self, reminder_id):
+        """Cancel a reminder; False if its slot has already fired"""
+        slot = int(reminder_id.split('.', 1)[0])
+        with self._lock:
+            if slot not in self._pending:
+                return False
+            self._append(self._path(slot, '.cancel'), reminder_id.encode('utf-8') + b'\n')
+            if self._cursor[0] == slot and self._cancelled is not None:
+                self._cancelled.add(reminder_id)
+            return True
+
+    def next_due(self):
+        """When the earliest pending slot fires, or None if nothing is pending"""
+        with self._lock:
+            slots = [s for s in (self._cursor[0], self._first_slot()) if s is not None]
+        return (min(slots) + 1) * self.slot_seconds if slots else None
+
+    def _first_slot(self):
+        while self._heap and self._heap[0] not in self._pending:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def _next_batch(self, now, batch_size):
+        """(slot, end offset, reminders) of the next due batch, or None"""
+        while True:
+            slot, offset = self._cursor
+            if slot is None:
+                slot = self._first_slot()
+                if slot is None or (slot + 1) * self.slot_seconds > now:
+                    return None
+                heapq.heappop(self._heap)
+                self._cursor = (slot, 0)
+                self._cancelled = None
+            if self._cancelled is None:
+                try:
+                    with open(self._path(slot, '.cancel'), 'rb') as f:
+                        self._cancelled = {line.strip().decode('utf-8') for line in f}
+                except FileNotFoundError:
+                    self._cancelled = set()
+
+            reminders, end = [], offset
+            with open(self._path(slot, '.jsonl'), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break       # torn by a crash; dropped with the slot
+                    end += len(line)
+                    reminders.append(json.loads(line))
+                    if len(reminders) == batch_size:
+                        break
+            if end > offset:
+                return slot, end, [r for r in reminders if r['id'] not in self._cancelled]
+            self._finish(slot)
+
+    def _finish(self, slot):
+        for suffix in ('.jsonl', '.cancel'):
+            path = self._path(slot, suffix)
+            fd = self._fds.pop(path, None)
+            if fd is not None:
+                os.close(fd)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._pending.discard(slot)
+        self._cancelled = None
+        self._save_cursor(None, 0)
+
+    def _save_cursor(self, slot, offset):
+        self._cursor = (slot, offset)
+        path = os.path.join(self.directory, _CURSOR)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'slot': slot, 'offset': offset}, f)
+        os.replace(path + '.tmp', path)
+
+    def run_due(self, fire, now=None, batch_size=1000, max_batches=None):
+        """
+        Call fire(reminders) for batches of up to batch_size reminders from
+        slots due by now. Returns how many reminders were fired.
+        """
+        now = time.time() if now is None else now
+        fired = batches = 0
+        with self._fire_lock:
+            while max_batches is None or batches < max_batches:
+                with self._lock:
+                    batch = self._next_batch(now, batch_size)
+                if batch is None:
+                    break
+                slot, end, reminders = batch
+                if reminders:
+                    fire(reminders)
+                with self._lock:
+                    self._save_cursor(slot, end)
+                fired += len(reminders)
+                batches += 1
+        return fired
+
+    def close(self):
+        with self._lock:
+            self._close_files()
@@ -0,0 +1,84 @@
+"""
+Streaming assistant replies.
+
+The engine no longer writes an assistant turn straight into the history.
+It queues a pending reply: the step the conversation reached and a draft,
+the step's rendered message. A reply producer then turns the pending
+reply into the text the user sees, as an iterator of chunks:
+
+    producer(session, reply) -> iterable of str
+
+'template' yields the draft whole, which is what the templated flows have
+always shown. 'simulated' stands in for a generation backend in tests and
+demos: it waits before the first chunk, then yields the draft a few words
+at a time. A generated-response backend plugs in as another producer.
+
+stream() hands the chunks on as they arrive and calls on_complete(text)
+only once the producer is exhausted, so a reply cut short (the page
+reran, the client went away) never reaches the history. It records time
+to first chunk, counted from when the reply was queued, and total time
+per reply as the reply_first_chunk and reply_total histograms.
+"""
+import random
+import re
+import time
+
+import metrics
+
+PRODUCERS = ('template', 'simulated')
+
+# Words and the whitespace after them, so chunks join back to the draft
+_WORDS = re.compile(r'\S+\s*|\s+')
+
+
+def template_producer(session, reply):
+    """The rendered step message, in one chunk"""
+    yield reply['draft']
+
+
+class SimulatedProducer:
+    """
+    Local stand-in for a generation backend: first_chunk_delay seconds of
+    "thinking", then words_per_chunk words every chunk_delay seconds, with
+    some jitter. The text is the draft, unchanged.
+    """
+
+    def __init__(self, first_chunk_delay=0.8, chunk_delay=0.03, words_per_chunk=3, seed=None):
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.words_per_chunk = words_per_chunk
+        self._random = random.Random(seed)
+
+    def __call__(self, session, reply):
+        words = _WORDS.findall(reply['draft'])
+        time.sleep(self.first_chunk_delay)
+        for i in range(0, len(words), self.words_per_chunk):
+            if i:
+                time.sleep(self.chunk_delay * self._random.uniform(0.5, 1.5))
+            yield ''.join(words[i:i + self.words_per_chunk])
+
+
+def load_producer(name='template'):
+    """A reply producer by name, one of PRODUCERS"""
+    if name == 'template':
+        return template_producer
+    if name == 'simulated':
+        return SimulatedProducer()
+    raise ValueError(f"Unknown reply producer {name!r}; choose from {PRODUCERS}")
+
+
+def stream(producer, session, reply, on_complete):
+    """
+    Yield the producer's chunks for reply, then call on_complete with the
+    whole text. Closing the generator early skips on_complete.
+    """
+    chunks = []
+    for chunk in producer(session, reply):
+        if not chunk:
+            continue
+        if not chunks:
+            metrics.observe('reply_first_chunk', time.time() - reply['queued'])
+        chunks.append(chunk)
+        yield chunk
+    metrics.observe('reply_total', time.time() - reply['queued'])
+    on_complete(''.join(chunks))
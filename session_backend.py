@@ -0,0 +1,279 @@
+"""
+Persistent conversation sessions.
+
+A session is stored field by field (profile, user id, owner, messages,
+flow, step, prediction, selected skills, job matches, served nudge,
+reminder, catalog version, pending reply), each encoded on its own: the
+chat history in ChatHistory's binary format, text fields as UTF-8 and the
+rest as JSON without whitespace. After a request only the fields whose
+value changed are written, so a button click rewrites a few bytes of
+flow/step and the history, not the whole session.
+
+SessionStore keeps recently used sessions in memory and drops them after
+`ttl` seconds idle; the next request for an evicted session restores it
+from the backend. Resident memory therefore tracks active sessions, not
+every session ever created.
+"""
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from chat_history import ChatHistory
+
+
+def _encode_json(value):
+    return b'' if value is None else json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def _decode_json(data):
+    return json.loads(data) if data else None
+
+
+def _encode_text(value):
+    return b'' if value is None else value.encode('utf-8')
+
+
+def _decode_text(data):
+    return data.decode('utf-8') if data else None
+
+
+# Session attribute -> (encode, decode)
+FIELD_CODECS = {
+    'user_profile': (lambda p: _encode_json(None if p is None else dict(p)), _decode_json),
+    'user_id': (_encode_text, _decode_text),
+    'owner': (_encode_text, _decode_text),
+    'messages': (ChatHistory.to_bytes, ChatHistory.from_bytes),
+    'conversation_flow': (_encode_text, _decode_text),
+    'conversation_step': (_encode_text, _decode_text),
+    'ml_prediction': (_encode_json, _decode_json),
+    'skills_selected': (_encode_json, lambda data: _decode_json(data) or []),
+    'job_matches': (_encode_json, lambda data: _decode_json(data) or []),
+    'job_selected': (_encode_json, _decode_json),
+    'jobs_applied': (_encode_json, lambda data: _decode_json(data) or []),
+    'served': (_encode_json, _decode_json),
+    'reminder': (_encode_json, _decode_json),
+    'catalog': (_encode_text, _decode_text),
+    'pending_reply': (_encode_json, _decode_json)
+}
+
+
+def fingerprint(field, value):
+    """
+    Cheap marker that changes whenever the field's value does. The chat
+    history carries a revision counter, so it is never encoded just to find
+    out it is unchanged.
+    """
+    if field == 'messages':
+        return (id(value), value.revision)
+    return FIELD_CODECS[field][0](value)
+
+
+class SessionBackend(ABC):
+    """Where sessions are persisted: session id -> {field: bytes}"""
+
+    @abstractmethod
+    def load(self, session_id):
+        """All stored fields of a session, or None if it is unknown"""
+
+    @abstractmethod
+    def save(self, session_id, fields):
+        """Write the given fields, leaving the others untouched"""
+
+    @abstractmethod
+    def delete(self, session_id):
+        """Forget a session"""
+
+    @abstractmethod
+    def purge(self, older_than):
+        """Delete sessions not written for older_than seconds"""
+
+    @abstractmethod
+    def field_values(self, field):
+        """Distinct stored values of one field across all sessions, encoded"""
+
+
+class MemorySessionBackend(SessionBackend):
+    """Keeps encoded sessions in a dict; nothing survives a restart"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._updated = {}
+
+    def load(self, session_id):
+        fields = self._sessions.get(session_id)
+        return dict(fields) if fields is not None else None
+
+    def save(self, session_id, fields):
+        self._sessions.setdefault(session_id, {}).update(fields)
+        self._updated[session_id] = time.time()
+
+    def delete(self, session_id):
+        self._sessions.pop(session_id, None)
+        self._updated.pop(session_id, None)
+
+    def purge(self, older_than):
+        cutoff = time.time() - older_than
+        for session_id in [s for s, t in self._updated.items() if t < cutoff]:
+            self.delete(session_id)
+
+    def field_values(self, field):
+        return {fields[field] for fields in self._sessions.values() if field in fields}
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """One row per (session, field) in a local SQLite file"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS session_fields ("
+                " session_id TEXT NOT NULL, field TEXT NOT NULL, value BLOB NOT NULL,"
+                " PRIMARY KEY (session_id, field)) WITHOUT ROWID")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY, updated REAL NOT NULL) WITHOUT ROWID")
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+
+    def load(self, session_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT field, value FROM session_fields WHERE session_id = ?",
+                (session_id,)).fetchall()
+        return {field: bytes(value) for field, value in rows} if rows else None
+
+    def save(self, session_id, fields):
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO session_fields VALUES (?, ?, ?)",
+                    [(session_id, field, value) for field, value in fields.items()])
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?)", (session_id, time.time()))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete(self, session_id):
+        with self._lock:
+            self._db.execute("DELETE FROM session_fields WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge(self, older_than):
+        cutoff = time.time() - older_than
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM session_fields WHERE session_id IN"
+                " (SELECT session_id FROM sessions WHERE updated < ?)", (cutoff,))
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (cutoff,))
+
+    def field_values(self, field):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT value FROM session_fields WHERE field = ?", (field,)).fetchall()
+        return {bytes(value) for value, in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SessionStore:
+    """
+    Resident sessions in front of a backend. new_session() builds an empty
+    session object whose FIELD_CODECS attributes get filled in on restore.
+    """
+
+    def __init__(self, backend, new_session, ttl=1800):
+        self.backend = backend
+        self.new_session = new_session
+        self.ttl = ttl
+        self._resident = {}     # session id -> [session, last access]
+        self._saved = {}        # session id -> {field: fingerprint}
+        self._lock = threading.RLock()
+
+    def add(self, session_id, session):
+        """Register a new session and persist it in full"""
+        with self._lock:
+            self._resident[session_id] = [session, time.monotonic()]
+            self._saved[session_id] = {}
+        self.commit(session_id)
+
+    def get(self, session_id):
+        """Resident session, restored from the backend if it was evicted"""
+        with self._lock:
+            entry = self._resident.get(session_id)
+            if entry is not None:
+                entry[1] = time.monotonic()
+                return entry[0]
+
+        fields = self.backend.load(session_id)
+        if fields is None:
+            raise KeyError(session_id)
+        session = self.new_session()
+        saved = {}
+        for field, (_, decode) in FIELD_CODECS.items():
+            if field in fields:
+                setattr(session, field, decode(fields[field]))
+            saved[field] = fingerprint(field, getattr(session, field))
+
+        with self._lock:
+            # Another thread may have restored it meanwhile; keep theirs
+            entry = self._resident.setdefault(session_id, [session, time.monotonic()])
+            if entry[0] is session:
+                self._saved[session_id] = saved
+            return entry[0]
+
+    def __contains__(self, session_id):
+        with self._lock:
+            if session_id in self._resident:
+                return True
+        return self.backend.load(session_id) is not None
+
+    def commit(self, session_id):
+        """Write the fields that changed since the last commit; returns how many"""
+        with self._lock:
+            entry = self._resident.get(session_id)
+            if entry is None:
+                return 0
+            session = entry[0]
+            saved = self._saved[session_id]
+            changed = {}
+            for field, (encode, _) in FIELD_CODECS.items():
+                value = getattr(session, field)
+                marker = fingerprint(field, value)
+                if saved.get(field) != marker:
+                    changed[field] = marker if isinstance(marker, bytes) else encode(value)
+                    saved[field] = marker
+            if changed:
+                self.backend.save(session_id, changed)
+            return len(changed)
+
+    def evict_idle(self):
+        """Drop sessions idle for longer than ttl (they stay in the backend)"""
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            idle = [sid for sid, (_, last) in self._resident.items() if last < cutoff]
+            for session_id in idle:
+                self.commit(session_id)
+                del self._resident[session_id]
+                del self._saved[session_id]
+        return len(idle)
+
+    def field_values(self, field):
+        """Distinct values of a hashable field across resident and stored sessions"""
+        with self._lock:
+            values = {getattr(session, field) for session, _ in self._resident.values()}
+        decode = FIELD_CODECS[field][1]
+        values.update(decode(value) for value in self.backend.field_values(field))
+        return values
+
+    def __len__(self):
+        return len(self._resident)
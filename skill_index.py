@@ -0,0 +1,184 @@
+"""
+Trending skills per industry, built from job postings.
+
+Each posting adds a weight to every skill it asks for, in its industry and
+in the all-industries bucket. Weights decay with a half-life, so a skill
+asked for by last week's postings outranks one that was popular last year.
+The decay uses a fixed landmark (forward decay): a posting at time t weighs
+2 ** ((t - landmark) / half_life). Newer postings weigh more, so existing
+counts never need rescaling as time passes and the ranking between two
+skills only changes when one of them gets a new posting.
+
+Because scores only ever grow, each industry keeps its leading candidates
+in a min-heap: a bumped skill either is already a candidate or displaces
+the weakest one. The ranked candidate list is rebuilt only after a change,
+so rendering the skill grid is a dictionary lookup and a short scan.
+
+Postings are JSON lines, appended as they arrive:
+
+    {"industry": "Finance", "skills": ["Excel", "SQL"], "posted": 1760000000}
+"""
+import heapq
+import json
+import os
+
+# Bucket every posting also counts towards, for unknown or thin industries
+ALL_INDUSTRIES = '*'
+
+# Decay half-life of a posting, in days
+HALF_LIFE_DAYS = 30
+
+# Ranked candidates kept per industry; more than are ever shown, so skills
+# the user already has can be skipped without a full scan
+CANDIDATES = 32
+
+# Past this exponent the landmark moves forward and all scores are rescaled
+_MAX_EXPONENT = 512
+
+
+class _TopSkills:
+    """Scores of one industry, with its `size` best skills kept in a heap"""
+
+    def __init__(self, size):
+        self.size = size
+        self.scores = {}        # skill -> decayed count
+        self.top = {}           # candidate skill -> score
+        self._heap = []         # (score, skill); entries go stale as scores grow
+        self._ranked = None
+
+    def bump(self, skill, weight):
+        score = self.scores.get(skill, 0.0) + weight
+        self.scores[skill] = score
+        if skill not in self.top and len(self.top) >= self.size:
+            floor_score, floor_skill = self._floor()
+            if score <= floor_score:
+                return
+            heapq.heappop(self._heap)
+            del self.top[floor_skill]
+        self.top[skill] = score
+        heapq.heappush(self._heap, (score, skill))
+        if len(self._heap) > 4 * self.size:
+            self._rebuild()
+        self._ranked = None
+
+    def _floor(self):
+        """The weakest candidate, dropping stale heap entries on the way"""
+        while self.top.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0]
+
+    def _rebuild(self):
+        self._heap = [(score, skill) for skill, score in self.top.items()]
+        heapq.heapify(self._heap)
+
+    def rescale(self, factor):
+        self.scores = {skill: score * factor for skill, score in self.scores.items()}
+        self.top = {skill: score * factor for skill, score in self.top.items()}
+        self._rebuild()
+
+    def ranked(self):
+        """Candidates, best first (ties broken by name)"""
+        if self._ranked is None:
+            self._ranked = tuple(sorted(self.top, key=lambda s: (-self.top[s], s)))
+        return self._ranked
+
+
+class SkillIndex:
+    """Decayed skill counts per industry with top-k lookups"""
+
+    def __init__(self, half_life_days=HALF_LIFE_DAYS, candidates=CANDIDATES):
+        self.half_life = half_life_days * 86400.0
+        self.candidates = candidates
+        self.landmark = None
+        self.postings = 0
+        self._industries = {}
+        self._path = None
+        self._offset = 0
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Index a postings file; refresh() picks up lines appended later"""
+        index = cls(**kwargs)
+        index._path = path
+        index.refresh()
+        return index
+
+    def add_posting(self, industry, skills, posted):
+        """Count one posting's skills (duplicates within a posting count once)"""
+        if self.landmark is None:
+            self.landmark = posted
+        exponent = (posted - self.landmark) / self.half_life
+        if exponent > _MAX_EXPONENT:
+            self._move_landmark(posted)
+            exponent = 0.0
+        weight = 2.0 ** exponent
+
+        for bucket in (industry, ALL_INDUSTRIES):
+            top = self._industries.get(bucket)
+            if top is None:
+                top = self._industries[bucket] = _TopSkills(self.candidates)
+            for skill in dict.fromkeys(skills):
+                top.bump(skill, weight)
+        self.postings += 1
+
+    def _move_landmark(self, landmark):
+        factor = 2.0 ** -((landmark - self.landmark) / self.half_life)
+        for top in self._industries.values():
+            top.rescale(factor)
+        self.landmark = landmark
+
+    def refresh(self):
+        """Index complete lines appended to the postings file since the last call"""
+        if self._path is None:
+            return 0
+        try:
+            if os.path.getsize(self._path) <= self._offset:
+                return 0
+        except FileNotFoundError:
+            return 0
+        added = 0
+        with open(self._path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break       # still being written; read it next time
+                self._offset += len(line)
+                if line.strip():
+                    posting = json.loads(line)
+                    self.add_posting(posting['industry'], posting['skills'], posting['posted'])
+                    added += 1
+        return added
+
+    @property
+    def industries(self):
+        return [name for name in self._industries if name != ALL_INDUSTRIES]
+
+    def score(self, industry, skill, now):
+        """Decayed number of postings asking for skill, as of now"""
+        top = self._industries.get(industry)
+        if top is None or self.landmark is None:
+            return 0.0
+        return top.scores.get(skill, 0.0) * 2.0 ** -((now - self.landmark) / self.half_life)
+
+    def top_skills(self, industry, k=8, exclude=()):
+        """
+        The k most in-demand skills for industry, skipping those in exclude.
+        Industries with too few postings are topped up from all industries.
+        """
+        exclude = set(exclude)
+        skills = []
+        for bucket in (industry, ALL_INDUSTRIES):
+            top = self._industries.get(bucket)
+            if top is None:
+                continue
+            ranked = top.ranked()
+            if len(ranked) < len(top.scores) and len(exclude) > len(ranked) - k:
+                # Exclusions could eat into the candidates: rank everything
+                ranked = heapq.nsmallest(len(exclude) + k, top.scores,
+                                         key=lambda s: (-top.scores[s], s))
+            for skill in ranked:
+                if skill not in exclude and skill not in skills:
+                    skills.append(skill)
+                    if len(skills) == k:
+                        return skills
+        return skills
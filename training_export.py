@@ -0,0 +1,379 @@
+"""
+Point-in-time training rows for the nudge model.
+
+Every served nudge (a 'served' line in the outcome log) becomes one row:
+the model features as they were just before it was served, and whether
+it was completed within `horizon` seconds. Features are rebuilt by
+replaying the activity events through FeatureAggregator, so a row only
+sees events logged before its serve. profile_completeness has no events
+behind it and is read from the profile store as it is today, so that one
+column is not point in time.
+
+days_since_last_refresh spans a user's whole history, but the replay
+only sees the logs: by default a user's history starts at their first
+logged record, so long-standing users' rows are off. With --baseline
+STORE, a profile store snapshotted just before the logs begin, the users
+it knows start from its lifetime counts instead. Today's store can't
+stand in for it, since it already counts the events being replayed.
+
+Inputs are append-only JSONL files: activity events (see
+feature_aggregator.py) and outcome logs, whose lines must carry user ids.
+Each run reads only what was appended since the last one, so a daily run
+adds that day's rows instead of rebuilding:
+
+ 1. Spool. New lines are streamed through once and appended, unparsed
+    beyond their user id, to one spool file per user-id shard.
+ 2. Export. A process pool takes one shard at a time. It loads the
+    shard's state: its users' feature aggregator and the serves whose
+    outcome window is still open. It replays the spooled records in time
+    order and writes the rows whose window has closed by the newest
+    timestamp read, as chunked .npz column files.
+
+Memory per worker is one shard's state plus its share of one run, so pick
+--shards to fit. Late records are applied when they arrive, not
+retroactively, and an outcome logged after its row was written is lost.
+
+OUTPUT/state.json holds the byte offset reached in every input. A run
+writes the offsets it is about to reach before it starts. If it dies,
+running the same command again redoes that run and skips the shards that
+had finished it.
+
+    python training_export.py training/ --events events.jsonl --outcomes outcomes.jsonl \\
+        --shards 64 --workers 8
+
+read_rows(OUTPUT) yields the rows back a chunk at a time, as columns.
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from hashlib import blake2b
+
+import numpy as np
+
+from feature_aggregator import DAY_SECONDS, FeatureAggregator
+from profile_store import ProfileStore
+from rafiq_core import MODEL_FEATURES, open_profile_store
+
+SERVE_COLUMNS = ('id', 'user_id', 'ts', 'nudge', 'confidence')
+LABEL_COLUMNS = ('completed', 'completed_after')
+COLUMNS = SERVE_COLUMNS + MODEL_FEATURES + LABEL_COLUMNS
+
+# The outcome that labels a row, logged when a flow reaches its goal
+LABEL_OUTCOME = 'completed'
+
+DEFAULT_HORIZON = 7 * DAY_SECONDS
+
+# Bump when state.json or the shard state changes shape, or the features
+# change meaning (2: 7-day login and search windows)
+_STATE_VERSION = 2
+
+
+def shard_of(user_id, shards):
+    return int.from_bytes(blake2b(user_id.encode('utf-8'), digest_size=8).digest(), 'little') % shards
+
+
+def _atomic_write(path, write):
+    """Call write(f) on a temporary file, then move it over path"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(path, state):
+    _atomic_write(path, lambda f: f.write(json.dumps(state, indent=2).encode('utf-8')))
+
+
+def new_lines(path, start, end):
+    """
+    Complete lines of path between byte offsets start and end, with the
+    offset after each; a line cut off by end is left for the next run
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        for line in f:
+            position += len(line)
+            if position > end or not line.endswith(b'\n'):
+                return
+            yield position, line
+
+
+def spool(ends, offsets, spool_dir, shards):
+    """
+    Append the new lines of every input to its user's shard spool.
+    Returns (offsets reached, newest ts, lines without a user id).
+    """
+    os.makedirs(spool_dir, exist_ok=True)
+    files = [open(os.path.join(spool_dir, f'shard-{shard:03d}.jsonl'), 'wb') for shard in range(shards)]
+    reached, newest, skipped = {}, None, 0
+    try:
+        for path, end in ends.items():
+            reached[path] = offsets.get(path, 0)
+            for position, line in new_lines(path, reached[path], end):
+                reached[path] = position
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                user_id = record.get('user_id')
+                if not isinstance(user_id, str):
+                    skipped += 1
+                    continue
+                newest = record['ts'] if newest is None else max(newest, record['ts'])
+                files[shard_of(user_id, shards)].write(line)
+    finally:
+        for f in files:
+            f.close()
+    return reached, newest, skipped
+
+
+@lru_cache(maxsize=None)
+def _profiles():
+    return open_profile_store()
+
+
+@lru_cache(maxsize=None)
+def _baseline(path):
+    return ProfileStore(path)
+
+
+def _start_users(aggregator, records, baseline):
+    """
+    Add the users first seen in records (in time order), starting from the
+    baseline store's lifetime counts for those it knows
+    """
+    store = _baseline(baseline) if baseline else None
+    for record in records:
+        user_id = record['user_id']
+        if user_id in aggregator:
+            continue
+        if store is not None and user_id in store:
+            aggregator.seed(user_id, store[user_id], record['ts'])
+        else:
+            aggregator.add_user(user_id, record['ts'])
+
+
+def _snapshot(aggregator, serves, pending, baseline=None):
+    """Record each serve's features as of its serving time"""
+    profiles = _profiles()
+    _start_users(aggregator, serves, baseline)
+    # Windowed counts are kept per day, so serves are read a day at a time
+    by_day = {}
+    for serve in serves:
+        by_day.setdefault(int(serve['ts'] // DAY_SECONDS), []).append(serve)
+    for day, group in sorted(by_day.items()):
+        derived = aggregator.feature_columns([s['user_id'] for s in group], day * DAY_SECONDS)
+        for i, serve in enumerate(group):
+            user_id = serve['user_id']
+            # -1 where the profile store doesn't know the user
+            features = tuple(
+                int(derived[f][i]) if f in derived
+                else profiles[user_id][f] if user_id in profiles else -1
+                for f in MODEL_FEATURES
+            )
+            pending[serve['id']] = {
+                **{c: serve[c] for c in SERVE_COLUMNS},
+                'features': features,
+                'completed_after': None
+            }
+
+
+def _label(pending, outcome, horizon):
+    serve = pending.get(outcome['id'])
+    if serve is None or outcome.get('outcome') != LABEL_OUTCOME or not outcome.get('hit'):
+        return
+    after = outcome['ts'] - serve['ts']
+    if after <= horizon and (serve['completed_after'] is None or after < serve['completed_after']):
+        serve['completed_after'] = after
+
+
+def write_rows(directory, shard, rows, chunk_size):
+    """Write rows as chunk_size-row .npz files of COLUMNS"""
+    os.makedirs(directory, exist_ok=True)
+    for part, start in enumerate(range(0, len(rows), chunk_size)):
+        chunk = rows[start:start + chunk_size]
+        features = np.asarray([r['features'] for r in chunk], dtype=np.int64).reshape(len(chunk), -1)
+        after = np.asarray([np.nan if r['completed_after'] is None else r['completed_after']
+                            for r in chunk], dtype=np.float64)
+        columns = {
+            'id': np.asarray([r['id'] for r in chunk], dtype=str),
+            'user_id': np.asarray([r['user_id'] for r in chunk], dtype=str),
+            'ts': np.asarray([r['ts'] for r in chunk], dtype=np.float64),
+            'nudge': np.asarray([r['nudge'] for r in chunk], dtype=str),
+            'confidence': np.asarray([r['confidence'] for r in chunk], dtype=np.float64),
+            **{f: features[:, i] for i, f in enumerate(MODEL_FEATURES)},
+            'completed': ~np.isnan(after),
+            'completed_after': after
+        }
+        path = os.path.join(directory, f'shard-{shard:03d}.{part:05d}.npz')
+        _atomic_write(path, lambda f: np.savez(f, **columns))
+
+
+def export_shard(output, shard, run, watermark, horizon, chunk_size, baseline=None):
+    """
+    Apply one run's spooled records to a shard and write the rows they
+    close. Returns the number of rows written.
+    """
+    state_path = os.path.join(output, 'shards', f'shard-{shard:03d}.pkl')
+    try:
+        with open(state_path, 'rb') as f:
+            state = pickle.load(f)
+    except FileNotFoundError:
+        state = {'version': _STATE_VERSION, 'run': 0, 'aggregator': FeatureAggregator(), 'pending': {}}
+    if state.get('version') != _STATE_VERSION:
+        raise ValueError(f"{state_path} was saved by an older version; export to a new directory")
+    if state['run'] >= run:
+        return 0    # finished before the run was interrupted
+
+    with open(os.path.join(output, 'spool', f'shard-{shard:03d}.jsonl'), 'rb') as f:
+        records = [json.loads(line) for line in f]
+    # A serve sorts before events with its timestamp, so it only sees earlier ones
+    records.sort(key=lambda r: (r['ts'], r.get('kind') != 'served'))
+
+    aggregator, pending = state['aggregator'], state['pending']
+    events, serves = [], []
+
+    def ingest(events):
+        _start_users(aggregator, events, baseline)
+        aggregator.ingest(events)
+
+    for record in records:
+        kind = record.get('kind')
+        if kind == 'served':
+            if events:
+                ingest(events)
+                events = []
+            serves.append(record)
+            continue
+        if serves:
+            _snapshot(aggregator, serves, pending, baseline)
+            serves = []
+        if kind is None:
+            events.append(record)
+        elif kind == 'outcome':
+            _label(pending, record, horizon)
+    if serves:
+        _snapshot(aggregator, serves, pending, baseline)
+    if events:
+        ingest(events)
+
+    closed = [] if watermark is None else sorted(
+        (serve for serve in pending.values() if serve['ts'] + horizon <= watermark),
+        key=lambda serve: (serve['ts'], serve['id']))
+    for serve in closed:
+        del pending[serve['id']]
+    write_rows(os.path.join(output, 'rows', f'run-{run:05d}'), shard, closed, chunk_size)
+
+    state['run'] = run
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    _atomic_write(state_path, lambda f: pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL))
+    return len(closed)
+
+
+def run_export(output, inputs, shards=16, workers=1, horizon=DEFAULT_HORIZON, chunk_size=65536,
+               baseline=None):
+    """
+    Run (or resume) one incremental export over the inputs' new lines,
+    seeding new users from the baseline profile store if one is given.
+    Returns (run number, rows written, lines skipped for lack of a user id).
+    """
+    os.makedirs(output, exist_ok=True)
+    state_path = os.path.join(output, 'state.json')
+    state = load_state(state_path) or {
+        'version': _STATE_VERSION,
+        'shards': shards,
+        'horizon': horizon,
+        'run': 0,
+        'offsets': {},
+        'watermark': None,
+        'baseline': baseline and os.path.abspath(baseline)
+    }
+    if state['version'] != _STATE_VERSION:
+        raise ValueError(f"{output} was exported by an older version; export to a new directory")
+    if (state['shards'], state['horizon']) != (shards, horizon):
+        raise ValueError(f"{output} was exported with {state['shards']} shards and a "
+                         f"{state['horizon']}s horizon; export to a new directory to change them")
+    if state.get('baseline') != (baseline and os.path.abspath(baseline)):
+        raise ValueError(f"{output} was exported with baseline {state.get('baseline')}; "
+                         "export to a new directory to change it")
+
+    pending = state.get('pending')
+    if pending is None:
+        pending = state['pending'] = {
+            'run': state['run'] + 1,
+            'ends': {os.path.abspath(p): os.path.getsize(p) for p in inputs}
+        }
+        save_state(state_path, state)
+    run = pending['run']
+
+    spool_dir = os.path.join(output, 'spool')
+    offsets, newest, skipped = spool(pending['ends'], state['offsets'], spool_dir, shards)
+    watermark = max((w for w in (state['watermark'], newest) if w is not None), default=None)
+
+    export = partial(export_shard, output, run=run, watermark=watermark, horizon=horizon,
+                     chunk_size=chunk_size, baseline=state.get('baseline'))
+    if workers <= 1:
+        rows = sum(map(export, range(shards)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = sum(pool.map(export, range(shards)))
+
+    del state['pending']
+    state.update(run=run, offsets={**state['offsets'], **offsets}, watermark=watermark)
+    save_state(state_path, state)
+    shutil.rmtree(spool_dir)
+    return run, rows, skipped
+
+
+def read_rows(output):
+    """Dicts of COLUMNS, one per written chunk, in run and shard order"""
+    state = load_state(os.path.join(output, 'state.json'))
+    if state is None:
+        return
+    for run in range(1, state['run'] + 1):
+        directory = os.path.join(output, 'rows', f'run-{run:05d}')
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.npz'):
+                with np.load(os.path.join(directory, name), allow_pickle=False) as chunk:
+                    yield {column: chunk[column] for column in COLUMNS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export point-in-time training rows for served nudges")
+    parser.add_argument('output', help="directory for rows and export state")
+    parser.add_argument('--events', nargs='*', default=[], help="activity event JSONL files")
+    parser.add_argument('--outcomes', nargs='*', default=[], help="outcome log files")
+    parser.add_argument('--shards', type=int, default=16, help="user-id shards (fixed per output)")
+    parser.add_argument('--workers', type=int, default=1, help="processes exporting shards in parallel")
+    parser.add_argument('--horizon-days', type=float, default=DEFAULT_HORIZON / DAY_SECONDS,
+                        help="how long after a serve its outcome still counts")
+    parser.add_argument('--chunk-size', type=int, default=65536, help="rows per output file")
+    parser.add_argument('--baseline', help="profile store snapshotted just before the logs begin; users "
+                                           "start from its lifetime counts (fixed per output)")
+    args = parser.parse_args()
+
+    run, rows, skipped = run_export(args.output, args.events + args.outcomes, args.shards,
+                                    args.workers, args.horizon_days * DAY_SECONDS, args.chunk_size,
+                                    args.baseline)
+    print(f"Run {run}: wrote {rows:,} rows to {args.output}"
+          + (f", skipped {skipped:,} lines without a user id" if skipped else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Gradient-boosted tree ensemble inference on flat NumPy arrays.
+
+Loads an XGBoost JSON dump (Booster.get_dump(dump_format='json')) and
+flattens every tree into shared contiguous arrays, one entry per node:
+
+    feature     index into feature_names, -1 for leaves
+    threshold   split value; rows with x < threshold go to `left`
+    left/right  child node indices ("yes"/"no" in the dump)
+    missing     child taken when the feature is NaN
+    value       leaf value (0 for internal nodes)
+
+Scoring walks all trees for a whole block of rows at once, one tree level
+per step, so there are no per-node Python objects or per-row loops.
+
+The model file is either the bare list of dumped trees, or an object
+carrying the metadata the dump lacks:
+
+    {"objective": "multi:softprob",
+     "feature_names": ["days_since_last_refresh", ...],
+     "classes": ["refresh_cv", "add_skill", "apply_job"],
+     "trees": [...]}
+
+Trees are assigned to classes round-robin, as XGBoost does.
+"""
+import hashlib
+import json
+
+import numpy as np
+
+# Rows scored per block, to bound the (rows x trees) index matrix
+BLOCK_ROWS = 65536
+
+
+class TreeEnsemble:
+    """A multi-class tree ensemble flattened into contiguous arrays"""
+
+    def __init__(self, trees, feature_names, classes, objective='multi:softprob', digest=''):
+        if objective not in ('multi:softprob', 'multi:softmax'):
+            raise ValueError(f"Unsupported objective {objective!r}")
+        if not classes or not feature_names:
+            raise ValueError("The model needs class and feature names")
+        if len(trees) % len(classes):
+            raise ValueError(f"{len(trees)} trees do not divide into {len(classes)} classes")
+
+        self.feature_names = tuple(feature_names)
+        self.classes = tuple(classes)
+        self.digest = digest
+        self._feature_index = {name: i for i, name in enumerate(self.feature_names)}
+        self._flatten(trees)
+
+        # Tree t contributes to class t % n_classes
+        self.tree_class = np.arange(len(trees)) % len(self.classes)
+
+    @classmethod
+    def from_json(cls, path, feature_names=(), classes=()):
+        """
+        Load a model file. feature_names and classes are the defaults for
+        a bare dump that does not name them.
+        """
+        with open(path, 'rb') as f:
+            raw = f.read()
+        spec = json.loads(raw)
+        if isinstance(spec, list):
+            spec = {'trees': spec}
+        return cls(
+            spec['trees'],
+            spec.get('feature_names') or feature_names,
+            spec.get('classes') or classes,
+            spec.get('objective', 'multi:softprob'),
+            digest=hashlib.sha256(raw).hexdigest()[:12]
+        )
+
+    def _resolve_feature(self, split):
+        if split in self._feature_index:
+            return self._feature_index[split]
+        # Unnamed dumps refer to features as f0, f1, ...
+        if split.startswith('f') and split[1:].isdigit() and int(split[1:]) < len(self.feature_names):
+            return int(split[1:])
+        raise ValueError(f"Split on unknown feature {split!r}")
+
+    def _flatten(self, trees):
+        feature, threshold, left, right, missing, value = [], [], [], [], [], []
+        roots = []
+        max_depth = 0
+
+        for tree in trees:
+            # First pass: give every node of this tree a global index
+            index = {}
+            stack = [tree]
+            while stack:
+                node = stack.pop()
+                index[node['nodeid']] = len(index) + len(feature)
+                stack.extend(node.get('children', ()))
+            size = len(index)
+            feature.extend([-1] * size)
+            threshold.extend([0.0] * size)
+            left.extend([0] * size)
+            right.extend([0] * size)
+            missing.extend([0] * size)
+            value.extend([0.0] * size)
+            roots.append(index[tree['nodeid']])
+
+            # Second pass: fill in splits and leaves
+            stack = [(tree, 0)]
+            while stack:
+                node, depth = stack.pop()
+                i = index[node['nodeid']]
+                max_depth = max(max_depth, depth)
+                if 'leaf' in node:
+                    value[i] = node['leaf']
+                    left[i] = right[i] = missing[i] = i
+                    continue
+                feature[i] = self._resolve_feature(node['split'])
+                threshold[i] = node['split_condition']
+                left[i] = index[node['yes']]
+                right[i] = index[node['no']]
+                missing[i] = index[node.get('missing', node['yes'])]
+                stack.extend((child, depth + 1) for child in node['children'])
+
+        self.feature = np.asarray(feature, dtype=np.int32)
+        # XGBoost compares in float32
+        self.threshold = np.asarray(threshold, dtype=np.float32)
+        self.left = np.asarray(left, dtype=np.int64)
+        self.right = np.asarray(right, dtype=np.int64)
+        self.missing = np.asarray(missing, dtype=np.int64)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int64)
+        self.max_depth = max_depth
+
+    def _leaf_values(self, X):
+        """(rows, trees) leaf values for a float32 feature matrix"""
+        rows = np.arange(len(X))[:, np.newaxis]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        # Leaves point at themselves, so walking max_depth levels lands
+        # every (row, tree) pair on its leaf
+        for _ in range(self.max_depth):
+            feat = self.feature[node]
+            x = X[rows, np.maximum(feat, 0)]
+            go_left = x < self.threshold[node]
+            nxt = np.where(go_left, self.left[node], self.right[node])
+            nxt = np.where(np.isnan(x), self.missing[node], nxt)
+            node = np.where(feat < 0, node, nxt)
+        return self.value[node]
+
+    def predict_margin(self, feature_columns):
+        """(rows, classes) raw scores from named feature columns"""
+        X = np.column_stack([
+            np.asarray(feature_columns[name], dtype=np.float32) for name in self.feature_names
+        ])
+        margins = np.zeros((len(X), len(self.classes)))
+        class_onehot = np.eye(len(self.classes))[self.tree_class]
+        for start in range(0, len(X), BLOCK_ROWS):
+            block = X[start:start + BLOCK_ROWS]
+            margins[start:start + len(block)] = self._leaf_values(block) @ class_onehot
+        return margins
+
+    def predict_proba(self, feature_columns):
+        """(rows, classes) softmax probabilities"""
+        margins = self.predict_margin(feature_columns)
+        margins -= margins.max(axis=1, keepdims=True)
+        exp = np.exp(margins)
+        return exp / exp.sum(axis=1, keepdims=True)